@@ -0,0 +1,321 @@
+"""
+A fake snowflake.connector backend for benchmarks: a synthetic account of
+N roles, M users, K grants and D databases, answering the queries snowmad
+sends after a fixed per-query latency. Statements sent to a target account
+are accepted and discarded, except the ones in the account's failing set.
+Queries submitted with execute_async run for three latencies after they're submitted.
+
+    with fake_snowflake(synthetic_account(roles=1000), latency=0.005):
+        ...  # snowflake.connector.connect now returns fake connections
+"""
+
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import snowflake.connector
+from snowflake.connector.connection import SnowflakeConnection
+from snowflake.connector.constants import QueryStatus
+
+
+result_column = namedtuple('result_column', ['name'])
+
+
+class synthetic_account:
+    """ the metadata of a generated account. grants are spread over roles, users and objects """
+
+    def __init__(self, roles = 100, users = 100, grants = 1000, databases = 10, tables = 200, seed = 0):
+        rng = np.random.default_rng(seed)
+
+        self.roles = [f"ROLE_{i}" for i in range(roles)]
+        self.users = [f"USER_{i}" for i in range(users)]
+        self.databases = [f"DB_{i}" for i in range(databases)]
+        self.tables = tables
+        self.schemas = ['PUBLIC', 'STAGING']
+        self.warehouses = [("WH_XS", "X-Small"), ("WH_M", "Medium"), ("WH_L", "Large")]
+        # statements that fail when they're run
+        self.failing = set()
+
+        # a third of the grants are role -> user, a third role -> role, the rest on objects
+        n_user, n_role = grants // 3, grants // 3
+        n_object = grants - n_user - n_role
+
+        self.grants_to_users = pd.DataFrame({
+            'ROLE': rng.choice(self.roles, n_user),
+            'GRANTEE_NAME': rng.choice(self.users, n_user),
+            'CREATED_ON': pd.Timestamp('2024-01-01'),
+        })
+
+        object_types = rng.choice(['ROLE'] * 2 + ['WAREHOUSE', 'DATABASE', 'SCHEMA', 'TABLE', 'VIEW'],
+                                  n_role + n_object)
+        object_types[:n_role] = 'ROLE'
+        databases_of = rng.choice(self.databases, len(object_types))
+        names = np.where(object_types == 'ROLE', rng.choice(self.roles, len(object_types)),
+                         np.char.add('OBJ_', rng.integers(0, tables, len(object_types)).astype(str)))
+        in_schema = np.isin(object_types, ['TABLE', 'VIEW'])
+
+        self.grants_to_roles = pd.DataFrame({
+            'PRIVILEGE': np.where(object_types == 'ROLE', 'USAGE', rng.choice(['USAGE', 'SELECT', 'OWNERSHIP'],
+                                                                              len(object_types))),
+            'GRANTED_ON': object_types,
+            'NAME': names,
+            'TABLE_CATALOG': np.where(in_schema | (object_types == 'SCHEMA'), databases_of, None),
+            'TABLE_SCHEMA': np.where(in_schema, 'PUBLIC', None),
+            'GRANTEE_NAME': rng.choice(self.roles, len(object_types)),
+            'CREATED_ON': pd.Timestamp('2024-01-01'),
+        })
+
+
+    def ddl(self, database):
+        """ a get_ddl('database', ...) blob: the get_ddl('schema', ...) blobs of its schemas """
+
+        return "\n\n".join([f"create or replace database {database};"] +
+                           [self.schema_ddl(database, schema) for schema in self.schemas])
+
+
+    def schema_ddl(self, database, schema):
+        """ a get_ddl('schema', ...) blob with tables, views and a procedure. the tables are spread over the schemas """
+
+        statements = [f"create or replace schema {database}.{schema};"]
+        for i in range(self.schemas.index(schema), self.tables, len(self.schemas)):
+            statements.append(f"create or replace TABLE {database}.{schema}.OBJ_{i} (\n\tID NUMBER(38,0),"
+                              f"\n\tNAME VARCHAR(255),\n\tUPDATED_AT TIMESTAMP_NTZ(9),\n\tPAYLOAD VARIANT\n);")
+            if i % 10 == 0:
+                statements.append(f"create or replace view {database}.{schema}.V_{i} as "
+                                  f"select * from {database}.{schema}.OBJ_{i} where ID > 0;")
+        statements.append(f"create or replace procedure {database}.{schema}.P() returns varchar "
+                          "language javascript as $$ var x = 1; return 'done'; $$;")
+        return "\n\n".join(statements)
+
+
+    def result(self, sql):
+        """ (columns, rows) or a DataFrame for one query """
+
+        lowered = " ".join(sql.lower().split())
+
+        if sql in self.failing:
+            raise snowflake.connector.errors.ProgrammingError(msg=f"cannot execute {sql}", errno=2003,
+                                                              sqlstate='02000')
+
+        if lowered.startswith('show roles'):
+            return ['created_on', 'name', 'owner', 'comment'], \
+                   [(None, role, 'SECURITYADMIN', '' if i % 2 else f"comment {i}") for i, role in enumerate(self.roles)]
+
+        if lowered.startswith('show users'):
+            return ['name', 'login_name', 'comment', 'disabled', 'display_name', 'email', 'first_name', 'last_name',
+                    'default_warehouse', 'default_role', 'must_change_password'], \
+                   [(user, user.lower(), '', 'false', user, f"{user.lower()}@example.com", 'First', 'Last',
+                     'WH_XS', 'PUBLIC', 'false') for user in self.users]
+
+        match = re.match(r'show grants of role "(.*)"', lowered)
+        if match:
+            role = match.group(1).upper()
+            users = self.grants_to_users[self.grants_to_users['ROLE'] == role]['GRANTEE_NAME']
+            roles = self.grants_to_roles[(self.grants_to_roles['GRANTED_ON'] == 'ROLE') &
+                                         (self.grants_to_roles['NAME'] == role)]['GRANTEE_NAME']
+            return ['role', 'granted_to', 'grantee_name'], \
+                   [(role, 'USER', user) for user in users] + [(role, 'ROLE', grantee) for grantee in roles]
+
+        if lowered.startswith('show databases'):
+            return ['name', 'origin', 'comment', 'retention_time'], \
+                   [(database, '', None, 1) for database in self.databases] + [('SNOWFLAKE', 'SNOWFLAKE', None, 1)]
+
+        if lowered.startswith('show schemas'):
+            match = re.match(r'show schemas in database "(.*)"', lowered)
+            databases = [match.group(1).upper()] if match else self.databases
+            return ['database_name', 'name', 'comment'], \
+                   [(database, schema, None) for database in databases
+                    for schema in self.schemas + ['INFORMATION_SCHEMA']]
+
+        if lowered.startswith('show warehouses'):
+            return ['name', 'size', 'auto_suspend', 'auto_resume', 'comment'], \
+                   [(name, size, 600, 'true', None) for name, size in self.warehouses]
+
+        match = re.search(r"""get_ddl\('schema', '"(.*?)"\."(.*?)"'""", lowered)
+        if match:
+            return ['DDL'], [(self.schema_ddl(match.group(1).upper(), match.group(2).upper()),)]
+
+        match = re.search(r"get_ddl\('database', '(.*?)'", lowered)
+        if match:
+            return ['DDL'], [(self.ddl(match.group(1).upper()),)]
+
+        if 'account_usage.grants_to_users' in lowered:
+            return self.grants_to_users
+        if 'account_usage.grants_to_roles' in lowered:
+            return self.grants_to_roles
+        if 'account_usage.roles' in lowered:
+            return pd.DataFrame({'NAME': self.roles})
+        if 'account_usage.users' in lowered:
+            return pd.DataFrame({'NAME': self.users, 'LOGIN_NAME': [user.lower() for user in self.users],
+                                 'DISPLAY_NAME': self.users, 'DEFAULT_ROLE': 'PUBLIC',
+                                 'EMAIL': [f"{user.lower()}@example.com" for user in self.users]})
+        if 'last_altered' in lowered:
+            return pd.DataFrame({'NAME': self.databases, 'LAST_ALTERED': pd.Timestamp('2024-01-01')})
+
+        # create / grant / drop sent to a target account
+        return ['status'], [('Statement executed successfully.',)]
+
+
+
+class fake_cursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.sfqid = None
+        self._rows = []
+        self._frame = None
+
+
+    def execute(self, sql, num_statements = None, **kwargs):
+        time.sleep(self.connection.latency)
+        self.sfqid = self.connection._query_id()
+        self._load(self.connection.account.result(sql))
+        return self
+
+
+    def execute_async(self, sql, **kwargs):
+        time.sleep(self.connection.latency)
+        self.sfqid = self.connection._query_id()
+
+        try:
+            outcome = (self.connection.account.result(sql), None)
+        except snowflake.connector.errors.Error as error:
+            error.sfqid = self.sfqid
+            outcome = (None, error)
+        with self.connection._lock:
+            self.connection._async[self.sfqid] = (time.time() + self.connection.async_seconds,) + outcome
+        return {'queryId': self.sfqid}
+
+
+    def get_results_from_sfqid(self, sfqid):
+        self.connection.requests += 1
+        time.sleep(self.connection.latency)
+        self.sfqid = sfqid
+        self._load(self.connection._async[sfqid][1])
+
+
+    def _load(self, result):
+        if isinstance(result, pd.DataFrame):
+            self._frame = result
+            self._rows = list(result.itertuples(index=False, name=None))
+            columns = list(result.columns)
+        else:
+            self._frame = None
+            columns, self._rows = result
+
+        self.description = [(column, None, None, None, None, None, True) for column in columns]
+
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+
+    def fetchmany(self, size = 1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+    def fetch_pandas_batches(self, batch_rows = 10000):
+        # like snowflake, only query results come back as arrow, SHOW output doesn't.
+        # the error is raised on the call, not on iteration
+        if self._frame is None:
+            raise snowflake.connector.errors.NotSupportedError(msg="not an arrow result")
+
+        frame, self._frame, self._rows = self._frame, None, []
+        return (frame.iloc[i:i + batch_rows].reset_index(drop=True) for i in range(0, len(frame), batch_rows))
+
+
+    def fetch_pandas_all(self):
+        return pd.concat(list(self.fetch_pandas_batches()) or [pd.DataFrame()], ignore_index=True)
+
+
+    def describe(self, sql):
+        self.execute(sql)
+        return [result_column(col[0]) for col in self.description]
+
+
+    def close(self):
+        pass
+
+
+
+class fake_connection:
+
+    def __init__(self, account, latency = 0.0):
+        self.account = account
+        self.latency = latency
+        # queries run, and requests made for them (submits, status polls, result fetches)
+        self.queries = 0
+        self.requests = 0
+        self._async = {}
+        # how long a query submitted with execute_async runs
+        self.async_seconds = 3 * latency
+        self._lock = threading.Lock()
+        self._closed = False
+
+
+    def cursor(self):
+        return fake_cursor(self)
+
+
+    def _query_id(self):
+        with self._lock:
+            self.queries += 1
+            self.requests += 1
+            return f"fake-{self.queries}"
+
+
+    def get_query_status_throw_if_error(self, sfqid):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            done_at, _, error = self._async[sfqid]
+
+        if time.time() < done_at:
+            return QueryStatus.RUNNING
+        if error is not None:
+            raise error
+        return QueryStatus.SUCCESS
+
+
+    is_still_running = staticmethod(SnowflakeConnection.is_still_running)
+
+
+    def is_closed(self):
+        return self._closed
+
+
+    def close(self):
+        self._closed = True
+
+
+
+@contextmanager
+def fake_snowflake(account, latency = 0.0):
+    """ patches snowflake.connector.connect to return fake connections to account.
+        yields the list of connections opened, for query counts
+    """
+
+    connections = []
+    lock = threading.Lock()
+
+    def connect(**kwargs):
+        time.sleep(latency)
+        conn = fake_connection(account, latency)
+        with lock:
+            connections.append(conn)
+        return conn
+
+    with mock.patch.object(snowflake.connector, 'connect', connect):
+        yield connections
@@ -0,0 +1,188 @@
+"""
+Compares the statement builders in snowmad.snowflake against the row by row
+loops they replaced, and against building the statements purely with pandas
+string ops + np.where, on synthetic account_usage frames.
+
+    python benchmarks/sql_generation.py --rows 1000000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# snowmad is in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snowmad.snowflake import user_sql, object_grant_sql
+
+
+def grants_frame(rows, seed = 0):
+    rng = np.random.default_rng(seed)
+    object_types = rng.choice(['WAREHOUSE', 'DATABASE', 'SCHEMA', 'TABLE', 'VIEW'], rows)
+    privileges = rng.choice(['USAGE', 'SELECT', 'INSERT', 'OWNERSHIP'], rows)
+    ids = rng.integers(0, 10_000, rows).astype(str)
+
+    return pd.DataFrame({
+        'PRIVILEGE': privileges,
+        'GRANTED_ON': object_types,
+        'NAME': np.char.add('OBJ_', ids).astype(object),
+        'TABLE_SCHEMA': np.where(np.isin(object_types, ['TABLE', 'VIEW']), 'PUBLIC', None),
+        'TABLE_CATALOG': np.where(np.isin(object_types, ['TABLE', 'VIEW', 'SCHEMA']), 'DB', None),
+        'GRANTEE_NAME': np.char.add('ROLE_', ids).astype(object),
+    })
+
+
+def users_frame(rows, seed = 0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(rows).astype(str)
+
+    def sometimes(values):
+        return np.where(rng.random(rows) < 0.8, values, None)
+
+    return pd.DataFrame({
+        'NAME': np.char.add('USER_', ids).astype(object),
+        'LOGIN_NAME': sometimes(np.char.add('LOGIN_', ids)),
+        'DISPLAY_NAME': sometimes(np.char.add('Display ', ids)),
+        'DEFAULT_ROLE': sometimes(np.full(rows, 'ANALYST')),
+        'EMAIL': sometimes(np.char.add(ids, '@example.com')),
+    })
+
+
+def object_grant_sql_rows(df_obj_grants):
+    """ the row by row loop object_grant_sql replaced """
+
+    privileges = df_obj_grants['PRIVILEGE'].values.tolist()
+    object_types = df_obj_grants['GRANTED_ON'].values.tolist()
+    object_names = df_obj_grants['NAME'].values.tolist()
+    object_name_schemas = df_obj_grants['TABLE_SCHEMA'].values.tolist()
+    object_name_dbs = df_obj_grants['TABLE_CATALOG'].values.tolist()
+    grantee_roles = df_obj_grants['GRANTEE_NAME'].values.tolist()
+
+    grants_sql_list = []
+    for i in range(0, len(df_obj_grants)):
+        privilege = privileges[i]
+        object_type = object_types[i]
+
+        if object_type == 'TABLE' or object_type == 'VIEW':
+            full_object_name = f"{object_name_dbs[i]}.{object_name_schemas[i]}.{object_names[i]}"
+        elif object_type == 'SCHEMA':
+            full_object_name = f"{object_name_dbs[i]}.{object_names[i]}"
+        else:
+            full_object_name = object_names[i]
+
+        if privilege == 'OWNERSHIP':
+            sql = [f"""GRANT {privilege} ON {object_type} {full_object_name} TO ROLE  {grantee_roles[i]} REVOKE CURRENT GRANTS; """]
+        else:
+            sql = [f"""GRANT {privilege} ON {object_type} {full_object_name} TO ROLE  {grantee_roles[i]}; """]
+
+        grants_sql_list += sql
+
+    return grants_sql_list
+
+
+def user_sql_rows(df_users):
+    """ the row by row loop user_sql replaced """
+
+    names = df_users['NAME'].values.tolist()
+    login_names = df_users['LOGIN_NAME'].values.tolist()
+    display_names = df_users['DISPLAY_NAME'].values.tolist()
+    default_roles = df_users['DEFAULT_ROLE'].values.tolist()
+    emails = df_users['EMAIL'].values.tolist()
+
+    user_sql_list = []
+    user_alter_list = []
+    for i in range(0, len(df_users)):
+        login_name = f"login_name='{login_names[i]}'" if login_names[i] != None else ""
+        display_name = f" display_name='{display_names[i]}'" if display_names[i] != None else ""
+        default_role = f" default_role={default_roles[i]}" if default_roles[i] != None else ""
+        email = f" email='{emails[i]}'" if emails[i] != None else ""
+
+        user_sql_list += [f"""CREATE OR REPLACE USER "{names[i]}" password='abc123' {login_name} {display_name} {default_role} {email}"""]
+        user_alter_list += [f"""ALTER USER "{names[i]}" SET {login_name} {display_name} {default_role} {email}"""]
+
+    return user_sql_list, user_alter_list
+
+
+def object_grant_sql_str_ops(df_obj_grants):
+    """ the statements built only with pandas string concatenation and np.where """
+
+    object_type = df_obj_grants['GRANTED_ON'].astype(object)
+    name = df_obj_grants['NAME'].astype(object)
+    db = df_obj_grants['TABLE_CATALOG'].astype(object)
+    schema = df_obj_grants['TABLE_SCHEMA'].astype(object)
+
+    full_object_name = np.where(object_type.isin(['TABLE', 'VIEW']), db + "." + schema + "." + name,
+                                np.where(object_type == 'SCHEMA', db + "." + name, name))
+    suffix = np.where(df_obj_grants['PRIVILEGE'] == 'OWNERSHIP', " REVOKE CURRENT GRANTS", "")
+
+    return ("GRANT " + df_obj_grants['PRIVILEGE'].astype(object) + " ON " + object_type + " " + full_object_name
+            + " TO ROLE  " + df_obj_grants['GRANTEE_NAME'].astype(object) + suffix + "; ").tolist()
+
+
+def user_sql_str_ops(df_users):
+    """ the statements built only with pandas string concatenation """
+
+    def optional(values, prefix, suffix = ""):
+        return (prefix + values.astype(object) + suffix).where(values.notna(), "")
+
+    properties = (optional(df_users['LOGIN_NAME'], "login_name='", "'") + " "
+                  + optional(df_users['DISPLAY_NAME'], " display_name='", "'") + " "
+                  + optional(df_users['DEFAULT_ROLE'], " default_role=") + " "
+                  + optional(df_users['EMAIL'], " email='", "'"))
+
+    name = '"' + df_users['NAME'].astype(object) + '"'
+
+    return (("CREATE OR REPLACE USER " + name + " password='abc123' " + properties).tolist(),
+            ("ALTER USER " + name + " SET " + properties).tolist())
+
+
+def best_of(fn, df, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(df)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    grants = grants_frame(args.rows)
+    users = users_frame(args.rows)
+
+    def normalized(sql_list):
+        return [" ".join(sql.split()) for sql in sql_list]
+
+    # all variants give the same statements, modulo whitespace
+    assert normalized(object_grant_sql(grants[:1000])) == normalized(object_grant_sql_rows(grants[:1000])) \
+        == normalized(object_grant_sql_str_ops(grants[:1000]))
+    # only the create statements are compared: user_sql sets the non-null
+    # properties and unsets the null ones, where the replaced loop always emitted one SET
+    assert normalized(user_sql(users[:1000])[0]) == normalized(user_sql_rows(users[:1000])[0]) \
+        == normalized(user_sql_str_ops(users[:1000])[0])
+
+    variants = [('object grants', grants, [('row loop', object_grant_sql_rows),
+                                           ('string ops', object_grant_sql_str_ops),
+                                           ('snowmad', object_grant_sql)]),
+                ('users', users, [('row loop', user_sql_rows),
+                                  ('string ops', user_sql_str_ops),
+                                  ('snowmad', user_sql)])]
+
+    for label, frame, fns in variants:
+        times = {name: best_of(fn, frame, args.repeat) for name, fn in fns}
+        baseline = times['row loop']
+        print(f"{label} ({args.rows} rows)")
+        for name, seconds in times.items():
+            print(f"    {name:12} {seconds:7.2f}s  {baseline / seconds:5.2f}x vs row loop")
+
+
+if __name__ == '__main__':
+    main()
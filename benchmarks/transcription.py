@@ -0,0 +1,230 @@
+"""
+Times the transcribe_account steps and the terraform generation against a fake
+snowflake backend (benchmarks/fake_snowflake.py) with a fixed per-query latency,
+and records the peak memory of every step.
+
+Results are written as JSON so runs can be compared between commits:
+
+    python benchmarks/transcription.py --roles 2000 --users 2000 --grants 50000 --output base.json
+    git checkout my-branch
+    python benchmarks/transcription.py --roles 2000 --users 2000 --grants 50000 --compare base.json
+
+--compare exits with status 1 if a step got slower (or used more memory) than --threshold allows.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# fake_snowflake sits next to this file, snowmad in the repo root
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_snowflake import fake_snowflake, synthetic_account
+
+from snowmad.snowflake import transcribe_account
+from snowmad.terraform import transcribe
+
+
+config = """
+[snowflake_source_account]
+user = bench
+password = bench
+account = source
+warehouse = bench_wh
+
+[snowflake_target_account]
+user = bench
+password = bench
+account = target
+warehouse = bench_wh
+
+[snowflake]
+user = bench
+password = bench
+account = source
+"""
+
+
+account_steps = ['database_objects', 'users', 'roles', 'warehouses',
+                 'user_role_grants', 'role_role_grants', 'role_object_grants']
+
+terraform_steps = ['create_role_resource', 'create_user_resource', 'create_role_grants_resource', 'generate_files']
+
+
+def benchmarks(config_file, args):
+    """ (name, setup, fn) per benchmark. setup builds what fn runs on, and isn't timed """
+
+    def account():
+        return transcribe_account(config_file, conn_type_target='password', return_sql=False,
+                                  workers=args.workers, batch_size=args.batch_size)
+
+    def terraform():
+        if os.path.exists('tf_manifest.json'):
+            os.remove('tf_manifest.json')
+        return transcribe(config_file)
+
+    cases = [(f"account.{step}", account, lambda acc, step=step: getattr(acc, step)()) for step in account_steps]
+    cases.append(('account.copy_account', account, lambda acc: acc.copy_account()))
+
+    # one get_ddl per schema instead of per database, schemas spread over the workers
+    def account_by_schema():
+        return transcribe_account(config_file, conn_type_target='password', return_sql=False,
+                                  workers=args.workers, batch_size=args.batch_size, ddl_granularity='schema')
+
+    cases.append(('account.database_objects_by_schema', account_by_schema, lambda acc: acc.database_objects()))
+    cases += [(f"terraform.{step}", terraform, lambda tf, step=step: getattr(tf, step)()) for step in terraform_steps]
+
+    # generate_files is a full run from an empty manifest, this one a run without any changes
+    def terraform_generated():
+        tf = terraform()
+        tf.generate_files()
+        return tf
+
+    cases.append(('terraform.generate_files_unchanged', terraform_generated, lambda tf: tf.generate_files()))
+
+    return cases
+
+
+def run(fn, setup, traced, connections):
+    """ (seconds, or peak bytes allocated while fn ran when traced, queries fn sent).
+        queries setup sends aren't counted
+    """
+
+    target = setup()
+    try:
+        queries_before = sum(conn.queries for conn in connections)
+        if traced:
+            tracemalloc.start()
+            fn(target)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak, sum(conn.queries for conn in connections) - queries_before
+
+        start = time.perf_counter()
+        fn(target)
+        return time.perf_counter() - start, sum(conn.queries for conn in connections) - queries_before
+
+    finally:
+        close = getattr(target, 'close', None) or getattr(target, 'close_conn', None)
+        close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """ prints each benchmark against the baseline, returns the regressed ones """
+
+    regressions = []
+    print(f"\n{'benchmark':40} {'seconds':>9} {'base':>9} {'ratio':>6} {'peak MB':>9} {'base':>9} {'ratio':>6}")
+
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:40} {result['seconds']:9.3f} {'-':>9}")
+            continue
+
+        time_ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+        memory_ratio = result['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else 1.0
+        flag = ""
+        if time_ratio > threshold or memory_ratio > threshold:
+            regressions.append(name)
+            flag = "  << regression"
+
+        print(f"{name:40} {result['seconds']:9.3f} {base['seconds']:9.3f} {time_ratio:6.2f} "
+              f"{result['peak_bytes'] / 2**20:9.1f} {base['peak_bytes'] / 2**20:9.1f} {memory_ratio:6.2f}{flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--roles', type=int, default=500)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--grants', type=int, default=10_000)
+    parser.add_argument('--databases', type=int, default=20)
+    parser.add_argument('--tables', type=int, default=500, help='tables per database get_ddl blob')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds per query')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='benchmark names to run')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio above which a benchmark regressed')
+    args = parser.parse_args()
+
+    account = synthetic_account(roles=args.roles, users=args.users, grants=args.grants,
+                                databases=args.databases, tables=args.tables)
+
+    workdir = tempfile.mkdtemp(prefix='snowmad_bench_')
+    config_file = os.path.join(workdir, 'snowflake.config')
+    with open(config_file, 'w') as f:
+        f.write(config)
+
+    # the terraform files are written to the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    results = {}
+    try:
+        with fake_snowflake(account, latency=args.latency) as connections:
+            for name, setup, fn in benchmarks(config_file, args):
+                if args.only and name not in args.only:
+                    continue
+
+                # output of the steps themselves isn't part of the report
+                with open(os.devnull, 'w') as devnull:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        timings = [run(fn, setup, False, connections) for _ in range(args.repeat)]
+                        seconds = min(seconds for seconds, _ in timings)
+                        queries = sum(queries for _, queries in timings) // args.repeat
+                        peak, _ = run(fn, setup, True, connections)
+                    finally:
+                        sys.stdout = stdout
+
+                results[name] = {'seconds': seconds, 'peak_bytes': peak, 'queries': queries}
+                print(f"{name:40} {seconds:9.3f}s {peak / 2**20:9.1f} MB peak {queries:8} queries")
+    finally:
+        os.chdir(cwd)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'compare', 'threshold', 'only')},
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        if baseline['parameters'] != report['parameters']:
+            print(f"warning: baseline was run with {baseline['parameters']}")
+
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {baseline.get('commit')}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
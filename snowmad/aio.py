@@ -0,0 +1,330 @@
+import asyncio
+import functools
+import time
+
+import pandas as pd
+import snowflake.connector
+
+from . import ddl
+from .pool import read_credentials
+from .snowflake import (copy_steps, account_usage_sql, replicated_databases, role_sql, user_sql, warehouse_sql,
+                        user_role_grant_sql, role_role_grant_sql, object_grant_sql, supported_object_types)
+
+
+async def _blocking(fn, *args, **kwargs):
+    """ runs one short blocking connector call (a single http request) off the event loop """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+
+async def query(conn, sql, poll_interval = 0.05, max_poll_interval = 2.0, results = True):
+    """ Submits sql with execute_async and polls its query id with exponential backoff
+        until it is done. Returns a cursor holding the results. Query errors are raised.
+        - results: fetch the results into the cursor. statements whose results aren't read
+          (DDL, GRANT) skip it, which saves a round trip
+    """
+
+    cur = conn.cursor()
+    await _blocking(cur.execute_async, sql)
+    sfqid = cur.sfqid
+
+    delay = poll_interval
+    while True:
+        status = await _blocking(conn.get_query_status_throw_if_error, sfqid)
+        if not conn.is_still_running(status):
+            break
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_poll_interval)
+
+    if results:
+        await _blocking(cur.get_results_from_sfqid, sfqid)
+    return cur
+
+
+async def fetch_data_df(sql, conn):
+    """ the results of sql as a DataFrame. SHOW results aren't arrow, they're read as rows """
+
+    cur = await query(conn, sql)
+    try:
+        return await _blocking(cur.fetch_pandas_all)
+    except snowflake.connector.errors.NotSupportedError:
+        rows = await _blocking(cur.fetchall)
+        return pd.DataFrame(rows, columns=[col[0] for col in cur.description])
+    finally:
+        cur.close()
+
+
+async def execute_sql_list(sql_list, conn, return_sql = False, return_errors = True, concurrency = 1,
+                           metrics = None, step = None):
+    """ Executes sql statements and skips any that can't be executed.
+        - concurrency: number of statements in flight at once on the connection.
+          1 keeps the order of sql_list, only use more for statements that don't depend on each other
+        - metrics: a snowmad.metrics.statement_metrics, see snowflake.execute_sql_list
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def execute(sql):
+        async with semaphore:
+            start = time.time()
+            try:
+                if return_sql:
+                    print("Executing: ", sql)
+                cur = await query(conn, sql, results = False)
+                cur.close()
+                
+                if metrics is not None:
+                    metrics.record(step, sql, start, time.time() - start, cur.sfqid)
+
+            except snowflake.connector.errors.ProgrammingError as e:
+                if metrics is not None:
+                    metrics.record(step, sql, start, time.time() - start, e.sfqid, e)
+                
+                if return_errors:
+                    print(e)
+                    print('Error {0} ({1}): {2} ({3})'.format(e.errno, e.sqlstate, e.msg, e.sfqid))
+
+            except Exception as error:
+                if metrics is not None:
+                    metrics.record(step, sql, start, time.time() - start, getattr(error, 'sfqid', None), error)
+                
+                if return_errors:
+                    print(error)
+                    print(f"Could not execute: {sql}")
+
+    if concurrency <= 1:
+        for sql in sql_list:
+            await execute(sql)
+        return
+
+    await asyncio.gather(*(execute(sql) for sql in sql_list))
+
+
+
+class async_transcribe_account:
+    """
+    The replication steps of transcribe_account on asyncio, replicating one source account
+    into one or more target accounts from a single event loop
+
+    Attributes:
+        config_file : str
+            the path of the config file that contains the snowflake credentials
+        source_config_name : str
+            the name of the header in the config file for the source account
+        target_config_names : list
+            the headers in the config file of the target accounts. every step is applied to all of them
+        conn_type_source: str
+            source account authentication type. can be 'password' or 'private_key'
+        conn_type_target: str
+            target accounts authentication type. can be 'password' or 'private_key'
+        db_ignore_list: list
+            list of database names that should not be replicated
+        ddl_filter: snowmad.ddl.ddl_filter
+            picks which statements of each database's get_ddl output are replicated
+        return_sql: bool
+            if true all of the sql statements that are executed will be printed
+        concurrency: int
+            statements in flight per target for steps whose statements are independent
+            (grants, users, roles, warehouses), and databases read / created at once
+        metrics: snowmad.metrics.statement_metrics
+            records every statement sent to the targets, per step
+
+    Queries are submitted with execute_async and polled by query id, so one connection per
+    account serves every concurrent query. Source metadata is read once and shared by all targets.
+    Incremental manifests and plan mode are only supported by transcribe_account.
+    snowmad.fanout.fan_out_account fans out from threads with batched requests, see there for which to use.
+
+        async with async_transcribe_account('snowflake.config', target_config_names=[...]) as account:
+            await account.copy_account()
+    """
+
+    def __init__(self,
+                 config_file,
+                 source_config_name = 'snowflake_source_account',
+                 target_config_names = ['snowflake_target_account'],
+                 conn_type_source = 'password',
+                 conn_type_target = 'private_key',
+                 db_ignore_list = [""],
+                 ddl_filter = None,
+                 return_sql = True,
+                 concurrency = 8,
+                 metrics = None):
+
+        self.config_file = config_file
+        self.source_config_name = source_config_name
+        self.target_config_names = list(target_config_names)
+        self.conn_type_source = conn_type_source
+        self.conn_type_target = conn_type_target
+        self.db_ignore_list = db_ignore_list
+        self.ddl_filter = ddl_filter if ddl_filter is not None else ddl.ddl_filter()
+        self.return_sql = return_sql
+        self.concurrency = concurrency
+        self.metrics = metrics
+        self.source_conn = None
+        self.target_conns = {}
+        self.db_results = {}
+        self.step_report = {}
+        self._metadata = {}
+
+
+    async def connect(self):
+        """ Opens the source connection and one connection per target account, concurrently """
+
+        async def open_conn(config_name, conn_type):
+            connect_args = read_credentials(self.config_file, config_name, conn_type)
+            conn = await _blocking(snowflake.connector.connect, **connect_args)
+            return connect_args['account'], conn
+
+        opened = await asyncio.gather(open_conn(self.source_config_name, self.conn_type_source),
+                                      *(open_conn(name, self.conn_type_target) for name in self.target_config_names))
+
+        account_source, self.source_conn = opened[0]
+        self.target_conns = dict(zip(self.target_config_names, [conn for _, conn in opened[1:]]))
+
+        for name, (account_target, _) in zip(self.target_config_names, opened[1:]):
+            if account_target == account_source:
+                raise ValueError(f"Source and Target Accounts Must Be Different: {name} is {account_source}")
+
+        print(f"connected to source account and {len(self.target_conns)} target accounts")
+        return self
+
+
+    async def close(self):
+        for conn in [self.source_conn, *self.target_conns.values()]:
+            if conn is not None:
+                await _blocking(conn.close)
+
+
+    async def __aenter__(self):
+        return await self.connect()
+
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+    async def _read_source(self, sql):
+        """ source reads are shared: concurrent steps asking for the same query await one read """
+
+        if sql not in self._metadata:
+            self._metadata[sql] = asyncio.ensure_future(fetch_data_df(sql, self.source_conn))
+        return await self._metadata[sql]
+
+
+    async def account_usage(self, view):
+        return await self._read_source(account_usage_sql(view))
+
+
+    async def _execute(self, step, sql_list, concurrency = None):
+        """ applies sql_list to every target account at once """
+
+        concurrency = self.concurrency if concurrency is None else concurrency
+        await asyncio.gather(*(execute_sql_list(sql_list, conn, self.return_sql, True, concurrency, self.metrics, step)
+                               for conn in self.target_conns.values()))
+        return len(sql_list)
+
+
+    async def roles(self):
+        return await self._execute('roles', role_sql(await self.account_usage('roles')))
+
+
+    async def users(self):
+        create_sql, _ = user_sql(await self.account_usage('users'))
+        return await self._execute('users', create_sql)
+
+
+    async def warehouses(self):
+        create_sql, _ = warehouse_sql(await self._read_source("""show warehouses;"""))
+        return await self._execute('warehouses', create_sql)
+
+
+    async def user_role_grants(self):
+        df_user_grants = await self.account_usage('grants_to_users')
+        return await self._execute('user_role_grants', user_role_grant_sql(df_user_grants))
+
+
+    async def role_role_grants(self):
+        df_grants = await self.account_usage('grants_to_roles')
+        return await self._execute('role_role_grants', role_role_grant_sql(df_grants))
+
+
+    async def role_object_grants(self):
+        df_grants = await self.account_usage('grants_to_roles')
+        df_obj_grants = df_grants[df_grants['GRANTED_ON'].isin(supported_object_types)]
+        return await self._execute('role_object_grants', object_grant_sql(df_obj_grants))
+
+
+    async def database_objects(self):
+        """ Reads and creates up to concurrency databases at once, see self.db_results.
+            The statements of one database are executed in order
+        """
+
+        databases = replicated_databases(await self._read_source('show databases'), self.db_ignore_list)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.db_results = {}
+
+        async def database(name):
+            async with semaphore:
+                try:
+                    df_ddl = await fetch_data_df(f"""select get_ddl('database', '{name}', true)""", self.source_conn)
+                    statements = self.ddl_filter.filter(df_ddl.iloc[0, 0])
+                    await self._execute('database_objects', statements, concurrency = 1)
+                    self.db_results[name] = {'status': 'created', 'statements': len(statements)}
+                except Exception as error:
+                    self.db_results[name] = {'status': 'failed', 'error': str(error)}
+
+        await asyncio.gather(*(database(name) for name in databases))
+
+        for name, result in self.db_results.items():
+            if result['status'] == 'failed':
+                print(f"Could Not Create: {name}")
+
+        return sum(result.get('statements', 0) for result in self.db_results.values())
+
+
+    async def copy_account(self, steps = None):
+        """ Runs the steps (all of copy_steps by default), each as soon as the steps it depends on are done.
+            Steps that depend on a failed step are skipped, see self.step_report
+        """
+
+        steps = list(copy_steps) if steps is None else list(steps)
+        unknown = [step for step in steps if step not in copy_steps]
+        if unknown:
+            raise ValueError(f"unknown copy steps: {unknown}, choose from {list(copy_steps)}")
+
+        self._metadata = {}
+        self.step_report = {}
+        tasks = {}
+
+        async def run(step):
+            deps = [dep for dep in copy_steps[step] if dep in steps]
+            await asyncio.gather(*(tasks[dep] for dep in deps))
+
+            if any(self.step_report[dep]['status'] != 'done' for dep in deps):
+                self.step_report[step] = {'status': 'skipped', 'statements': 0, 'seconds': 0.0}
+                return
+
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                statements = await getattr(self, step)()
+                self.step_report[step] = {'status': 'done', 'statements': statements or 0}
+            except Exception as error:
+                print(f"{step} failed: {error}")
+                self.step_report[step] = {'status': 'failed', 'statements': 0}
+            self.step_report[step]['seconds'] = loop.time() - start
+
+        # copy_steps lists every step after the steps it depends on
+        for step in sorted(steps, key = list(copy_steps).index):
+            tasks[step] = asyncio.ensure_future(run(step))
+        await asyncio.gather(*tasks.values())
+
+        for step in steps:
+            report = self.step_report[step]
+            print(f"{step}: {report['status']} - {report['statements']} statements in {report['seconds']:.1f}s")
+
+        if self.metrics is not None:
+            self.metrics.print_summary()
+
+        print(f"created account objects in {len(self.target_conns)} target accounts")
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+
+
+class checkpoint_journal:
+    """
+    An append only journal of the work a copy_account run finished, so a failed run can be resumed
+
+    Attributes:
+        path : str
+            location of the journal file. It is created on the first record
+        sync: bool
+            if true every record is fsynced, so it survives a crash of the machine
+            and not only of the process
+
+    Every record is one JSON line {'step': ..., 'done': [unit, ...], 'time': ...}, appended when a
+    unit of work completed: a database for database_objects, a statement (by its ddl_hash) for the
+    other steps. A line cut off by a crash is ignored when the journal is read.
+    """
+
+    def __init__(self, path, sync = True):
+        self.path = path
+        self.sync = sync
+        self.done = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.done.setdefault(entry['step'], set()).update(entry['done'])
+
+
+    def is_done(self, step, unit):
+        return unit in self.done.get(step, ())
+
+
+    def pending(self, step, units):
+        """ the units of a step that aren't in the journal yet, in order """
+
+        done = self.done.get(step, ())
+        return [unit for unit in units if unit not in done]
+
+
+    def record(self, step, units):
+        """ appends finished units of a step """
+
+        units = list(units)
+        if not units:
+            return
+
+        line = json.dumps({'step': step, 'done': units, 'time': time.time()}) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+            self.done.setdefault(step, set()).update(units)
+
+
+    def units(self, step = None):
+        """ number of finished units, of one step or all of them """
+
+        if step is not None:
+            return len(self.done.get(step, ()))
+        return sum(len(units) for units in self.done.values())
+
+
+    def reset(self):
+        """ starts an empty journal, for a run that doesn't resume """
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.done = {}
+
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
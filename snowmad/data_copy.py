@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+
+# one unit of work: a whole table, or one hash partition of a large table
+copy_task = namedtuple('copy_task', ['database', 'schema', 'table', 'partition', 'partitions'])
+
+
+def quote_name(*parts):
+    """ "DB"."SCHEMA"."TABLE" with embedded quotes escaped """
+
+    return ".".join('"' + part.replace('"', '""') + '"' for part in parts)
+
+
+def table_tasks(tables, partition_rows = 5_000_000):
+    """ Splits (database, schema, table, row_count) tuples into copy_tasks.
+        Tables with more than partition_rows rows are split into hash partitions of about partition_rows rows
+    """
+
+    tasks = []
+    for database, schema, table, row_count in tables:
+        partitions = max(1, math.ceil((row_count or 0) / partition_rows))
+        tasks += [copy_task(database, schema, table, partition, partitions) for partition in range(partitions)]
+
+    return tasks
+
+
+def _columns(cur, name):
+    cur.execute(f"select * from {name} limit 0")
+    return [col[0] for col in cur.description]
+
+
+def partition_sql(task, columns):
+    """ select for one copy_task. partitions are picked on a hash of all columns """
+
+    name = quote_name(task.database, task.schema, task.table)
+    if task.partitions == 1:
+        return f"select * from {name}"
+
+    hashed = ", ".join(quote_name(column) for column in columns)
+    return f"select * from {name} where mod(abs(hash({hashed})), {task.partitions}) = {task.partition}"
+
+
+def checksum_sql(database, schema, table, columns):
+    """ row count and an order independent hash of every row """
+
+    hashed = ", ".join(quote_name(column) for column in columns)
+    return f"select count(*), hash_agg({hashed}) from {quote_name(database, schema, table)}"
+
+
+
+class table_copy:
+    """
+    Copies table rows between two accounts
+
+    Attributes:
+        source_pool : snowmad.pool.connection_pool
+            connections to the account the rows are read from
+        target_pool : snowmad.pool.connection_pool
+            connections to the account the rows are loaded into. the tables must already exist
+        load : function
+            load(conn, df, table_name, database = ..., schema = ...) -> (success, chunks, rows, output),
+            snowflake.connector.pandas_tools.write_pandas by default (stage PUT + COPY INTO)
+        workers : int
+            number of tasks running at the same time. each task holds at most one
+            result batch in memory, so in-flight memory is about workers x batch size
+        partition_rows : int
+            tables with more rows than this are copied as several hash partitions
+
+    Each task streams its source rows as arrow result batches and bulk loads every batch
+    into the target as it arrives. Per table outcomes are kept in self.results.
+    """
+
+    def __init__(self, source_pool, target_pool, load = None, workers = 4, partition_rows = 5_000_000):
+        if load is None:
+            from snowflake.connector.pandas_tools import write_pandas
+            load = write_pandas
+
+        self.source_pool = source_pool
+        self.target_pool = target_pool
+        self.load = load
+        self.workers = workers
+        self.partition_rows = partition_rows
+        self.results = {}
+        self._lock = threading.Lock()
+
+
+    def copy(self, tables, truncate = True, verify = True):
+        """ Copies (database, schema, table, row_count) tables and returns self.results.
+            - truncate: empty the target tables first, so a copy can be re-run
+            - verify: compare row counts and checksums of source and target afterwards
+        """
+
+        tables = list(tables)
+        self.results = {".".join(table[:3]): {'status': 'copying', 'rows': 0, 'seconds': 0.0} for table in tables}
+
+        if truncate:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(self._truncate, [table[:3] for table in tables]))
+
+        tasks = [task for task in table_tasks(tables, self.partition_rows)
+                 if self.results[f"{task.database}.{task.schema}.{task.table}"]['status'] == 'copying']
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._copy_task, tasks))
+
+        copied = [table[:3] for table in tables if self.results[".".join(table[:3])]['status'] == 'copying']
+        for table in copied:
+            self.results[".".join(table)]['status'] = 'copied'
+
+        if verify:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(self._verify, copied))
+
+        return self.results
+
+
+    def _fail(self, key, error):
+        with self._lock:
+            self.results[key].update({'status': 'failed', 'error': str(error)})
+
+
+    def _truncate(self, table):
+        try:
+            with self.target_pool.connection() as conn:
+                conn.cursor().execute(f"truncate table {quote_name(*table)}")
+        except Exception as error:
+            self._fail(".".join(table), error)
+
+
+    def _copy_task(self, task):
+        key = f"{task.database}.{task.schema}.{task.table}"
+        start = time.perf_counter()
+
+        try:
+            with self.source_pool.connection() as source_conn, \
+                 self.target_pool.connection() as target_conn:
+
+                cur = source_conn.cursor()
+                try:
+                    cur.execute(partition_sql(task, _columns(cur, quote_name(task.database, task.schema, task.table))))
+
+                    for batch in cur.fetch_pandas_batches():
+                        if not len(batch):
+                            continue
+                        success, _, rows, _ = self.load(target_conn, batch, task.table,
+                                                        database = task.database, schema = task.schema)
+                        if not success:
+                            raise RuntimeError(f"load into {key} was not successful")
+
+                        with self._lock:
+                            self.results[key]['rows'] += rows
+                finally:
+                    cur.close()
+
+        except Exception as error:
+            self._fail(key, error)
+
+        finally:
+            with self._lock:
+                self.results[key]['seconds'] += time.perf_counter() - start
+
+
+    def _verify(self, table):
+        key = ".".join(table)
+
+        try:
+            checksums = []
+            for pool in [self.source_pool, self.target_pool]:
+                with pool.connection() as conn:
+                    cur = conn.cursor()
+                    try:
+                        cur.execute(checksum_sql(*table, _columns(cur, quote_name(*table))))
+                        checksums.append(tuple(cur.fetchone()))
+                    finally:
+                        cur.close()
+
+        except Exception as error:
+            self._fail(key, f"verification failed: {error}")
+            return
+
+        (source_rows, source_hash), (target_rows, target_hash) = checksums
+        with self._lock:
+            self.results[key].update({'source_rows': source_rows, 'target_rows': target_rows,
+                                      'verified': source_rows == target_rows and source_hash == target_hash})
+            if not self.results[key]['verified']:
+                self.results[key]['status'] = 'mismatch'
@@ -0,0 +1,124 @@
+import re
+
+
+# everything a ';' inside of doesn't end a statement. unterminated tokens run to the end of the text
+_token_re = re.compile(r"""
+      '(?:[^'\\]|\\.|'')*'?        # string literal, with \ and '' escapes
+    | "(?:[^"]|"")*"?              # quoted identifier
+    | \$\$.*?(?:\$\$|\Z)           # $$ procedure / function body
+    | (?:--|//)[^\n]*              # line comment
+    | /\*.*?(?:\*/|\Z)             # block comment
+    | ;
+""", re.VERBOSE | re.DOTALL)
+
+
+# object kinds made of more than one word, longest first
+_multi_word_kinds = ['ROW ACCESS POLICY', 'MASKING POLICY', 'NETWORK POLICY', 'PASSWORD POLICY',
+                     'SESSION POLICY', 'NETWORK RULE', 'FILE FORMAT', 'EXTERNAL TABLE',
+                     'MATERIALIZED VIEW', 'DYNAMIC TABLE', 'EVENT TABLE', 'HYBRID TABLE',
+                     'ICEBERG TABLE', 'RESOURCE MONITOR', 'STORAGE INTEGRATION']
+
+# modifiers that can sit between CREATE [OR REPLACE] and the object kind
+_modifiers = ['SECURE', 'TRANSIENT', 'TEMPORARY', 'TEMP', 'VOLATILE', 'LOCAL', 'GLOBAL', 'RECURSIVE']
+
+_create_re = re.compile(r"""
+    ^(?:\s+|(?:--|//)[^\n]*\n|/\*.*?\*/)*                        # leading whitespace / comments
+    create\s+(?:or\s+replace\s+)?
+    (?:(?:{modifiers})\s+)*
+    (?P<kind>{multi_word}|\w+)
+""".format(modifiers="|".join(_modifiers),
+           multi_word="|".join(kind.replace(" ", r"\s+") for kind in _multi_word_kinds)),
+    re.VERBOSE | re.DOTALL | re.IGNORECASE)
+
+
+# what database_objects has always left out: objects that depend on other objects or
+# can't be copied with their ddl alone
+default_ignore_kinds = ['PROCEDURE', 'FUNCTION', 'STAGE', 'STREAM', 'TASK', 'FILE FORMAT',
+                        'VIEW', 'MATERIALIZED VIEW', 'PIPE', 'MASKING POLICY']
+
+# tables with foreign keys or masking policies on columns
+default_ignore_patterns = [r"\sreferences\s", r"masking\s+policy"]
+
+
+
+def split_statements(text):
+    """ Yields the statements of a sql script in one pass over the text.
+        Statements are split on ';' outside of string literals, quoted identifiers,
+        comments and $$ bodies. Whitespace is kept, only the ends are stripped
+    """
+
+    start = 0
+    for token in _token_re.finditer(text):
+        if token.group() != ';':
+            continue
+
+        statement = text[start:token.start()].strip()
+        if statement:
+            yield statement
+        start = token.end()
+
+    statement = text[start:].strip()
+    if statement:
+        yield statement
+
+
+def statement_kind(statement):
+    """ 'TABLE', 'VIEW', 'FILE FORMAT', ... for a CREATE statement, None for anything else """
+
+    match = _create_re.match(statement)
+    if match is None:
+        return None
+
+    return " ".join(match.group('kind').upper().split())
+
+
+
+class ddl_filter:
+    """
+    Picks the CREATE statements of a get_ddl dump that are replicated
+
+    Attributes:
+        ignore_kinds : list
+            object kinds that are left out, see statement_kind
+        allow_kinds : list
+            if set, only these object kinds are kept (ignore_kinds still applies)
+        ignore_patterns : list
+            regular expressions. statements matching any of them are left out
+    """
+
+    def __init__(self,
+                 ignore_kinds = default_ignore_kinds,
+                 allow_kinds = None,
+                 ignore_patterns = default_ignore_patterns):
+
+        self.ignore_kinds = {kind.upper() for kind in ignore_kinds}
+        self.allow_kinds = {kind.upper() for kind in allow_kinds} if allow_kinds is not None else None
+        self.ignore_re = re.compile("|".join(f"(?:{pattern})" for pattern in ignore_patterns), re.IGNORECASE) \
+                         if ignore_patterns else None
+
+
+    def keep(self, statement, kind = None):
+        kind = kind or statement_kind(statement)
+
+        if kind is None or kind in self.ignore_kinds:
+            return False
+        if self.allow_kinds is not None and kind not in self.allow_kinds:
+            return False
+        if self.ignore_re is not None and self.ignore_re.search(statement):
+            return False
+
+        return True
+
+
+    def classify(self, text):
+        """ (kind, statement, kept) for every statement in text """
+
+        for statement in split_statements(text):
+            kind = statement_kind(statement)
+            yield kind, statement, self.keep(statement, kind)
+
+
+    def filter(self, text):
+        """ the statements of text that are replicated, in order """
+
+        return [statement for _, statement, kept in self.classify(text) if kept]
@@ -0,0 +1,150 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import statement_metrics
+from .pool import connection_pool
+from .snowflake import transcribe_account, execute_sql_list, independent_steps
+
+
+
+class fan_out_account:
+    """
+    Replicates one source account into several target accounts from a single read of the source
+
+    Attributes:
+        config_file : str
+            the path of the config file that contains the snowflake credentials
+        target_config_names : list
+            the headers in the config file of the target accounts
+        source_config_name : str
+            the name of the header in the config file for the source account
+        conn_type_source: str
+            source account authentication type. can be 'password' or 'private_key'
+        conn_type_target: str
+            target accounts authentication type. can be 'password' or 'private_key'
+        batch_size: int
+            statements sent per request to each target
+        target_connections: int
+            connections per target. the statements of independent_steps (grants, users, roles,
+            warehouses) are spread over them, the other steps run in order on one connection
+        return_sql: bool
+            if true all of the sql statements that are executed will be printed
+        sinks: list
+            statement_metrics sinks, they get the statements of every target.
+            steps are recorded as 'target_config_name.step'
+        **source_args:
+            passed on to the source transcribe_account (db_ignore_list, ddl_filter, workers, ...)
+
+    The source metadata and get_ddl output are read once into a sql_plan (transcribe_account in
+    plan mode), which is then applied to every target at the same time, one worker per target.
+    Incremental manifests and grant reconciliation are per target and not supported here.
+
+    snowmad.aio.async_transcribe_account also replicates one source into several targets. It sends
+    every statement as its own request from one event loop, with one connection per account.
+    This class sends multi statement batches from threads, and it builds on transcribe_account:
+    ddl_granularity, ddl filters and everything else of plan mode apply, and the plan can be saved
+    and reviewed. Use aio to run many targets from a single thread, this class for throughput per target.
+    """
+
+    def __init__(self,
+                 config_file,
+                 target_config_names,
+                 source_config_name = 'snowflake_source_account',
+                 conn_type_source = 'password',
+                 conn_type_target = 'private_key',
+                 batch_size = 100,
+                 target_connections = 4,
+                 return_sql = False,
+                 sinks = None,
+                 **source_args):
+
+        self.config_file = config_file
+        self.target_config_names = list(target_config_names)
+        self.conn_type_target = conn_type_target
+        self.batch_size = batch_size
+        self.target_connections = target_connections
+        self.return_sql = return_sql
+        self.sinks = list(sinks or [])
+        self.target_reports = {}
+
+        self.source = transcribe_account(config_file, source_config_name, conn_type_source = conn_type_source,
+                                         return_sql = return_sql, plan_only = True, **source_args)
+        self.plan = None
+
+
+    def close(self):
+        self.source.close()
+
+
+    def copy_account(self, steps = None, step_workers = 4, target_workers = None):
+        """ - Reads the source once and builds the plan of steps (all of copy_steps by default)
+            - Applies it to every target concurrently, target_workers at a time (all by default)
+            - Per target outcome, wall time and per step statement summary in self.target_reports
+        """
+
+        self.source.copy_account(steps, step_workers)
+        self.plan = self.source.plan
+
+        self.target_reports = {}
+        with ThreadPoolExecutor(max_workers=target_workers or len(self.target_config_names)) as executor:
+            list(executor.map(self.apply_to_target, self.target_config_names))
+
+        for name, report in self.target_reports.items():
+            failed = sum(step['failed'] for step in report.get('steps', {}).values())
+            print(f"{name}: {report['status']} - {report.get('statements', 0)} statements "
+                  f"({failed} failed) in {report['seconds']:.1f}s")
+
+
+    def apply_to_target(self, target_config_name):
+        """ Applies self.plan to one target and records its report """
+
+        start = time.perf_counter()
+        metrics = statement_metrics(self.sinks)
+        report = {'status': 'running'}
+        self.target_reports[target_config_name] = report
+
+        pool = None
+        try:
+            pool = connection_pool(self.config_file, target_config_name, self.conn_type_target,
+                                   size = self.target_connections)
+            if pool.account == self.source.source_pool.account:
+                raise ValueError(f"Source and Target Accounts Must Be Different: {pool.account}")
+
+            for step, sql_list in self.plan.step_statements().items():
+                step_name = f"{target_config_name}.{step}"
+                if step not in independent_steps:
+                    self._apply(pool, sql_list, metrics, step_name)
+                    continue
+
+                # one slice of the step per connection
+                workers = max(1, min(self.target_connections, len(sql_list)))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(lambda i: self._apply(pool, sql_list[i::workers], metrics, step_name),
+                                      range(workers)))
+
+            # the metrics of this target only, target names can have dots in them
+            prefix = f"{target_config_name}."
+            steps = {step[len(prefix):]: summary for step, summary in metrics.summary().items()}
+            report.update({'status': 'done', 'statements': sum(step['statements'] for step in steps.values()),
+                           'steps': steps})
+
+        except Exception as error:
+            print(f"{target_config_name} failed: {error}")
+            report.update({'status': 'failed', 'error': str(error)})
+
+        finally:
+            if pool is not None:
+                pool.close()
+            report['seconds'] = time.perf_counter() - start
+
+
+    def _apply(self, pool, sql_list, metrics, step):
+        """ executes statements in order on one pool connection """
+
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                execute_sql_list(sql_list, cur, return_sql = self.return_sql, return_errors = True,
+                                 batch_size = self.batch_size, metrics = metrics, step = step)
+            finally:
+                cur.close()
@@ -0,0 +1,100 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+# one grant, comparable between accounts. grantee_type is 'USER' or 'ROLE'
+grant_key = namedtuple('grant_key', ['privilege', 'granted_on', 'name', 'grantee_type', 'grantee'])
+
+# grants to and of these roles are never revoked
+system_roles = {'PUBLIC', 'ACCOUNTADMIN', 'SECURITYADMIN', 'ORGADMIN', 'USERADMIN', 'SYSADMIN'}
+
+
+def object_names(df_obj_grants):
+    """ db.schema.name for tables / views, db.name for schemas, name for everything else.
+        Shared by the grant keys and snowmad.snowflake.object_grant_sql
+    """
+
+    object_types = df_obj_grants['GRANTED_ON'].to_numpy()
+    qualification = np.where(np.isin(object_types, ['TABLE', 'VIEW']), 2,
+                             np.where(object_types == 'SCHEMA', 1, 0)).tolist()
+
+    columns = zip(df_obj_grants['NAME'].tolist(), df_obj_grants['TABLE_SCHEMA'].tolist(),
+                  df_obj_grants['TABLE_CATALOG'].tolist(), qualification)
+
+    return [f"{db}.{schema}.{name}" if qualify == 2 else f"{db}.{name}" if qualify == 1 else name
+            for name, schema, db, qualify in columns]
+
+
+def user_grant_keys(df_user_grants):
+    """ keys of a grants_to_users frame """
+
+    return [grant_key('USAGE', 'ROLE', role, 'USER', user)
+            for role, user in zip(df_user_grants['ROLE'].tolist(), df_user_grants['GRANTEE_NAME'].tolist())]
+
+
+def role_grant_keys(df_role_grants):
+    """ keys of the role grants (GRANTED_ON = 'ROLE') of a grants_to_roles frame """
+
+    return [grant_key('USAGE', 'ROLE', role, 'ROLE', grantee)
+            for role, grantee in zip(df_role_grants['NAME'].tolist(), df_role_grants['GRANTEE_NAME'].tolist())]
+
+
+def object_grant_keys(df_obj_grants):
+    """ keys of the object grants of a grants_to_roles frame """
+
+    return [grant_key(privilege, object_type, name, 'ROLE', grantee)
+            for privilege, object_type, name, grantee in zip(df_obj_grants['PRIVILEGE'].tolist(),
+                                                               df_obj_grants['GRANTED_ON'].tolist(),
+                                                               object_names(df_obj_grants),
+                                                               df_obj_grants['GRANTEE_NAME'].tolist())]
+
+
+def revoke_sql(keys):
+    """ REVOKE statements for grant keys. OWNERSHIP can only be transferred, it is left out """
+
+    sql_list = []
+    for key in keys:
+        if key.privilege == 'OWNERSHIP':
+            continue
+
+        if key.granted_on == 'ROLE':
+            sql_list.append(f"""REVOKE ROLE "{key.name}" FROM {key.grantee_type} "{key.grantee}";""")
+        else:
+            sql_list.append(f"""REVOKE {key.privilege} ON {key.granted_on} {key.name} FROM ROLE {key.grantee};""")
+
+    return sql_list
+
+
+
+class grant_diff:
+    """
+    Compares source grants with the grants a target account already has
+
+    Attributes:
+        target_keys : set
+            grant_keys of the target account, loaded once in bulk
+
+    missing() keeps the rows of a source frame that the target doesn't have, so the usual
+    statement builders only render those. Source keys are remembered, extra() gives
+    the target grants that weren't in any source frame seen.
+    """
+
+    def __init__(self, target_keys):
+        self.target_keys = set(target_keys)
+        self.source_keys = set()
+
+
+    def missing(self, df, keys):
+        """ the rows of df (one key per row) that aren't in the target """
+
+        self.source_keys.update(keys)
+        return df.loc[np.array([key not in self.target_keys for key in keys], dtype=bool)]
+
+
+    def extra(self):
+        """ target grants that weren't in any source frame, except grants to or of system roles """
+
+        return sorted(key for key in self.target_keys - self.source_keys
+                      if not (key.grantee_type == 'ROLE' and key.grantee in system_roles)
+                      and not (key.granted_on == 'ROLE' and key.name in system_roles))
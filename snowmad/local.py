@@ -0,0 +1,189 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# "DB"."SCHEMA"."TABLE" -> "DB.SCHEMA.TABLE", sqlite has no databases or schemas
+_qualified_re = re.compile(r'"((?:[^"]|"")*)"\."((?:[^"]|"")*)"\."((?:[^"]|"")*)"')
+_truncate_re = re.compile(r"^\s*truncate\s+table\s+(?:if\s+exists\s+)?", re.IGNORECASE)
+
+
+def _translate(sql):
+    sql = _qualified_re.sub(lambda match: f'"{match[1]}.{match[2]}.{match[3]}"', sql)
+    return _truncate_re.sub("delete from ", sql)
+
+
+def _hash(*values):
+    """ deterministic signed 64 bit hash, like snowflake's HASH """
+
+    digest = hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class _hash_agg:
+    """ order independent hash of a set of rows, like snowflake's HASH_AGG """
+
+    def __init__(self):
+        self.total = 0
+
+    def step(self, *values):
+        self.total = (self.total + _hash(*values)) % 2 ** 64
+
+    def finalize(self):
+        return self.total - 2 ** 64 if self.total >= 2 ** 63 else self.total
+
+
+
+class local_cursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cur = connection._db.cursor()
+        self.description = None
+        self.sfqid = None
+
+
+    def execute(self, sql, params = None, **kwargs):
+        with self.connection._lock:
+            self._cur.execute(_translate(sql), params or ())
+            self.description = self._cur.description
+        return self
+
+
+    def fetchone(self):
+        with self.connection._lock:
+            return self._cur.fetchone()
+
+
+    def fetchmany(self, size = 1000):
+        with self.connection._lock:
+            return self._cur.fetchmany(size)
+
+
+    def fetchall(self):
+        with self.connection._lock:
+            return self._cur.fetchall()
+
+
+    def fetch_pandas_batches(self, batch_rows = 10000):
+        columns = [col[0] for col in self.description]
+        while True:
+            rows = self.fetchmany(batch_rows)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=columns)
+
+
+    def fetch_pandas_all(self):
+        columns = [col[0] for col in self.description]
+        return pd.DataFrame(self.fetchall(), columns=columns)
+
+
+    def close(self):
+        self._cur.close()
+
+
+
+class local_connection:
+    """
+    A stand-in for a snowflake connection, backed by sqlite
+
+    Attributes:
+        path : str
+            sqlite database file, in memory by default
+
+    Understands the subset of snowflake sql snowmad.data_copy sends: fully quoted
+    "DB"."SCHEMA"."TABLE" names, TRUNCATE TABLE, HASH, HASH_AGG and MOD.
+    One connection can be shared by several threads, statements are serialized.
+    """
+
+    def __init__(self, path = ':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.create_function('hash', -1, _hash, deterministic=True)
+        self._db.create_function('mod', 2, lambda a, b: a % b, deterministic=True)
+        self._db.create_aggregate('hash_agg', -1, _hash_agg)
+        self._lock = threading.RLock()
+        self._closed = False
+
+
+    def cursor(self):
+        return local_cursor(self)
+
+
+    def create_table(self, database, schema, table, df):
+        """ creates (or replaces) a table with the contents of df """
+
+        with self._lock:
+            df.to_sql(f"{database}.{schema}.{table}", self._db, index=False, if_exists='replace')
+
+
+    def table(self, database, schema, table):
+        with self._lock:
+            return pd.read_sql(f'select * from "{database}.{schema}.{table}"', self._db)
+
+
+    def is_closed(self):
+        return self._closed
+
+
+    def close(self):
+        self._closed = True
+        self._db.close()
+
+
+
+def write_pandas(conn, df, table_name, database = None, schema = None, **kwargs):
+    """ snowflake.connector.pandas_tools.write_pandas for a local_connection """
+
+    name = ".".join(part for part in [database, schema, table_name] if part)
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    values = ", ".join("?" for _ in df.columns)
+
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].astype(str)
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+    with conn._lock:
+        conn._db.executemany(f'insert into "{name}" ({columns}) values ({values})', rows)
+
+    return True, 1, len(df), []
+
+
+
+class local_pool:
+    """ the connection_pool interface over one shared local_connection """
+
+    def __init__(self, connection = None, account = 'local'):
+        self.conn = connection or local_connection()
+        self.account = account
+        self.user = None
+        self.role = None
+
+
+    def acquire(self, timeout = None):
+        return self.conn
+
+
+    def release(self, conn, check = False):
+        pass
+
+
+    def invalidate(self, conn):
+        # the one connection is shared, it isn't replaced
+        pass
+
+
+    @contextmanager
+    def connection(self, timeout = None):
+        yield self.conn
+
+
+    def close(self):
+        self.conn.close()
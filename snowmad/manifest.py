@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+from datetime import timedelta
+
+import pandas as pd
+
+
+def ddl_hash(sql):
+    """ stable hash of a generated statement, whitespace differences are ignored """
+
+    return hashlib.sha256(" ".join(sql.split()).encode('utf-8')).hexdigest()
+
+
+def utc_timestamp(value):
+    """ a timestamp (or its string) as a tz-aware UTC timestamp, so values with different
+        offsets or precision compare correctly. naive timestamps are taken as UTC
+    """
+
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        return timestamp.tz_localize('UTC')
+    return timestamp.tz_convert('UTC')
+
+
+
+class replication_manifest:
+    """
+    A JSON file recording what was replicated to the target account, used for incremental runs
+
+    Attributes:
+        path : str
+            location of the manifest file. It is created on the first save
+        overlap_hours: int
+            watermarks are moved back by this many hours when used, to cover the
+            ingestion latency of the ACCOUNT_USAGE views
+
+    Manifest layout:
+        objects: {object_type: {name: {'hash': ddl hash, 'last_altered': str, 'statements': [hashes]}}}
+        watermarks: {view name: highest created_on seen}
+    """
+
+    def __init__(self, path, overlap_hours = 3):
+        self.path = path
+        self.overlap_hours = overlap_hours
+        self.objects = {}
+        self.watermarks = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+
+            self.objects = manifest.get('objects', {})
+            self.watermarks = manifest.get('watermarks', {})
+
+
+    def get(self, object_type, name):
+        return self.objects.get(object_type, {}).get(name)
+
+
+    def diff(self, object_type, name, sql):
+        """ returns 'new', 'changed' or None (unchanged) for a generated statement """
+
+        entry = self.get(object_type, name)
+        if entry is None:
+            return 'new'
+        if entry['hash'] != ddl_hash(sql):
+            return 'changed'
+        return None
+
+
+    def record(self, object_type, name, sql, last_altered = None, statements = None):
+        entry = {'hash': ddl_hash(sql)}
+        if last_altered is not None:
+            entry['last_altered'] = utc_timestamp(last_altered).isoformat()
+        if statements is not None:
+            entry['statements'] = [ddl_hash(statement) for statement in statements]
+
+        self.objects.setdefault(object_type, {})[name] = entry
+
+
+    def is_stale(self, object_type, name, last_altered):
+        """ true if the source object changed after it was last replicated """
+
+        entry = self.get(object_type, name)
+        if entry is None or 'last_altered' not in entry:
+            return True
+        return utc_timestamp(last_altered) > utc_timestamp(entry['last_altered'])
+
+
+    def watermark(self, view):
+        """ created_on lower bound for reading view, or None to read everything """
+
+        watermark = self.watermarks.get(view)
+        if watermark is None:
+            return None
+
+        watermark = utc_timestamp(watermark) - timedelta(hours=self.overlap_hours)
+        return watermark.isoformat(sep=' ')
+
+
+    def advance(self, view, created_on):
+        """ moves the watermark of view forward to created_on """
+
+        if created_on is None:
+            return
+        created_on = utc_timestamp(created_on)
+
+        current = self.watermarks.get(view)
+        if current is None or created_on > utc_timestamp(current):
+            self.watermarks[view] = created_on.isoformat(sep=' ')
+
+
+    def save(self):
+        """ writes the manifest atomically """
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'objects': self.objects, 'watermarks': self.watermarks}, f, indent=1, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+
+# one request sent to snowflake: a single statement, or a multi statement batch
+statement_record = namedtuple('statement_record', ['step', 'sql', 'start', 'seconds', 'sfqid', 'status',
+                                                   'errno', 'error', 'statements'])
+
+
+
+class statement_metrics:
+    """
+    Collects the latency, query id and outcome of every statement sent by execute_sql_list
+
+    Attributes:
+        sinks : list
+            callables that get every statement_record as it is recorded, e.g. a plain callback,
+            json_log_sink or prometheus_counters
+        keep_records : bool
+            keep the records in memory for summary(). the sinks get them either way
+
+    Thread safe, one instance can be shared by every step and worker of a run.
+    """
+
+    def __init__(self, sinks = None, keep_records = True):
+        self.sinks = list(sinks or [])
+        self.keep_records = keep_records
+        self.records = []
+        self._lock = threading.Lock()
+
+
+    def record(self, step, sql, start, seconds, sfqid = None, error = None, statements = 1):
+        record = statement_record(step if step is not None else 'statements', sql, start, seconds, sfqid,
+                                  'ok' if error is None else 'failed',
+                                  getattr(error, 'errno', None), str(error) if error is not None else None,
+                                  statements)
+
+        with self._lock:
+            if self.keep_records:
+                self.records.append(record)
+            for sink in self.sinks:
+                sink(record)
+
+        return record
+
+
+    def summary(self):
+        """ {step: {statements, failed, requests, seconds, p50, p95, p99, statements_per_second}}.
+            Percentiles are request latencies in seconds, throughput is statements per second
+            between the first request of the step starting and the last one finishing
+        """
+
+        with self._lock:
+            by_step = defaultdict(list)
+            for record in self.records:
+                by_step[record.step].append(record)
+
+        summary = {}
+        for step, records in by_step.items():
+            latencies = np.array([record.seconds for record in records])
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+            wall = max(record.start + record.seconds for record in records) - min(record.start for record in records)
+            statements = sum(record.statements for record in records)
+
+            summary[step] = {
+                'statements': statements,
+                'failed': sum(record.statements for record in records if record.status == 'failed'),
+                'requests': len(records),
+                'seconds': float(latencies.sum()),
+                'p50': p50, 'p95': p95, 'p99': p99,
+                'statements_per_second': statements / wall if wall > 0 else float(statements),
+            }
+
+        return summary
+
+
+    def slowest(self, n = 10):
+        """ the n slowest requests, slowest first """
+
+        with self._lock:
+            return sorted(self.records, key=lambda record: record.seconds, reverse=True)[:n]
+
+
+    def print_summary(self):
+        for step, stats in self.summary().items():
+            print(f"{step}: {stats['statements']} statements ({stats['failed']} failed), "
+                  f"p50 {stats['p50'] * 1000:.0f}ms p95 {stats['p95'] * 1000:.0f}ms p99 {stats['p99'] * 1000:.0f}ms, "
+                  f"{stats['statements_per_second']:.1f} statements/s")
+
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+
+
+class json_log_sink:
+    """ writes every statement_record as one JSON line to path """
+
+    def __init__(self, path, include_sql = True):
+        self.path = path
+        self.include_sql = include_sql
+        self._lock = threading.Lock()
+
+
+    def __call__(self, record):
+        entry = record._asdict()
+        if not self.include_sql:
+            entry.pop('sql')
+
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+
+
+class prometheus_counters:
+    """
+    Prometheus style counters and latency histograms per step and status
+
+    Attributes:
+        prefix : str
+            metric name prefix
+        buckets : list
+            upper bounds of the latency histogram buckets, in seconds
+
+    render() returns the metrics in the Prometheus text exposition format,
+    e.g. for a textfile collector or an http handler.
+    """
+
+    def __init__(self, prefix = 'snowmad', buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)):
+        self.prefix = prefix
+        self.buckets = list(buckets)
+        self.statements = defaultdict(int)
+        self.requests = defaultdict(int)
+        self.latency_buckets = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.latency_sum = defaultdict(float)
+        self._lock = threading.Lock()
+
+
+    def __call__(self, record):
+        key = (record.step, record.status)
+        with self._lock:
+            self.statements[key] += record.statements
+            self.requests[key] += 1
+            self.latency_sum[record.step] += record.seconds
+
+            counts = self.latency_buckets[record.step]
+            for i, bound in enumerate(self.buckets):
+                if record.seconds <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+
+
+    def render(self):
+        prefix = self.prefix
+        lines = [f"# TYPE {prefix}_statements_total counter"]
+
+        with self._lock:
+            for (step, status), count in sorted(self.statements.items()):
+                lines.append(f'{prefix}_statements_total{{step="{step}",status="{status}"}} {count}')
+
+            lines.append(f"# TYPE {prefix}_requests_total counter")
+            for (step, status), count in sorted(self.requests.items()):
+                lines.append(f'{prefix}_requests_total{{step="{step}",status="{status}"}} {count}')
+
+            lines.append(f"# TYPE {prefix}_request_seconds histogram")
+            for step, counts in sorted(self.latency_buckets.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{prefix}_request_seconds_bucket{{step="{step}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_request_seconds_bucket{{step="{step}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'{prefix}_request_seconds_sum{{step="{step}"}} {self.latency_sum[step]}')
+                lines.append(f'{prefix}_request_seconds_count{{step="{step}"}} {counts[-1]}')
+
+        return "\n".join(lines) + "\n"
+
+
+    def write(self, path):
+        """ writes render() for a node_exporter textfile collector """
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
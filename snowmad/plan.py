@@ -0,0 +1,106 @@
+import json
+import threading
+
+from .manifest import ddl_hash
+
+
+
+class sql_plan:
+    """
+    The statements a copy_account run would send to the target account, collected without touching it
+
+    Attributes:
+        order : list
+            step names in the order they are applied. steps that aren't listed
+            go after the listed ones, in the order they were first added
+
+    Statements are kept per step and de-duplicated across the plan (first occurrence wins).
+    Within a step, statements added with a unit (a database, or a database.schema) are ordered
+    by unit, so a plan that workers built concurrently comes out in the same order every run.
+    Statements added without a unit keep the order they were added in, ahead of the units.
+    """
+
+    def __init__(self, order = None):
+        self.order = list(order or [])
+        self._steps = {}
+        self._statements = None
+        self._lock = threading.Lock()
+
+
+    def add(self, step, sql_list, unit = None):
+        with self._lock:
+            chunks = self._steps.setdefault(step, [])
+            chunks.append((unit, len(chunks), list(sql_list)))
+            self._statements = None
+
+
+    def steps(self):
+        listed = [step for step in self.order if step in self._steps]
+        return listed + [step for step in self._steps if step not in self.order]
+
+
+    def statements(self):
+        """ ordered, de-duplicated (step, sql) pairs """
+
+        with self._lock:
+            if self._statements is not None:
+                return list(self._statements)
+
+            seen = set()
+            statements = []
+            for step in self.steps():
+                chunks = sorted(self._steps[step], key = lambda chunk: (chunk[0] is not None, chunk[0] or '', chunk[1]))
+                for _, _, sql_list in chunks:
+                    for sql in sql_list:
+                        key = ddl_hash(sql)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        statements.append((step, sql))
+
+            self._statements = statements
+            return list(statements)
+
+
+    def step_statements(self):
+        """ {step: [sql, ...]} in plan order """
+
+        by_step = {}
+        for step, sql in self.statements():
+            by_step.setdefault(step, []).append(sql)
+        return by_step
+
+
+    def __len__(self):
+        self.statements()
+        return len(self._statements)
+
+
+    def to_sql(self, path):
+        """ writes the plan as a reviewable .sql script, one comment header per step """
+
+        with open(path, 'w') as f:
+            for step, sql_list in self.step_statements().items():
+                f.write(f"-- step: {step} ({len(sql_list)} statements)\n")
+                for sql in sql_list:
+                    f.write(sql.strip().rstrip(";") + ";\n")
+                f.write("\n")
+
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'order': self.steps(),
+                       'statements': [{'step': step, 'sql': sql} for step, sql in self.statements()]},
+                      f, indent=1)
+
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, 'r') as f:
+            saved = json.load(f)
+
+        plan = cls(saved['order'])
+        for statement in saved['statements']:
+            plan.add(statement['step'], [statement['sql']])
+
+        return plan
@@ -0,0 +1,204 @@
+import configparser
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import snowflake.connector
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+
+def read_credentials(config_file, config_name, conn_type):
+    """ Reads one account from the config file and returns the snowflake.connector.connect arguments.
+        For 'private_key' the key is loaded and serialized here, so it only happens once per pool
+    """
+
+    credentials = configparser.ConfigParser()
+    credentials.read(config_file)
+    section = credentials[config_name]
+
+    connect_args = {
+        'user': section['user'],
+        'account': section['account'],
+    }
+
+    # the terraform config has no warehouse
+    if section.get('warehouse'):
+        connect_args['warehouse'] = section['warehouse']
+
+    # without a role the session runs as the user's default role
+    if section.get('role'):
+        connect_args['role'] = section['role']
+
+    if conn_type == 'password':
+        connect_args['password'] = section['password']
+
+    if conn_type == 'private_key':
+        with open(section['private_key'], "rb") as key_file:
+            p_key = serialization.load_pem_private_key(
+                key_file.read(),
+                password=None,
+                backend=default_backend()
+            )
+
+        connect_args['private_key'] = p_key.private_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption())
+
+    return connect_args
+
+
+
+class connection_pool:
+    """
+    A pool of warm connections to one snowflake account
+
+    Attributes:
+        config_file : str
+            the path of the config file that contains the snowflake credentials
+        config_name : str
+            the name of the header in the config file for the account
+        conn_type : str
+            authentication type. can be 'password' or 'private_key'
+        size : int
+            maximum number of connections open at the same time
+        keep_alive : bool
+            keep sessions alive while connections sit idle in the pool
+        health_check_after : int
+            connections idle for longer than this many seconds are checked with 'select 1'
+            before they are handed out again
+    """
+
+    def __init__(self,
+                 config_file,
+                 config_name,
+                 conn_type = 'password',
+                 size = 4,
+                 keep_alive = True,
+                 health_check_after = 300):
+
+        self.connect_args = read_credentials(config_file, config_name, conn_type)
+        self.account = self.connect_args['account']
+        self.user = self.connect_args['user']
+        self.role = self.connect_args.get('role')
+        self.size = size
+        self.keep_alive = keep_alive
+        self.health_check_after = health_check_after
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+
+    def _connect(self):
+        return snowflake.connector.connect(**self.connect_args,
+                                           client_session_keep_alive = self.keep_alive)
+
+
+    def _healthy(self, conn, idle_since):
+        if conn.is_closed():
+            return False
+
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+
+        cur = None
+        try:
+            cur = conn.cursor()
+            cur.execute("select 1").fetchall()
+            return True
+        except Exception:
+            return False
+        finally:
+            if cur is not None:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+
+
+    def acquire(self, timeout = None):
+        """ Hands out an idle connection, or opens a new one while the pool is below size """
+
+        if not self._slots.acquire(timeout = timeout):
+            raise TimeoutError(f"no connection to {self.account} available after {timeout}s")
+
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+
+                if self._healthy(conn, idle_since):
+                    return conn
+
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        except Exception:
+            self._slots.release()
+            raise
+
+
+    def release(self, conn, check = False):
+        """ Returns a connection to the pool. Closed connections are dropped.
+            check: health check the connection before it is handed out again
+        """
+
+        try:
+            if self._closed:
+                conn.close()
+            elif not conn.is_closed():
+                # idle since forever, so the next acquire runs the health check
+                self._idle.put((conn, float('-inf') if check else time.monotonic()))
+        finally:
+            self._slots.release()
+
+
+    def invalidate(self, conn):
+        """ Closes a connection that failed and frees its slot, instead of returning it to the pool """
+
+        try:
+            conn.close()
+        except Exception:
+            pass
+        finally:
+            self._slots.release()
+
+
+    @contextmanager
+    def connection(self, timeout = None):
+        """ with pool.connection() as conn: ...
+            a connection that raised is health checked before it is handed out again
+        """
+
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, check = True)
+            raise
+        else:
+            self.release(conn)
+
+
+    def close(self):
+        """ Closes the idle connections. Connections still checked out are closed when they are released """
+
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,299 @@
+import hashlib
+import os
+import threading
+import time
+
+import pyarrow as pa
+
+
+def source_key(account, user, role = None):
+    """ who a snapshot was read as. SHOW and ACCOUNT_USAGE results depend on the privileges
+        of the user and role, so the same query has a snapshot per account, user and role.
+        role None is the user's default role
+    """
+
+    return f"{account}/{user}/{role or ''}"
+
+
+
+class snapshot_cache:
+    """
+    A local cache of metadata query results, stored as Arrow IPC files
+
+    Attributes:
+        directory : str
+            where the snapshot files are kept. created if it doesn't exist
+        ttl : int
+            seconds a snapshot is used for before the query is run again
+        max_bytes : int
+            total size of the snapshot files. the least recently used snapshots
+            are removed once it is exceeded
+
+    Snapshots are keyed by source (see source_key) and query text, and are read back memory mapped.
+    """
+
+    def __init__(self, directory, ttl = 3600, max_bytes = 1024 ** 3):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        os.makedirs(directory, exist_ok = True)
+
+        # running total of the snapshot sizes, so a put only scans the directory when it's over max_bytes
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.evict()
+
+
+    def _path(self, source, sql):
+        key = hashlib.sha256(f"{source}\n{' '.join(sql.split())}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{key}.arrow")
+
+
+    def _fresh(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime < self.ttl
+        except FileNotFoundError:
+            return False
+
+
+    def get_table(self, source, sql):
+        """ the snapshot as a memory mapped arrow table, or None if there is no fresh snapshot """
+
+        path = self._path(source, sql)
+        if not self._fresh(path):
+            return None
+
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+        # access time drives eviction, modification time drives the ttl
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except FileNotFoundError:
+            pass
+        return table
+
+
+    def get(self, source, sql):
+        """ the snapshot as a DataFrame, or None if there is no fresh snapshot """
+
+        table = self.get_table(source, sql)
+        return table.to_pandas() if table is not None else None
+
+
+    def put(self, source, sql, df):
+        """ stores df as the snapshot of sql """
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index = False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError) as error:
+            print(f"snapshot not saved: {error}")
+            return
+
+        self.put_table(source, sql, table)
+
+
+    def put_rows(self, source, sql, rows):
+        """ stores a list of row dicts as the snapshot of sql """
+
+        try:
+            table = pa.Table.from_pylist(rows)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError) as error:
+            print(f"snapshot not saved: {error}")
+            return
+
+        self.put_table(source, sql, table)
+
+
+    def put_table(self, source, sql, table):
+        path = self._path(source, sql)
+        table = table.replace_schema_metadata({'source': source, 'sql': sql})
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        self._added(path)
+
+
+    def writer(self, source, sql):
+        """ a snapshot_writer that stores the snapshot of sql batch by batch """
+
+        return snapshot_writer(self, source, sql)
+
+
+    def _added(self, path):
+        with self._lock:
+            self._bytes += os.path.getsize(path)
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+
+
+    def fetch(self, source, sql, fetch_fn):
+        """ the snapshot of sql if it is fresh, otherwise fetch_fn() which is then stored """
+
+        df = self.get(source, sql)
+        if df is not None:
+            return df
+
+        df = fetch_fn()
+        self.put(source, sql, df)
+        return df
+
+
+    def evict(self):
+        """ removes expired snapshots, then the least recently used ones above max_bytes """
+
+        snapshots = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.arrow'):
+                continue
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+
+            if time.time() - stat.st_mtime >= self.ttl:
+                self._remove(entry.path)
+            else:
+                snapshots.append((stat.st_atime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in snapshots)
+        for _, size, path in sorted(snapshots):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+        with self._lock:
+            self._bytes = total
+
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.arrow'):
+                self._remove(entry.path)
+
+        with self._lock:
+            self._bytes = 0
+
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+
+class snapshot_writer:
+    """
+    Writes a snapshot as its rows arrive, one record batch at a time, so a result
+    doesn't have to be held in memory to be cached
+
+    Attributes:
+        cache : snapshot_cache
+            the cache the snapshot goes in
+        source : str
+            see source_key
+        sql : str
+            the query the rows are the result of
+
+    The snapshot only replaces the cached one on commit. Used as a context manager
+    it commits when the block finishes and is discarded when it raises, so a result
+    that wasn't read to the end isn't cached.
+    """
+
+    def __init__(self, cache, source, sql):
+        self.cache = cache
+        self.source = source
+        self.sql = sql
+
+        self._path = cache._path(source, sql)
+        self._tmp_path = f"{self._path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._schema = None
+        self._sink = None
+        self._writer = None
+        self._failed = False
+        self._committed = False
+
+
+    def write_rows(self, rows):
+        """ appends a batch of row dicts. the first batch sets the column types,
+            a batch that doesn't fit them discards the snapshot
+        """
+
+        if self._failed or not rows:
+            return
+
+        try:
+            if self._writer is None:
+                # a column that is null all through the first batch has no type yet,
+                # it's stored as strings like most SHOW columns
+                schema = pa.RecordBatch.from_pylist(rows).schema
+                schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                    for field in schema])
+                self._schema = schema.with_metadata({'source': self.source, 'sql': self.sql})
+                self._sink = pa.OSFile(self._tmp_path, 'wb')
+                self._writer = pa.ipc.new_file(self._sink, self._schema)
+
+            self._writer.write_batch(pa.RecordBatch.from_pylist(rows, schema = self._schema))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError) as error:
+            print(f"snapshot not saved: {error}")
+            self.abort()
+
+
+    def commit(self):
+        """ closes the snapshot and makes it the cached one """
+
+        if self._failed or self._committed:
+            return
+        self._committed = True
+
+        if self._writer is None:
+            # no rows, the snapshot is an empty table
+            self.cache.put_table(self.source, self.sql, pa.table({}))
+            return
+
+        self._close()
+        os.replace(self._tmp_path, self._path)
+        self.cache._added(self._path)
+
+
+    def abort(self):
+        """ discards what was written. does nothing once the snapshot is committed """
+
+        if self._committed:
+            return
+        self._failed = True
+        self._close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -1,81 +1,196 @@
+import numpy as np
 import pandas as pd
 import snowflake.connector 
-import configparser
 import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives.asymmetric import dsa
-from cryptography.hazmat.primitives import serialization
+from . import ddl
+from .checkpoint import checkpoint_journal
+from .data_copy import table_copy, quote_name
+from .grants import grant_diff, object_names, user_grant_keys, role_grant_keys, object_grant_keys, revoke_sql
+from .manifest import replication_manifest, ddl_hash
+from .plan import sql_plan
+from .pool import connection_pool, read_credentials
+from .snapshot import snapshot_cache, source_key
+from .teardown import drop_plan, teardown
+from .throttle import is_retryable
 
 
 def parse_credentials(config_file, config_name, conn_type):
     """ helper function to connect to source and target snowflake accounts"""
     
-    credentials = configparser.ConfigParser()
-    credentials.read(config_file)
+    connect_args = read_credentials(config_file, config_name, conn_type)
     
-    user = credentials[config_name]['user']
-    account = credentials[config_name]['account']
-    warehouse = credentials[config_name]['warehouse']
-    
-    if conn_type == 'password':
-        password = credentials[config_name]['password']
+    conn = snowflake.connector.connect(**connect_args)
+    cur = conn.cursor()
 
-        conn = snowflake.connector.connect(
-                user = user,
-                password = password,
-                account = account,
-                warehouse = warehouse
-            )
+    return conn, cur, connect_args['account']
 
-        cur = conn.cursor()
-    
-    if conn_type == 'private_key':
-        pkb_key_path = credentials[config_name]['private_key']
-        
-        with open(pkb_key_path, "rb") as key_file:
-            p_key = serialization.load_pem_private_key(
-                key_file.read(),
-                password=None,
-                backend=default_backend()
-            )
 
-        pkb = p_key.private_bytes(
-            encoding=serialization.Encoding.DER,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption())
+def execute_sql_list(sql_list, cursor, return_sql = False, return_errors = True, batch_size = None,
+                     metrics = None, step = None, errors = None):
+    """ Execute sql statements and skip any that can't be executed
+        - batch_size: when set, statements are sent batch_size at a time as one multi
+          statement request. A batch stops at the first statement that fails: that statement
+          is reported as before and the batch resumes after it. If it can't be told which
+          statement failed, the rest of the batch is run one statement at a time
+        - metrics: a snowmad.metrics.statement_metrics that gets the latency, query id
+          and outcome of every request, recorded under step
+        - errors: a list that gets (sql, error) for every statement that couldn't be executed
+    """
+    
+    # todo:
+    # handle exceptions better
+    # always give option to skip objects that can't be created
+    # put return sql option here as well
+    
+    if not batch_size or batch_size <= 1:
+        _execute_statements(sql_list, cursor, return_sql, return_errors, metrics, step, errors)
+        return
+    
+    for i in range(0, len(sql_list), batch_size):
+        batch = sql_list[i:i + batch_size]
         
+        while batch:
+            if len(batch) == 1:
+                _execute_statements(batch, cursor, return_sql, return_errors, metrics, step, errors)
+                break
+            
+            failed = _execute_batch(batch, cursor, return_sql, metrics, step)
+            if failed is None:
+                break
+            
+            index, error = failed
+            if index is None:
+                _execute_statements(batch, cursor, return_sql, return_errors, metrics, step, errors)
+                break
+            
+            # the statements before index ran, the rest of the batch didn't
+            if errors is not None:
+                errors.append((batch[index], error))
+            if return_errors:
+                print(error)
+                print(f"Could not execute: {batch[index]}")
+            batch = batch[index + 1:]
+            
+            
+def _execute_batch(sql_list, cursor, return_sql = False, metrics = None, step = None):
+    """ Execute a list of statements in a single multi statement request.
+        Returns None if it succeeded, otherwise (index, error) with the index in sql_list of
+        the statement that failed, or None for the index if that isn't known.
+        A batch that failed partway is recorded in metrics as the statements that ran and the one that failed
+    """
+    
+    kept = [i for i, sql in enumerate(sql_list) if sql.strip().rstrip(";").strip()]
+    statements = [sql_list[i].strip().rstrip(";").strip() for i in kept]
+    if not statements:
+        return None
+    batch_sql = ";\n".join(statements)
+    
+    start = time.time()
+    try:
+        if return_sql:
+            print(f"Executing batch of {len(statements)}: ", batch_sql)
+        cursor.execute(batch_sql, num_statements=len(statements))
         
-        conn = snowflake.connector.connect(
-            user = user,
-            account = account,
-            private_key=pkb,
-            warehouse = warehouse
-        )
+    except Exception as error:
+        seconds = time.time() - start
+        progress = _batch_progress(cursor, getattr(error, 'sfqid', None), statements, start)
         
-        cur = conn.cursor()
-
-    return conn, cur, account
+        if progress is None:
+            # the statements are counted when they are re-run one at a time
+            if metrics is not None:
+                metrics.record(step, batch_sql, start, seconds, getattr(error, 'sfqid', None), error, statements = 0)
+            if return_sql:
+                print(error)
+                print("Batch failed, executing statements one at a time")
+            return None, error
+        
+        index, ran_seconds, failed_seconds, failed_sfqid = progress
+        if metrics is not None:
+            if index:
+                metrics.record(step, ";\n".join(statements[:index]), start, ran_seconds, error.sfqid,
+                               statements = index)
+            metrics.record(step, statements[index], start + ran_seconds, failed_seconds, failed_sfqid, error)
+        if return_sql:
+            print(f"Batch failed at statement {index + 1} of {len(statements)}, resuming after it")
+        return kept[index], error
+    
+    if metrics is not None:
+        metrics.record(step, batch_sql, start, time.time() - start, cursor.sfqid, statements = len(statements))
+    
+    return None
 
 
-def execute_sql_list(sql_list, cursor, return_sql = False, return_errors = True):
-    """ Execute sql statements and skip any that can't be executed """
+def _batch_progress(cursor, batch_sfqid, statements, start):
+    """ Where a failed multi statement request stopped: (index of the statement that failed,
+        seconds the statements before it ran, seconds of the failed one, its query id).
+        The connector only hands out the child query ids of a batch that succeeded, so the
+        children are read from the session's query history: they run in order after their parent.
+        Other cursors of the connection share the session, their queries in between are skipped.
+        None if the children can't be matched with the statements
+    """
     
-    # todo:
-    # handle exceptions better
-    # always give option to skip objects that can't be created
-    # put return sql option here as well
+    if batch_sfqid is None:
+        return None
+    
+    # qualified with the SNOWFLAKE database, target sessions have no current database.
+    # queries that ended before the batch started (less a margin for clock skew) aren't read
+    try:
+        cursor.execute(f"""select query_id, query_text, execution_status, total_elapsed_time
+                           from table(snowflake.information_schema.query_history_by_session(
+                               end_time_range_start => to_timestamp_ltz({int(start) - 60}),
+                               result_limit => 10000))
+                           order by start_time""")
+        history = cursor.fetchall()
+    except Exception:
+        return None
+    
+    query_ids = [row[0] for row in history]
+    if batch_sfqid not in query_ids:
+        return None
+    
+    index = 0
+    ran_seconds = 0.0
+    for query_id, query_text, status, elapsed_ms in history[query_ids.index(batch_sfqid) + 1:]:
+        if " ".join((query_text or "").strip().rstrip(";").split()) != " ".join(statements[index].split()):
+            continue
+        if status != 'SUCCESS':
+            return index, ran_seconds, (elapsed_ms or 0) / 1000, query_id
+        
+        ran_seconds += (elapsed_ms or 0) / 1000
+        index += 1
+        if index == len(statements):
+            return None
+    
+    return None
+    
+    
+def _execute_statements(sql_list, cursor, return_sql = False, return_errors = True, metrics = None, step = None,
+                        errors = None):
+    """ Execute sql statements one at a time """
     
     for sql in sql_list:
+        start = time.time()
         try:
             if return_sql:
                 print("Executing: ", sql)
                 cursor.execute(sql)
             else:
                 cursor.execute(sql)
+            
+            if metrics is not None:
+                metrics.record(step, sql, start, time.time() - start, cursor.sfqid)
 
         except snowflake.connector.errors.ProgrammingError as e:
+            if metrics is not None:
+                metrics.record(step, sql, start, time.time() - start, e.sfqid, e)
+            if errors is not None:
+                errors.append((sql, e))
+            
             if return_errors:
                 print(e)
                 print('Error {0} ({1}): {2} ({3})'.format(e.errno, e.sqlstate, e.msg, e.sfqid))
@@ -85,6 +200,11 @@ def execute_sql_list(sql_list, cursor, return_sql = False, return_errors = True)
             continue
 
         except Exception as error:
+            if metrics is not None:
+                metrics.record(step, sql, start, time.time() - start, getattr(error, 'sfqid', None), error)
+            if errors is not None:
+                errors.append((sql, error))
+            
             if return_errors:
                 print(error)
                 print("Could not create grants for users")
@@ -93,22 +213,272 @@ def execute_sql_list(sql_list, cursor, return_sql = False, return_errors = True)
             continue
     
     
-def fetch_data_df(sql, connection):
-    # fetch data from source account in a dataframe
+def execute_plan(plan, cursor, return_sql = False, return_errors = True, batch_size = 100, metrics = None):
+    """ Applies a sql_plan step by step, in plan order """
+    
+    for step, sql_list in plan.step_statements().items():
+        if return_sql:
+            print(f"Applying step: {step} ({len(sql_list)} statements)")
+        execute_sql_list(sql_list, cursor, return_sql = return_sql, return_errors = return_errors,
+                         batch_size = batch_size, metrics = metrics, step = step)
+    
+    
+def iter_data_batches(sql, connection, columns = None, batch_rows = 10000):
+    """ Yields the result of sql as DataFrames, one per arrow result batch, so large
+        views can be processed as a stream
+        - columns: only these columns are returned. select queries are projected in
+          snowflake, other statements (show, describe) client side
+        - SHOW / DESCRIBE results aren't returned as arrow, they are read batch_rows rows at a time
+    """
+    
+    if columns is not None and re.match(r"\s*(select|with)\b", sql, re.IGNORECASE):
+        sql = f"""select {", ".join(columns)} from ({sql.strip().rstrip(";")})"""
+        columns = None
+        
+    cur = connection.cursor()
     try:
-        df = pd.read_sql(sql, connection)
+        cur.execute(sql)
+        
+        try:
+            batches = cur.fetch_pandas_batches()
+        except snowflake.connector.errors.NotSupportedError:
+            batches = _row_batches(cur, batch_rows)
+            
+        for batch in batches:
+            yield batch if columns is None else batch[columns]
+            
+    finally:
+        cur.close()
+        
+        
+def _row_batches(cur, batch_rows):
+    names = [col[0] for col in cur.description]
+    
+    while True:
+        rows = cur.fetchmany(batch_rows)
+        if not rows:
+            break
+        yield pd.DataFrame(rows, columns=names)
+    
+    
+def fetch_data_df(sql, connection, columns = None):
+    # fetch data from source account in a dataframe, built from arrow result batches
+    try:
+        batches = list(iter_data_batches(sql, connection, columns))
+        
+        if batches:
+            df = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+        else:
+            # empty result: no batches, but keep the columns
+            df = pd.DataFrame(columns=columns or _result_columns(sql, connection))
 
     except snowflake.connector.errors.ProgrammingError as e:
         print(e)
         print('Error {0} ({1}): {2} ({3})'.format(e.errno, e.sqlstate, e.msg, e.sfqid))
+        raise
 
     except Exception as error:
         print(error)
         print(f"fetching data failed for: \n  {sql}")
+        raise
         
     return df
 
 
+def _result_columns(sql, connection):
+    cur = connection.cursor()
+    try:
+        return [col.name for col in cur.describe(sql)]
+    finally:
+        cur.close()
+
+
+def replicated_databases(df_db, db_ignore_list):
+    """ names of the databases of a 'show databases' frame that are replicated """
+    
+    # Don't include default snowflake databases:
+    df_db = df_db[(df_db['name'] != 'SNOWFLAKE') & (df_db['name'] != 'SNOWFLAKE_SAMPLE_DATA')]
+    
+    # Don't include shares (origin is other than your account)
+    df_db = df_db[df_db['origin'] == ""]
+    
+    # Don't include databases on the ignore list:
+    return df_db[~df_db['name'].isin(db_ignore_list)]['name'].unique().tolist()
+
+
+# ACCOUNT_USAGE views read by transcribe_account, loaded with only the columns
+# and filters a run needs. Each view is read once per run, see transcribe_account.account_usage
+account_usage_views = {
+    'roles': {
+        'columns': ['NAME'],
+        # don't re-create default roles
+        'filter': """deleted_on is null and
+                     name not in ('PUBLIC', 'ACCOUNTADMIN', 'SECURITYADMIN', 
+                                  'ORGADMIN', 'USERADMIN', 'SYSADMIN')"""
+    },
+    'users': {
+        'columns': ['NAME', 'LOGIN_NAME', 'DISPLAY_NAME', 'DEFAULT_ROLE', 'EMAIL'],
+        ## Ingore default snowflake role and the user who was used to create the account
+        'filter': """deleted_on is null and
+                     name not like 'SNOWFLAKE' and
+                     created_on not in (SELECT min(created_on) FROM snowflake.account_usage.users)"""
+    },
+    'grants_to_users': {
+        'columns': ['ROLE', 'GRANTEE_NAME', 'CREATED_ON'],
+        'filter': "deleted_on is null",
+        # incremental runs only read grants created after the manifest watermark
+        'watermark': 'CREATED_ON'
+    },
+    # shared by role_role_grants (granted_on = ROLE) and role_object_grants
+    'grants_to_roles': {
+        'columns': ['PRIVILEGE', 'GRANTED_ON', 'NAME', 'TABLE_CATALOG', 'TABLE_SCHEMA', 'GRANTEE_NAME', 'CREATED_ON'],
+        'filter': """deleted_on is null and
+                     granted_on in ('ROLE', 'WAREHOUSE', 'DATABASE', 'SCHEMA', 'TABLE', 'VIEW') and
+                     (granted_on = 'ROLE' or name not in ('SNOWFLAKE_SAMPLE_DATA', 'SNOWFLAKE'))""",
+        'watermark': 'CREATED_ON'
+    },
+}
+
+
+def account_usage_sql(view, since = None):
+    """ Builds the projected + filtered query for one of the account_usage_views.
+        since: only read rows newer than this timestamp (views with a watermark column)
+    """
+    
+    columns = ", ".join(account_usage_views[view]['columns'])
+    where = account_usage_views[view]['filter']
+    
+    if since is not None:
+        where += f" and {account_usage_views[view]['watermark']} > '{since}'::timestamp_ltz"
+    
+    return f"""select {columns} from snowflake.account_usage.{view}
+                where {where};"""
+
+
+# latest change per database, including changes to the schemas and tables inside it
+database_last_altered_sql = """select database_name as name, max(last_altered) as last_altered from (
+                                    select database_name, last_altered from snowflake.account_usage.databases where deleted is null
+                                    union all
+                                    select catalog_name, last_altered from snowflake.account_usage.schemata where deleted is null
+                                    union all
+                                    select table_catalog, last_altered from snowflake.account_usage.tables where deleted is null
+                                  )
+                                  group by database_name;"""
+
+
+def role_sql(df_roles):
+    """ CREATE OR REPLACE ROLE statements for an account_usage.roles frame """
+    
+    return [f"""CREATE OR REPLACE ROLE {role}""" for role in df_roles['NAME'].tolist()]
+
+
+def warehouse_sql(df_wh):
+    """ CREATE OR REPLACE and ALTER statements for a 'show warehouses' frame, created with: name, size """
+    
+    columns = list(zip(df_wh['name'].tolist(), df_wh['size'].tolist()))
+    
+    create_sql = [f"""CREATE OR REPLACE warehouse {wh} warehouse_size='{size}' initially_suspended=true;""" \
+                  for wh, size in columns]
+    alter_sql = [f"""ALTER warehouse {wh} SET warehouse_size='{size}';""" for wh, size in columns]
+    
+    return create_sql, alter_sql
+
+
+def user_role_grant_sql(df_user_grants):
+    """ GRANT ROLE ... TO USER statements for a grants_to_users frame """
+    
+    return [f"""GRANT ROLE "{role}" TO USER "{user}";""" \
+            for role, user in zip(df_user_grants['ROLE'].tolist(), df_user_grants['GRANTEE_NAME'].tolist())]
+
+
+def role_role_grant_sql(df_grants):
+    """ GRANT ROLE ... TO ROLE statements for the role grants of a grants_to_roles frame """
+    
+    # just looking at roles in this step
+    df_role_grants = df_grants[df_grants['GRANTED_ON'] == 'ROLE']
+    
+    return [f"""GRANT ROLE "{role_source}" TO ROLE "{role_target}";""" \
+            for role_source, role_target in zip(df_role_grants['NAME'].tolist(), df_role_grants['GRANTEE_NAME'].tolist())]
+
+
+user_properties = ['login_name', 'display_name', 'default_role', 'email']
+
+
+def user_sql(df_users):
+    """ CREATE OR REPLACE USER and ALTER USER statements for an account_usage.users frame.
+        Columns are pulled out once and the statements are rendered in a single pass,
+        returns two lists in the order of df_users: a create statement per user, and per user
+        a tuple of alter statements (SET the properties that have a value, UNSET the null ones)
+    """
+    
+    password = "'abc123'"
+    
+    names = df_users['NAME'].tolist()
+    columns = [_nulls_to_none(df_users[prop.upper()]) for prop in user_properties]
+    
+    # optional properties are left out for nulls
+    properties = [((f"login_name='{login_name}'" if login_name is not None else "") + " " +
+                   (f" display_name='{display_name}'" if display_name is not None else "") + " " +
+                   (f" default_role={default_role}" if default_role is not None else "") + " " +
+                   (f" email='{email}'" if email is not None else "")).strip()
+                  for login_name, display_name, default_role, email in zip(*columns)]
+    unset = [((" login_name," if login_name is None else "") +
+              (" display_name," if display_name is None else "") +
+              (" default_role," if default_role is None else "") +
+              (" email," if email is None else "")).strip(" ,")
+             for login_name, display_name, default_role, email in zip(*columns)]
+    
+    create_sql = [f"""CREATE OR REPLACE USER "{name}" password={password} {props}""" for name, props in zip(names, properties)]
+    # tuples rather than lists: a list per user is a lot of work for the garbage collector
+    alter_sql = [(f"""ALTER USER "{name}" SET {props}""", f"""ALTER USER "{name}" UNSET {nulls}""") if props and nulls else
+                 (f"""ALTER USER "{name}" SET {props}""",) if props else
+                 (f"""ALTER USER "{name}" UNSET {nulls}""",)
+                 for name, props, nulls in zip(names, properties, unset)]
+    
+    return create_sql, alter_sql
+
+
+supported_object_types = ['WAREHOUSE', 'DATABASE', 'SCHEMA', 'TABLE', 'VIEW']
+
+
+def object_grant_sql(df_obj_grants):
+    """ GRANT statements for a grants_to_roles frame of supported object types.
+        The object names (grants.object_names) and the OWNERSHIP suffix are picked column wise (np.where),
+        then the statements are rendered in a single pass. Returns a list in the order of df_obj_grants
+    """
+    
+    # some restrictions on granting ownership
+    suffixes = np.where(df_obj_grants['PRIVILEGE'].to_numpy() == 'OWNERSHIP', " REVOKE CURRENT GRANTS; ", "; ").tolist()
+    
+    columns = zip(df_obj_grants['PRIVILEGE'].tolist(), df_obj_grants['GRANTED_ON'].tolist(), object_names(df_obj_grants),
+                  df_obj_grants['GRANTEE_NAME'].tolist(), suffixes)
+    
+    return [f"GRANT {privilege} ON {object_type} {name} TO ROLE  {grantee}{suffix}"
+            for privilege, object_type, name, grantee, suffix in columns]
+
+
+def _nulls_to_none(values):
+    """ column as a list with every null (None / NaN / NA) as None """
+    
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+# copy_account steps and the steps each one depends on.
+# steps without a path between them run concurrently
+copy_steps = {
+    'database_objects': [],
+    'users': [],
+    'roles': [],
+    'warehouses': [],
+    'user_role_grants': ['users', 'roles'],
+    'role_role_grants': ['roles'],
+    'role_object_grants': ['roles', 'warehouses', 'database_objects'],
+}
+
+# steps whose statements don't depend on each other and can be sent concurrently
+independent_steps = ['users', 'roles', 'warehouses', 'user_role_grants', 'role_role_grants', 'role_object_grants']
+
+
         
 class transcribe_account:
     """
@@ -128,8 +498,64 @@ class transcribe_account:
             source account authentication type. can be 'password' or 'private_key
         db_ingore_list: list
             list of database names that should not be replicated
+        ddl_filter: snowmad.ddl.ddl_filter
+            picks which statements of each database's get_ddl output are replicated.
+            the default leaves out procedures, functions, stages, streams, tasks, file formats,
+            views, pipes, masking policies and tables with foreign keys or masking policies
         return_sql: bool
             if true all of the sql statements that are executed will be printed
+        workers: int
+            number of databases to replicate concurrently in database_objects.
+            each worker uses its own source and target connections from the connection pools
+        ddl_granularity: str
+            'database' (default) reads the ddl of a database with a single get_ddl call.
+            'schema' lists the schemas of every database and reads and replicates each schema with
+            its own get_ddl call, workers schemas at a time. a large database is spread over the workers,
+            and memory is bounded by the largest schema instead of the largest database
+        batch_size: int
+            number of statements sent per request to the target account.
+            None (default) sends one statement at a time
+        pool_size: int
+            connections kept per account. defaults to workers + 1
+        plan_only: bool
+            if true the target account isn't connected to. copy_account and the steps only
+            read the source and collect their statements in self.plan (a sql_plan), which can be
+            saved with to_sql / to_json and applied later with apply_plan or execute_plan
+        stream_metadata: bool
+            if true the grant steps process the ACCOUNT_USAGE grant views batch by batch
+            as they are fetched, instead of loading them into one shared DataFrame.
+            memory stays bounded, but grants_to_roles is then read once per grant step
+        snapshot_dir: str
+            directory of a local snapshot cache (see snowmad.snapshot). When set 'show databases',
+            'show warehouses' and the ACCOUNT_USAGE views are read from snapshots younger than
+            snapshot_ttl seconds instead of the source account
+        snapshot_ttl: int
+            seconds a snapshot is used for
+        metrics: snowmad.metrics.statement_metrics
+            records latency, query id and outcome of every statement sent to the target,
+            per step. copy_account prints the per step summary (p50 / p95 / p99, statements/s)
+        write_controller: snowmad.throttle.write_controller
+            sends the statements with retries for transient errors. statements of independent
+            steps (users, roles, warehouses, grants) are sent concurrently on target pool connections,
+            as many as the controller's adaptive limit allows. batch_size is not used with it
+        reconcile_grants: bool
+            if true the grant steps read the target account's grants once (ACCOUNT_USAGE) and only
+            send the source grants the target doesn't have yet. grants made within the view latency
+            may not show up yet and are sent again, which is harmless
+        revoke_extra_grants: bool
+            with reconcile_grants, also revoke target grants that the source doesn't have.
+            grants to and of system roles and OWNERSHIP are never revoked. only on runs that read
+            the full source views (not incremental)
+        manifest_file: str
+            path of a JSON manifest of replicated objects. When set runs are incremental:
+            only objects that are new or changed since the last run are sent to the target,
+            and existing users / warehouses are altered instead of replaced
+        journal_file: str
+            path of a checkpoint journal (see snowmad.checkpoint). copy_account records every database
+            and every statement as it completes, resume() runs copy_account again without sending
+            what the failed run already finished. The source is read again on resume
+        journal_batch: int
+            statements sent between two journal records
 
     """
     
@@ -140,25 +566,76 @@ class transcribe_account:
                  conn_type_source = 'password', 
                  conn_type_target = 'private_key',
                  db_ignore_list = [""],
-                 return_sql = True):
+                 ddl_filter = None,
+                 return_sql = True,
+                 workers = 1,
+                 ddl_granularity = 'database',
+                 batch_size = None,
+                 manifest_file = None,
+                 pool_size = None,
+                 plan_only = False,
+                 stream_metadata = False,
+                 snapshot_dir = None,
+                 snapshot_ttl = 3600,
+                 metrics = None,
+                 write_controller = None,
+                 reconcile_grants = False,
+                 revoke_extra_grants = False,
+                 journal_file = None,
+                 journal_batch = 1000):
         
         self.sql_drop_list = []
         self.db_ignore_list = db_ignore_list
+        self.ddl_filter = ddl_filter if ddl_filter is not None else ddl.ddl_filter()
         self.return_sql = return_sql
-        
+        self.workers = workers
+        self.batch_size = batch_size
+        self.db_results = {}
+        
+        if ddl_granularity not in ('database', 'schema'):
+            raise ValueError(f"unknown ddl_granularity: {ddl_granularity}, choose from 'database' or 'schema'")
+        self.ddl_granularity = ddl_granularity
+        self.table_results = {}
+        self.stream_metadata = stream_metadata
+        self.snapshot = snapshot_cache(snapshot_dir, snapshot_ttl) if snapshot_dir else None
+        self.metadata_cache = {}
+        self._streamed_watermarks = {}
+        self._cache_lock = threading.Lock()
+        self._view_locks = defaultdict(threading.Lock)
+        self._local = threading.local()
+        self.step_report = {}
+        self.metrics = metrics
+        self.write_controller = write_controller
+        self.reconcile_grants = reconcile_grants
+        self.revoke_extra_grants = revoke_extra_grants
+        self.target_grants_cache = {}
+        self.journal = checkpoint_journal(journal_file) if journal_file else None
+        self.journal_batch = journal_batch
+        self.resumed_statements = defaultdict(int)
+        self.manifest = replication_manifest(manifest_file) if manifest_file else None
+        self.plan = sql_plan(order = list(copy_steps)) if plan_only else None
+        
+        # warm connections shared by the main steps and the database workers
+        pool_size = pool_size or workers + 1
         
         try:
-            self.source_conn, self.source_cur, account_source = parse_credentials(config_file,
-                                                                                  source_config_name,
-                                                                                  conn_type_source)
+            self.source_pool = connection_pool(config_file, source_config_name, conn_type_source, size = pool_size)
+            self.source_conn = self.source_pool.acquire()
+            self.source_cur = self.source_conn.cursor()
             print("connected to source account")
             
-            self.target_conn, self.target_cur, account_target = parse_credentials(config_file,
-                                                                                  target_config_name,
-                                                                                  conn_type_target)
+            # planning only needs source reads
+            if plan_only:
+                return
             
+            self.target_pool = connection_pool(config_file, target_config_name, conn_type_target, size = pool_size)
+            self._target_account = (config_file, target_config_name, conn_type_target)
+            self.target_conn = self.target_pool.acquire()
+            self.target_cur = self.target_conn.cursor()
             print("connected to target account")
             
+            account_source = self.source_pool.account
+            account_target = self.target_pool.account
             
 
             assert account_source != account_target, f"""Error: Source and Target Accounts Must Be Different: \n
@@ -171,63 +648,64 @@ class transcribe_account:
             print("connection to snowflake accounts could not be established")
         
         
-    def database_objects(self):
+    def close(self):
+        """ Returns the main connections and closes both connection pools """
+        
+        for pool, conn in [(getattr(self, 'source_pool', None), getattr(self, 'source_conn', None)),
+                           (getattr(self, 'target_pool', None), getattr(self, 'target_conn', None))]:
+            if pool is None:
+                continue
+            if conn is not None:
+                pool.release(conn)
+            pool.close()
+            
+        if self.journal is not None:
+            self.journal.close()
+        
+        
+    def database_objects(self, workers = None):
         """ - Reads databases from the source account
             - Creates databases in the target account
             - Outputs a list of sql for dropping objects
+            - With workers > 1 databases are replicated concurrently, see self.db_results
+              for the per database outcome
         """
         
-        sql = 'show databases'
-        df_db = fetch_data_df(sql, self.source_conn)
-        
-        
-        # Don't include default snowflake databases:
-        df_db = df_db[(df_db['name'] != 'SNOWFLAKE') & (df_db['name'] != 'SNOWFLAKE_SAMPLE_DATA')]
-        
-        # Don't include shares (origin is other than your account)
-        df_db = df_db[df_db['origin'] == ""]
-        
-        # Don't include databases on the ignore list:
-        databases = df_db[~df_db['name'].isin(self.db_ignore_list)]['name'].unique().tolist()
+        databases = self._source_databases()
         
         # for dropping dbs
         self.db_drop_sql_list = [f"""DROP DATABASE IF EXISTS "{database}";""" for database in databases]
         self.sql_drop_list += self.db_drop_sql_list
         
+        self.db_results = {}
+        self._db_last_altered = {}
+        
+        # incremental: only read ddl for databases changed since they were last replicated
+        if self.manifest is not None:
+            df_altered = self._read_source(database_last_altered_sql)
+            self._db_last_altered = dict(zip(df_altered['NAME'], df_altered['LAST_ALTERED']))
+            
+            unchanged = [db for db in databases if db in self._db_last_altered and 
+                         not self.manifest.is_stale('DATABASE', db, self._db_last_altered[db])]
+            for database in unchanged:
+                self.db_results[database] = {'status': 'unchanged', 'statements': 0}
+                
+            databases = [db for db in databases if db not in unchanged]
+            
+        workers = self.workers if workers is None else workers
 
         try:
-            # Get + execute ddl for all objects in one database
-            for database in databases:
+            if self.ddl_granularity == 'schema':
+                self._database_objects_by_schema(databases, workers)
+            elif workers > 1:
+                self._database_objects_concurrent(databases, workers)
+            else:
+                for database in databases:
+                    self._database_result(database, self.source_conn, self._target_cursor())
                 
-                try:
-                    sql = f"""select get_ddl('database', '{database}', true)"""
-                    df_db_ddl = pd.read_sql(sql, self.source_conn)
-
-                    list_of_commands = [x for x in [ re.sub(r"[\n\t]*", "", x) for x in df_db_ddl.iloc[0,0].split(";") ]  if x ]
-
-                    # Ignore specified objects (need to make more robust when I have more time)
-                    ignore_objects = ['PROCEDURE', 'FUNCTION', 'STAGE', 'STREAM', 'TASK',
-                                      'FILE FORMAT', 'VIEW', 'PIPE', 'MATERIALIZED', 'SECURE',
-                                      'RECURSIVE']
-                    ignore_objects_lower = [obj.lower() for obj in ignore_objects]
-                    ignore_objects += ignore_objects_lower
-                    ignore_create_replace = [f"create or replace {obj}" for obj in ignore_objects]
-                    ignore_create_replace_upper = [f"CREATE OR REPLACE {obj}" for obj in ignore_objects]
-                    ignore_create = [f"create {obj}" for obj in ignore_objects]   
-                    ignore_create_upper = [f"CREATE {obj}" for obj in ignore_objects]   
-                    misc_ignore_text = [" references ", "MASKING POLICY", "masking policy"]
-                    ignore_text = ignore_create + ignore_create_replace + ignore_create_upper + ignore_create_replace_upper + misc_ignore_text
-
-
-                    list_of_commands_filtered = [ddl for ddl in list_of_commands if all(txt not in ddl for txt in ignore_text)]
-                    list_of_commands_filtered = [ddl for ddl in list_of_commands_filtered if ddl.startswith("CREATE") | ddl.startswith("create")]
-                    
-                    execute_sql_list(list_of_commands_filtered, self.target_cur, return_sql = self.return_sql, return_errors = True)
-                    
-                    
-                except Exception:
-                    print(f"Could Not Create: {database}")
-                    continue
+            failed = [db for db, result in self.db_results.items() if result['status'] == 'failed']
+            for database in failed:
+                print(f"Could Not Create: {database}")
                 
             print("created db objects")
 
@@ -239,6 +717,259 @@ class transcribe_account:
         except Exception as error:
             print(error)
             print("could not create databases and database objects")
+            
+        return sum(result.get('statements', 0) for result in self.db_results.values())
+        
+    
+    def _source_databases(self):
+        """ names of the source databases that are replicated """
+        
+        sql = 'show databases'
+        df_db = self._read_source(sql)
+        
+        return replicated_databases(df_db, self.db_ignore_list)
+    
+    
+    def table_data(self, workers = None, partition_rows = 5_000_000, verify = True, load = None):
+        """ - Copies the rows of every base table of the replicated databases into the
+              target account, see snowmad.data_copy.table_copy. Run after database_objects
+            - Large tables are split into hash partitions of about partition_rows rows
+            - With verify, row counts and checksums of both sides are compared afterwards
+            - Per table outcomes are kept in self.table_results
+        """
+        
+        if self.plan is not None:
+            print("table data is not part of a plan, it needs the target account")
+            return 0
+        
+        tables = []
+        for database in self._source_databases():
+            sql = f"""select table_schema, table_name, row_count from "{database}".information_schema.tables
+                      where table_type = 'BASE TABLE' and table_schema != 'INFORMATION_SCHEMA'"""
+            try:
+                df_tables = fetch_data_df(sql, self.source_conn)
+            except Exception:
+                continue
+            
+            tables += [(database, schema, table, row_count) for schema, table, row_count
+                       in zip(df_tables['TABLE_SCHEMA'], df_tables['TABLE_NAME'], df_tables['ROW_COUNT'])]
+        
+        copier = table_copy(self.source_pool, self.target_pool, load = load,
+                            workers = self.workers if workers is None else workers, partition_rows = partition_rows)
+        self.table_results = copier.copy(tables, verify = verify)
+        
+        problems = {table: result for table, result in self.table_results.items() if result['status'] != 'copied'}
+        for table, result in problems.items():
+            print(f"Could Not Copy: {table} ({result['status']})")
+        
+        rows = sum(result['rows'] for result in self.table_results.values())
+        print(f"copied {rows} rows into {len(self.table_results) - len(problems)} tables")
+        
+        return rows
+    
+    
+    def _database_objects_concurrent(self, databases, workers):
+        """ - Replicates databases on a thread pool, one database per task
+            - Each task borrows a source and a target connection from the connection pools
+        """
+        
+        def worker(database):
+            try:
+                if self.plan is not None:
+                    with self.source_pool.connection() as source_conn:
+                        self._database_result(database, source_conn, None)
+                    return
+                
+                with self.source_pool.connection() as source_conn, \
+                     self.target_pool.connection() as target_conn:
+                    self._database_result(database, source_conn, target_conn.cursor())
+                    
+            except Exception as error:
+                self.db_results[database] = {'status': 'failed', 'error': f"connection failed: {error}"}
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(worker, databases))
+    
+    
+    def _database_objects_by_schema(self, databases, workers):
+        """ - Creates the databases and lists their schemas, one database per task
+            - Then replicates the schemas of every database on a thread pool, one get_ddl('schema') per task
+            - A database's outcome adds up its schemas, it failed if one of its schemas did
+        """
+        
+        schemas = {}
+        
+        def prepare(database):
+            # finished before a resume
+            if self.journal is not None and self.journal.is_done('database_objects', database):
+                self.db_results[database] = {'status': 'resumed', 'statements': 0}
+                return
+            
+            try:
+                schemas[database] = self._database_schemas(database)
+            except Exception as error:
+                self.db_results[database] = {'status': 'failed', 'error': str(error)}
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(prepare, databases))
+            
+            tasks = [(database, schema) for database in databases for schema in schemas.get(database, [])]
+            schema_results = dict(zip(tasks, executor.map(self._schema_result, tasks)))
+        
+        for database, database_schemas in schemas.items():
+            results = {schema: schema_results[(database, schema)] for schema in database_schemas}
+            # the create database statement and the schemas' statements
+            statements = 1 + sum(result.get('statements', 0) for result in results.values())
+            failed = {schema: result['error'] for schema, result in results.items() if result['status'] == 'failed'}
+            
+            if failed:
+                self.db_results[database] = {'status': 'failed', 'statements': statements,
+                                             'error': f"schemas failed: {failed}"}
+                continue
+            
+            self.db_results[database] = {'status': 'created', 'statements': statements, 'schemas': len(results)}
+            
+            # schemas that lost their connection halfway aren't in the journal, they're redone on resume
+            if self.journal is not None and self.plan is None and \
+               all(self.journal.is_done('database_objects', f"{database}.{schema}") for schema in results):
+                self.journal.record('database_objects', [database])
+            # a schema with failed statements keeps the database stale, so they're sent again next run
+            if self.manifest is not None:
+                complete = not any(result.get('failed') for result in results.values())
+                self.manifest.record('DATABASE', database, f"""create database if not exists "{database}";""",
+                                     last_altered = self._db_last_altered.get(database) if complete else None)
+    
+    
+    def _database_schemas(self, database):
+        """ Creates a database in the target (if it doesn't exist) and returns the names of its schemas """
+        
+        with self.source_pool.connection() as source_conn:
+            df_schemas = fetch_data_df(f"""show schemas in database "{database}";""", source_conn)
+        
+        # schemas are replaced on their own, an existing database isn't
+        create_sql = [f"""create database if not exists "{database}";"""]
+        if self.plan is not None:
+            # the unit puts the database ahead of its schemas ("DB" sorts before "DB.SCHEMA") in the plan
+            self._execute('database_objects', create_sql, unit = database)
+        else:
+            with self.target_pool.connection() as target_conn:
+                self._execute('database_objects', create_sql, target_conn.cursor())
+        
+        return [schema for schema in df_schemas['name'].tolist() if schema != 'INFORMATION_SCHEMA']
+    
+    
+    def _schema_result(self, task):
+        """ Replicates one (database, schema), returns its outcome """
+        
+        database, schema = task
+        if self.journal is not None and self.journal.is_done('database_objects', f"{database}.{schema}"):
+            return {'status': 'resumed', 'statements': 0}
+        
+        try:
+            if self.plan is not None:
+                with self.source_pool.connection() as source_conn:
+                    statements, failed = self._schema_ddl(database, schema, source_conn, None)
+            else:
+                with self.source_pool.connection() as source_conn, \
+                     self.target_pool.connection() as target_conn:
+                    statements, failed = self._schema_ddl(database, schema, source_conn, target_conn.cursor())
+            
+            return {'status': 'created', 'statements': statements, 'failed': failed}
+        
+        except Exception as error:
+            return {'status': 'failed', 'error': str(error)}
+    
+    
+    def _schema_ddl(self, database, schema, source_conn, target_cur):
+        """ Get + execute ddl for all objects in one schema. Returns (statements sent, statements failed) """
+        
+        name = f"{database}.{schema}"
+        # quoted, so mixed case names and names with special characters resolve to the right schema
+        quoted = quote_name(database, schema).replace("'", "''")
+        sql = f"""select get_ddl('schema', '{quoted}', true)"""
+        cur = source_conn.cursor()
+        try:
+            schema_ddl = cur.execute(sql).fetchone()[0]
+        finally:
+            cur.close()
+        
+        list_of_commands_filtered = self.ddl_filter.filter(schema_ddl)
+        
+        errors = []
+        
+        # incremental: only the statements that weren't sent on a previous run.
+        # failed statements aren't recorded, they're sent again next run
+        if self.manifest is not None:
+            sent = set((self.manifest.get('SCHEMA', name) or {}).get('statements', []))
+            new_commands = [ddl_sql for ddl_sql in list_of_commands_filtered if ddl_hash(ddl_sql) not in sent]
+            
+            self._execute('database_objects', new_commands, target_cur, unit = name, errors = errors)
+            failed = {sql for sql, _ in errors}
+            self.manifest.record('SCHEMA', name, schema_ddl,
+                                 statements = [ddl_sql for ddl_sql in list_of_commands_filtered if ddl_sql not in failed])
+            
+            return len(new_commands), len(failed)
+        
+        self._execute('database_objects', list_of_commands_filtered, target_cur, unit = name, errors = errors)
+        
+        return len(list_of_commands_filtered), len(errors)
+    
+    
+    def _database_result(self, database, source_conn, target_cur):
+        """ Runs one database and records its outcome in self.db_results """
+        
+        # finished before a resume, get_ddl isn't read again
+        if self.journal is not None and self.journal.is_done('database_objects', database):
+            self.db_results[database] = {'status': 'resumed', 'statements': 0}
+            return
+        
+        try:
+            statements = self._database_ddl(database, source_conn, target_cur)
+            self.db_results[database] = {'status': 'created', 'statements': statements}
+            
+        except Exception as error:
+            self.db_results[database] = {'status': 'failed', 'error': str(error)}
+    
+    
+    def _database_ddl(self, database, source_conn, target_cur):
+        """ Get + execute ddl for all objects in one database """
+        
+        sql = f"""select get_ddl('database', '{database}', true)"""
+        cur = source_conn.cursor()
+        try:
+            db_ddl = cur.execute(sql).fetchone()[0]
+        finally:
+            cur.close()
+
+        list_of_commands_filtered = self.ddl_filter.filter(db_ddl)
+        
+        if self.manifest is not None:
+            return self._database_ddl_incremental(database, db_ddl, list_of_commands_filtered, target_cur)
+        
+        self._execute('database_objects', list_of_commands_filtered, target_cur, unit = database)
+        
+        return len(list_of_commands_filtered)
+    
+    
+    def _database_ddl_incremental(self, database, ddl, list_of_commands, target_cur):
+        """ Only executes the statements of a database that weren't sent on a previous run """
+        
+        entry = self.manifest.get('DATABASE', database) or {}
+        sent = set(entry.get('statements', []))
+        
+        new_commands = [ddl_sql for ddl_sql in list_of_commands if ddl_hash(ddl_sql) not in sent]
+        
+        errors = []
+        self._execute('database_objects', new_commands, target_cur, unit = database, errors = errors)
+        failed = {sql for sql, _ in errors}
+        
+        # failed statements aren't recorded, and without last_altered the database stays stale
+        # so they're sent again next run
+        self.manifest.record('DATABASE', database, ddl, 
+                             last_altered = None if failed else self._db_last_altered.get(database),
+                             statements = [ddl_sql for ddl_sql in list_of_commands if ddl_sql not in failed])
+        
+        return len(new_commands)
         
     
     
@@ -248,24 +979,26 @@ class transcribe_account:
             - Outputs a list of sql for dropping objects
         """
         
-        # don't re-create default roles
-        sql = """select * from snowflake.account_usage.roles
-                    where name not like 'PUBLIC' and
-                    name not like 'ACCOUNTADMIN' and
-                    name not like 'SECURITYADMIN' and 
-                    name not like 'ORGADMIN' and
-                    name not like 'USERADMIN' and
-                    name not like 'SYSADMIN';"""
-        df_roles = fetch_data_df(sql, self.source_conn)
+        df_roles = self.account_usage('roles')
             
             
         roles = df_roles['NAME'].values.tolist()
         self.drop_roles_sql_list = [f"""DROP ROLE IF EXISTS "{role}";""" for role in roles]
         self.sql_drop_list += self.drop_roles_sql_list
         
-        roles_sql =  [f"""CREATE OR REPLACE ROLE {role}""" for role in roles]
+        roles_sql = role_sql(df_roles)
+        
+        # incremental: replacing a role drops its grants, so only create the new ones
+        if self.manifest is not None:
+            changes = []
+            for role in roles:
+                sql = f"""CREATE ROLE IF NOT EXISTS {role}"""
+                if self.manifest.diff('ROLE', role, sql):
+                    changes.append((role, sql, [sql]))
+            
+            return self._execute_recorded('roles', 'ROLE', changes)
     
-        execute_sql_list(roles_sql, self.target_cur, return_sql = self.return_sql, return_errors = True)
+        return self._execute('roles', roles_sql)
         
       
         
@@ -278,57 +1011,23 @@ class transcribe_account:
         
         self.user_drop_list = []
         
-        ## Ingore default snowflake role and the user who was used to create the account
-        sql = """select * from snowflake.account_usage.users
-                where name not like 'SNOWFLAKE' and
-                created_on not in (SELECT min(created_on) FROM snowflake.account_usage.users);"""
-        
-        df_users = fetch_data_df(sql, self.source_conn)
+        df_users = self.account_usage('users')
 
         
         names = df_users['NAME'].values.tolist()
-        login_names = df_users['LOGIN_NAME'].values.tolist()
-        display_names = df_users['DISPLAY_NAME'].values.tolist()
-        default_roles = df_users['DEFAULT_ROLE'].values.tolist()
-        emails = df_users['EMAIL'].values.tolist()
         
         self.drop_user_sql_list = [f"""DROP USER IF EXISTS "{user}";""" for user in names]
         self.sql_drop_list += self.drop_user_sql_list
         
-        user_sql_list = []
-        
         # Construct user sql strings
-        for i in range(0, len(df_users)):
-
-            name = f'"{names[i]}"'
-            password = "'abc123'"
-
-            if login_names[i] != None:
-                login_name = f"login_name='{login_names[i]}'"
-            else:
-                login_name = ""
-
-            if display_names[i] != None:
-                display_name = f" display_name='{display_names[i]}'"
-            else:
-                display_name = ""
-
-            if default_roles[i] != None:   
-                default_role = f" default_role={default_roles[i]}"
-            else:
-                default_role = ""
-
-            if emails[i] != None:
-                email = f" email='{emails[i]}'"
-            else:
-                email = ""
-
-            sql = [f"""CREATE OR REPLACE USER {name} password={password} {login_name} \
-                        {display_name} {default_role} {email}"""]
-
-            user_sql_list += sql
+        user_sql_list, user_alter_list = user_sql(df_users)
             
-        execute_sql_list(user_sql_list, self.target_cur, return_sql = self.return_sql, return_errors = True)
+        # incremental: new users are created, changed users are altered so passwords aren't reset
+        if self.manifest is not None:
+            return self._execute_recorded('users', 'USER',
+                                          self._incremental_sql('USER', names, user_sql_list, user_alter_list))
+            
+        return self._execute('users', user_sql_list)
 
         
     
@@ -340,18 +1039,21 @@ class transcribe_account:
         """
         
         sql = """show warehouses;"""
-        df_wh = fetch_data_df(sql, self.source_conn)
+        df_wh = self._read_source(sql)
 
         warehouses = df_wh['name'].values.tolist()
-        wh_sizes = df_wh['size'].values.tolist()
         
-        self.drop_wh_list = [f"""DROP WAREHOUSE "{wh}";""" for wh in warehouses]
+        self.drop_wh_list = [f"""DROP WAREHOUSE IF EXISTS "{wh}";""" for wh in warehouses]
         self.sql_drop_list += self.drop_wh_list
 
-        wh_list = [ f"""CREATE OR REPLACE warehouse {wh} warehouse_size='{size}' initially_suspended=true;""" \
-                   for wh, size in zip(warehouses, wh_sizes)]
+        wh_list, wh_alter_list = warehouse_sql(df_wh)
+        
+        if self.manifest is not None:
+            return self._execute_recorded('warehouses', 'WAREHOUSE',
+                                          self._incremental_sql('WAREHOUSE', warehouses, wh_list,
+                                                                [[alter_sql] for alter_sql in wh_alter_list]))
         
-        execute_sql_list(wh_list, self.target_cur, return_sql = self.return_sql, return_errors = True)
+        return self._execute('warehouses', wh_list)
         
 
     
@@ -361,20 +1063,20 @@ class transcribe_account:
             - Future grants not supported yet
         """
         
-        sql = """select * from snowflake.account_usage.grants_to_users;"""
-        df_user_grants  = fetch_data_df(sql, self.source_conn)
-        
+        statements = 0
+        diff = self._grant_diff('grants_to_users', user_grant_keys)
         
-        # only get the grants that still exist
-        df_user_grants = df_user_grants[df_user_grants['DELETED_ON'].isnull()]
+        # only has the grants that still exist
+        for df_user_grants in self._account_usage_frames('grants_to_users'):
+            
+            if diff is not None:
+                df_user_grants = diff.missing(df_user_grants, user_grant_keys(df_user_grants))
 
-        roles = df_user_grants['ROLE'].values.tolist()
-        users = df_user_grants['GRANTEE_NAME'].values.tolist()
-        
-        user_role_grant_list = [f"""GRANT ROLE "{role}" TO USER "{user}";""" \
-                                for role, user in zip(roles, users)]
+            user_role_grant_list = user_role_grant_sql(df_user_grants)
 
-        execute_sql_list(user_role_grant_list, self.target_cur, return_sql = self.return_sql, return_errors = True)
+            statements += self._execute('user_role_grants', user_role_grant_list)
+        
+        return statements + self._revoke_extra_grants('user_role_grants', 'grants_to_users', diff)
         
         
         
@@ -384,22 +1086,21 @@ class transcribe_account:
             - Future grants not supported yet
         """
         
-        sql = """select * from snowflake.account_usage.grants_to_roles;"""
-        df_grants  = fetch_data_df(sql, self.source_conn)
+        statements = 0
+        diff = self._grant_diff('grants_to_roles', role_grant_keys, lambda df: df[df['GRANTED_ON'] == 'ROLE'])
         
-        # just looking at roles in this step
-        df_role_grants = df_grants[df_grants['GRANTED_ON'] == 'ROLE']
-        
-        # only get the grants that still exist
-        df_role_grants = df_role_grants[df_role_grants ['DELETED_ON'].isnull()]
-        
-        role_sources = df_role_grants['NAME'].values.tolist()
-        role_targets =df_role_grants['GRANTEE_NAME'].values.tolist()
+        # only has the grants that still exist
+        for df_grants in self._account_usage_frames('grants_to_roles'):
+            
+            if diff is not None:
+                df_role_grants = df_grants[df_grants['GRANTED_ON'] == 'ROLE']
+                df_grants = diff.missing(df_role_grants, role_grant_keys(df_role_grants))
         
-        role_role_grant_list = [f"""GRANT ROLE "{role_source}" TO ROLE "{role_target}";""" \
-                                    for role_source, role_target in zip(role_sources, role_targets)]
+            role_role_grant_list = role_role_grant_sql(df_grants)
+            
+            statements += self._execute('role_role_grants', role_role_grant_list)
         
-        execute_sql_list(role_role_grant_list, self.target_cur, return_sql = self.return_sql, return_errors = True)
+        return statements + self._revoke_extra_grants('role_role_grants', 'grants_to_roles', diff)
         
         
             
@@ -410,92 +1111,435 @@ class transcribe_account:
             - Future grants not supported yet
         """
         
-        sql = """select * from snowflake.account_usage.grants_to_roles;"""
-        df_grants  = fetch_data_df(sql, self.source_conn)
-        
-        supported_object_types = ['WAREHOUSE', 'DATABASE', 'SCHEMA', 'TABLE', 'VIEW']
-        df_obj_grants = df_grants[df_grants['GRANTED_ON'].isin(supported_object_types)]
-        
-        # filter out any snowflake objects
-        snowflake_obj_list = ['SNOWFLAKE_SAMPLE_DATA', 'SNOWFLAKE']
-        df_obj_grants = df_obj_grants[~df_obj_grants['NAME'].isin(snowflake_obj_list)]
-        
-        privileges = df_obj_grants['PRIVILEGE'].values.tolist()
-        object_types = df_obj_grants['GRANTED_ON'].values.tolist()
-        object_names = df_obj_grants['NAME'].values.tolist()
-        object_name_schemas = df_obj_grants['TABLE_SCHEMA'].values.tolist()
-        object_name_dbs = df_obj_grants['TABLE_CATALOG'].values.tolist()
-        grantee_roles = df_obj_grants['GRANTEE_NAME'].values.tolist()
-
-        grants_sql_list = []
-        for i in range(0, len(df_obj_grants)):  
-            privilege = privileges[i]
-            object_type = object_types[i]
-            object_name = object_names[i]
-            grantee_role = grantee_roles[i]
-            object_name_schema = object_name_schemas[i]
-            object_name_db = object_name_dbs[i]
-
-            # Some objects need a full name/path
-            if object_type == 'TABLE' or object_type == 'VIEW':
-                full_object_name = f"{object_name_db}.{object_name_schema}.{object_name}"
-            elif object_type == 'SCHEMA':
-                full_object_name = f"{object_name_db}.{object_name}"
-            else:
-                full_object_name = object_name
-
-            # some restrictions on granting ownership
-            if privilege == 'OWNERSHIP':   
-                sql = [f"""GRANT {privilege} ON {object_type} {full_object_name} TO ROLE  {grantee_role} REVOKE CURRENT GRANTS; """]
+        statements = 0
+        diff = self._grant_diff('grants_to_roles', object_grant_keys,
+                                lambda df: df[df['GRANTED_ON'].isin(supported_object_types)])
+        
+        # snowflake objects and deleted grants are already filtered out in the query
+        for df_grants in self._account_usage_frames('grants_to_roles'):
+            
+            df_obj_grants = df_grants[df_grants['GRANTED_ON'].isin(supported_object_types)]
+            
+            if diff is not None:
+                df_obj_grants = diff.missing(df_obj_grants, object_grant_keys(df_obj_grants))
+            
+            grants_sql_list = object_grant_sql(df_obj_grants)
+                
+            statements += self._execute('role_object_grants', grants_sql_list)
+        
+        return statements + self._revoke_extra_grants('role_object_grants', 'grants_to_roles', diff)
+    
+    
+    def target_grants(self, view):
+        """ The target account's grants_to_users / grants_to_roles, read once per run in bulk """
+        
+        with self._cache_lock:
+            view_lock = self._view_locks[('target', view)]
+            
+        with view_lock:
+            if view not in self.target_grants_cache:
+                with self.target_pool.connection() as conn:
+                    self.target_grants_cache[view] = fetch_data_df(account_usage_sql(view), conn)
+                    
+            return self.target_grants_cache[view]
+    
+    
+    def _grant_diff(self, view, keys, select = None):
+        """ grant_diff against the target's grants for one grant step, None if grants aren't reconciled """
+        
+        if not self.reconcile_grants or self.plan is not None:
+            return None
+        
+        df_target = self.target_grants(view)
+        return grant_diff(keys(select(df_target) if select is not None else df_target))
+    
+    
+    def _revoke_extra_grants(self, step, view, diff):
+        """ revokes the target grants the source doesn't have, once every source frame was compared """
+        
+        # incremental runs only read the newest source grants, everything else would look extra
+        if diff is None or not self.revoke_extra_grants or self._since(view) is not None:
+            return 0
+        
+        revoke_sql_list = revoke_sql(diff.extra())
+        
+        return self._execute(step, revoke_sql_list)
+        
+        
+    def account_usage(self, view):
+        """ Returns the snapshot of an ACCOUNT_USAGE view for this run.
+            The view is read from the source account on first use and shared by every step after that
+        """
+        
+        # one lock per view so steps reading different views don't wait on each other
+        with self._cache_lock:
+            view_lock = self._view_locks[view]
+            
+        with view_lock:
+            if view not in self.metadata_cache:
+                self.metadata_cache[view] = self._read_source(account_usage_sql(view, self._since(view)))
+                
+            return self.metadata_cache[view]
+        
+        
+    def account_usage_batches(self, view):
+        """ Yields an ACCOUNT_USAGE view in arrow result batches.
+            Uses the run's snapshot if it is already loaded, otherwise the view is streamed
+            from the source without being cached
+        """
+        
+        if view in self.metadata_cache:
+            yield self.metadata_cache[view]
+            return
+        
+        column = account_usage_views[view].get('watermark')
+        sql = account_usage_sql(view, self._since(view))
+        
+        if self.snapshot is not None:
+            df = self.snapshot.get(self._snapshot_source(), sql)
+            if df is not None:
+                if column and len(df):
+                    self._stream_watermark(view, df[column].max())
+                yield df
+                return
+        
+        for batch in iter_data_batches(sql, self.source_conn):
+            if column and len(batch):
+                self._stream_watermark(view, batch[column].max())
+            yield batch
+            
+            
+    def _account_usage_frames(self, view):
+        """ The view as one shared snapshot, or as a stream of batches with stream_metadata """
+        
+        if self.stream_metadata:
+            return self.account_usage_batches(view)
+        
+        return [self.account_usage(view)]
+    
+    
+    def _read_source(self, sql):
+        """ fetch_data_df on the source account, through the snapshot cache if there is one """
+        
+        if self.snapshot is None:
+            return fetch_data_df(sql, self.source_conn)
+        
+        return self.snapshot.fetch(self._snapshot_source(), sql, lambda: fetch_data_df(sql, self.source_conn))
+    
+    
+    def _snapshot_source(self):
+        return source_key(self.source_pool.account, self.source_pool.user, self.source_pool.role)
+    
+    
+    def _since(self, view):
+        """ watermark to read view from on incremental runs """
+        
+        if self.manifest is not None and 'watermark' in account_usage_views[view]:
+            return self.manifest.watermark(view)
+        
+        return None
+    
+    
+    def _stream_watermark(self, view, created_on):
+        with self._cache_lock:
+            current = self._streamed_watermarks.get(view)
+            if current is None or created_on > current:
+                self._streamed_watermarks[view] = created_on
+        
+        
+    def invalidate_cache(self, view = None):
+        """ Drops cached ACCOUNT_USAGE snapshots so they are re-read. Drops all views if view is None """
+        
+        with self._cache_lock:
+            if view is None:
+                self.metadata_cache = {}
+                self._streamed_watermarks = {}
+                self.target_grants_cache = {}
             else:
-                sql = [f"""GRANT {privilege} ON {object_type} {full_object_name} TO ROLE  {grantee_role}; """]
-
-            grants_sql_list += sql
+                self.metadata_cache.pop(view, None)
+                self._streamed_watermarks.pop(view, None)
+                self.target_grants_cache.pop(view, None)
+        
+        
+    def _incremental_sql(self, object_type, names, create_list, alter_list):
+        """ Picks the create statement for new objects and the alter statements (a list per object)
+            for changed objects. Unchanged objects are skipped.
+            Returns (name, create_sql, statements) per object to send, see _execute_recorded
+        """
+        
+        changes = []
+        for name, create_sql, alter_sql in zip(names, create_list, alter_list):
+            change = self.manifest.diff(object_type, name, create_sql)
             
-        execute_sql_list(grants_sql_list, self.target_cur, return_sql = self.return_sql, return_errors = True)
+            if change == 'new':
+                changes.append((name, create_sql, [create_sql]))
+            elif change == 'changed':
+                changes.append((name, create_sql, alter_sql))
+                
+        return changes
+    
+    
+    def _execute_recorded(self, step, object_type, changes):
+        """ Sends the statements of (name, recorded_sql, statements) changes and records in the manifest
+            only the objects whose statements all succeeded, the others are sent again next run
+        """
         
+        errors = []
+        sent = self._execute(step, [sql for _, _, statements in changes for sql in statements], errors = errors)
+        failed = {sql for sql, _ in errors}
         
-    def copy_account(self):
-        """ Function to create all objects. Specific object selection not supported yet """
+        for name, recorded_sql, statements in changes:
+            if not failed.intersection(statements):
+                self.manifest.record(object_type, name, recorded_sql)
         
-        self.database_objects()
-        self.users()
-        self.roles()
-        self.warehouses()
-        self.user_role_grants()
-        self.role_role_grants()
-        self.role_object_grants()
+        return sent
         
-        print("created account objects")
         
+    def save_manifest(self):
+        """ Moves the grant watermarks forward to what this run read and writes the manifest.
+            Nothing is saved in plan mode since the plan hasn't been applied
+        """
+        
+        if self.manifest is None or self.plan is not None:
+            return
+        
+        with self._cache_lock:
+            for view, df in self.metadata_cache.items():
+                column = account_usage_views[view].get('watermark')
+                if column and len(df):
+                    self.manifest.advance(view, df[column].max())
+                    
+            for view, created_on in self._streamed_watermarks.items():
+                self.manifest.advance(view, created_on)
+                    
+        self.manifest.save()
+        
+        
+    def copy_account(self, steps = None, step_workers = 4, resume = False):
+        """ Function to create all objects
+            - steps: list of step names from copy_steps to run, defaults to all of them.
+              dependencies that aren't selected are assumed to be in place already
+            - step_workers: number of independent steps that can run at the same time
+            - wall time and statement count per step are reported in self.step_report
+            - resume: keep the checkpoint journal of the previous run and skip the work it finished,
+              see resume(). Otherwise the journal is started over
+        """
+        
+        steps = list(copy_steps) if steps is None else list(steps)
+        unknown = [step for step in steps if step not in copy_steps]
+        if unknown:
+            raise ValueError(f"unknown copy steps: {unknown}, choose from {list(copy_steps)}")
+        
+        # each run starts from a fresh metadata snapshot
+        self.invalidate_cache()
+        self.step_report = {}
+        self.resumed_statements = defaultdict(int)
+        
+        if self.journal is not None and not resume:
+            self.journal.reset()
+        
+        self._run_steps(steps, step_workers)
         
+        self.save_manifest()
         
+        for step in steps:
+            report = self.step_report[step]
+            print(f"{step}: {report['status']} - {report['statements']} statements in {report['seconds']:.1f}s")
+        
+        if resume:
+            databases = sum(result['status'] == 'resumed' for result in self.db_results.values())
+            print(f"resumed: {databases} databases and {sum(self.resumed_statements.values())} statements "
+                  f"were finished by the previous run")
+        
+        if self.metrics is not None:
+            self.metrics.print_summary()
+        
+        if self.plan is not None:
+            print(f"planned {len(self.plan)} statements")
+        else:
+            print("created account objects")
+        
+        
+    def resume(self, steps = None, step_workers = 4):
+        """ Runs copy_account again after a failed run, without sending the databases and statements
+            the checkpoint journal has as finished. Needs a journal_file
+        """
+        
+        if self.journal is None:
+            raise ValueError("resume needs a journal_file")
+        
+        self.copy_account(steps, step_workers, resume = True)
+        
+        
+    def _run_steps(self, steps, step_workers):
+        """ Runs steps as soon as the steps they depend on are done.
+            Steps that depend on a failed step are skipped
+        """
         
-    def drop_objects(self, objects = 'all'):
-        """ Drops all created objects. Depends on other functions being ran """
+        pending = {step: [dep for dep in copy_steps[step] if dep in steps] for step in steps}
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=step_workers) as executor:
+            while pending or running:
+                for step, deps in list(pending.items()):
+                    statuses = [self.step_report.get(dep, {}).get('status') for dep in deps]
+                    
+                    if any(status in ('failed', 'skipped') for status in statuses):
+                        self.step_report[step] = {'status': 'skipped', 'statements': 0, 'seconds': 0.0}
+                        del pending[step]
+                        
+                    elif all(status == 'done' for status in statuses):
+                        running[executor.submit(self._timed_step, step)] = step
+                        del pending[step]
+                        
+                if not running:
+                    continue
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    
+                    
+    def _timed_step(self, step):
+        """ Runs one step on its own target cursor and records its wall time and statement count """
+        
+        start = time.perf_counter()
+        self._local.target_cur = None
+        
+        try:
+            if self.plan is None:
+                self._local.target_cur = self.target_conn.cursor()
+            statements = getattr(self, step)()
+            self.step_report[step] = {'status': 'done', 'statements': statements or 0}
+            
+        except Exception as error:
+            print(error)
+            print(f"step failed: {step}")
+            self.step_report[step] = {'status': 'failed', 'statements': 0, 'error': str(error)}
+            
+        finally:
+            if self._local.target_cur is not None:
+                self._local.target_cur.close()
+                self._local.target_cur = None
+            self.step_report[step]['seconds'] = time.perf_counter() - start
+            
+            
+    def _target_cursor(self):
+        """ Cursor for the target account: the step's own cursor when run from copy_account """
+        
+        return getattr(self._local, 'target_cur', None) or getattr(self, 'target_cur', None)
+    
+    
+    def _execute(self, step, sql_list, cursor = None, unit = None, errors = None):
+        """ Sends a step's statements to the target account, or adds them to self.plan in plan mode.
+            With a journal, statements a previous run finished are skipped and finished ones are recorded,
+            journal_batch at a time. unit records sql_list as a whole instead (a database).
+            errors gets (sql, error) for every statement that couldn't be executed.
+            Returns the number of statements sent (or planned), without the ones the journal skipped
+        """
+        
+        if self.plan is not None:
+            self.plan.add(step, sql_list, unit)
+            return len(sql_list)
+        
+        errors = errors if errors is not None else []
+        
+        if self.journal is None:
+            self._send(step, sql_list, cursor, errors)
+            return len(sql_list)
+        
+        # statements that failed on a lost connection or throttling aren't finished, they're sent again on resume
+        if unit is not None:
+            self._send(step, sql_list, cursor, errors)
+            if not any(is_retryable(error) for _, error in errors):
+                self.journal.record(step, [unit])
+            return len(sql_list)
+        
+        pending = [(sql, sql_hash) for sql, sql_hash in zip(sql_list, map(ddl_hash, sql_list))
+                   if not self.journal.is_done(step, sql_hash)]
+        with self._cache_lock:
+            self.resumed_statements[step] += len(sql_list) - len(pending)
+        
+        for i in range(0, len(pending), self.journal_batch):
+            batch = pending[i:i + self.journal_batch]
+            batch_errors = []
+            self._send(step, [sql for sql, _ in batch], cursor, batch_errors)
+            errors.extend(batch_errors)
+            
+            retry = {sql for sql, error in batch_errors if is_retryable(error)}
+            self.journal.record(step, [sql_hash for sql, sql_hash in batch if sql not in retry])
+        
+        return len(pending)
+            
+            
+    def _send(self, step, sql_list, cursor = None, errors = None):
+        """ Sends statements to the target account, with the write_controller if there is one """
+        
+        if self.write_controller is not None:
+            pool = self.target_pool if step in independent_steps else None
+            self.write_controller.execute_sql_list(sql_list, pool = pool, cursor = cursor or self._target_cursor(),
+                                                   return_sql = self.return_sql, return_errors = True,
+                                                   metrics = self.metrics, step = step, errors = errors)
+            return
+        
+        execute_sql_list(sql_list, cursor or self._target_cursor(), return_sql = self.return_sql, return_errors = True,
+                         batch_size = self.batch_size, metrics = self.metrics, step = step, errors = errors)
+        
+        
+    def apply_plan(self, plan, batch_size = 100):
+        """ Applies a sql_plan (e.g. loaded with sql_plan.from_json) to the target account """
+        
+        execute_plan(plan, self.target_cur, return_sql = self.return_sql, return_errors = True,
+                     batch_size = batch_size, metrics = self.metrics)
+        
+        
+        
+    def teardown_plan(self, objects = 'all'):
+        """ drop_plan of the objects created by the steps that ran: 'all', 'databases', 'users', 'roles' or 'warehouses' """
+        
+        drop_lists = {'all': 'sql_drop_list', 'databases': 'db_drop_sql_list', 'users': 'drop_user_sql_list',
+                      'roles': 'drop_roles_sql_list', 'warehouses': 'drop_wh_list'}
+        
+        plan = drop_plan()
+        plan.add(getattr(self, drop_lists[objects], []))
+        return plan
+    
+    
+    def save_drop_plan(self, path, objects = 'all'):
+        """ Saves the teardown_plan, for snowmad.teardown.teardown_account in another process """
+        
+        self.teardown_plan(objects).save(path)
+        
+        
+    def drop_objects(self, objects = 'all', workers = 8, plan_file = None):
+        """ Drops all created objects. Depends on other functions being ran
+            - drops are ordered by tier (grants, users and roles, databases and warehouses)
+              and each tier runs concurrently on workers connections of a teardown pool of its own,
+              the pool shared by the copy steps is sized for those
+            - plan_file: the drop plan is saved there first, and kept up to date as drops complete,
+              so a failed teardown can be finished with snowmad.teardown.teardown_account
+        """
+        
+        pool = connection_pool(*self._target_account, size = workers)
+        try:
+            report = teardown(pool, workers, self.return_sql, self.metrics,
+                              self.write_controller).run(self.teardown_plan(objects), plan_file)
+        finally:
+            pool.close()
         
         if objects == 'all':
-            execute_sql_list(self.sql_drop_list, self.target_cur, self.return_sql )
             self.sql_drop_list = []
             
         if objects == 'databases':
-            execute_sql_list(self.db_drop_sql_list, self.target_cur, self.return_sql)
             self.db_drop_sql_list = []
             
         if objects == 'users':
-            execute_sql_list(self.drop_user_sql_list, self.target_cur, self.return_sql)
             self.drop_user_sql_list = []
-            
         
         if objects == 'roles':
-            execute_sql_list(self.self.drop_roles_sql_list, self.target_cur, self.return_sql)
             self.drop_roles_sql_list = []
         
         if objects == 'warehouses':
-            execute_sql_list(self.drop_wh_list, self.target_cur, self.return_sql)
             self.drop_wh_list = []
-            
         
-
-    
-    
\ No newline at end of file
+        return report
@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .pool import connection_pool
+
+
+# tiers in the order they are dropped: grants, then the users and roles, then databases and warehouses.
+# dropping a role hands the objects it owns to the role dropping it, so its databases can go after it
+teardown_tiers = ['grants', 'users_roles', 'databases_warehouses']
+
+_tier_patterns = [('grants', re.compile(r"\s*revoke\b", re.IGNORECASE)),
+                  ('users_roles', re.compile(r"\s*drop\s+(user|role)\b", re.IGNORECASE)),
+                  ('databases_warehouses', re.compile(r"\s*drop\s+(database|warehouse)\b", re.IGNORECASE))]
+
+
+def teardown_tier(sql):
+    """ the tier of a REVOKE / DROP statement. anything else goes in the last tier """
+
+    for tier, pattern in _tier_patterns:
+        if pattern.match(sql):
+            return tier
+
+    return teardown_tiers[-1]
+
+
+
+class drop_plan:
+    """
+    The statements that tear down what a copy_account run created, by tier
+
+    Attributes:
+        tiers : dict
+            {tier: [sql, ...]} for the tiers in teardown_tiers
+
+    A plan is saved as JSON so the teardown can run in another process than the one that
+    built it. teardown takes the statements that were executed out of the saved plan,
+    so a failed teardown can be run again from the same file.
+    """
+
+    def __init__(self, tiers = None):
+        self.tiers = {tier: [] for tier in teardown_tiers}
+        # the statements of each tier as a set, to find the ones already in the plan
+        self._in_tier = {tier: set() for tier in teardown_tiers}
+        self._lock = threading.Lock()
+
+        for sql_list in (tiers or {}).values():
+            self.add(sql_list)
+
+
+    def add(self, sql_list):
+        """ adds statements to their tiers, statements already in the plan are left out """
+
+        with self._lock:
+            for sql in sql_list:
+                tier = teardown_tier(sql)
+                if sql not in self._in_tier[tier]:
+                    self._in_tier[tier].add(sql)
+                    self.tiers[tier].append(sql)
+
+
+    def remove(self, sql_list):
+        done = set(sql_list)
+        with self._lock:
+            self.tiers = {tier: [sql for sql in statements if sql not in done] for tier, statements in self.tiers.items()}
+            self._in_tier = {tier: set(statements) for tier, statements in self.tiers.items()}
+
+
+    def __len__(self):
+        return sum(len(statements) for statements in self.tiers.values())
+
+
+    def save(self, path):
+        """ writes the plan atomically """
+
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                json.dump({'tiers': self.tiers}, f, indent=1)
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f)['tiers'])
+
+
+
+class teardown:
+    """
+    Runs a drop_plan tier by tier, the statements of a tier concurrently
+
+    Attributes:
+        pool : snowmad.pool.connection_pool
+            connections to the account that is torn down
+        workers : int
+            statements in flight within a tier, each worker holds one pool connection.
+            the pool needs at least as many free connections
+        return_sql: bool
+            if true all of the sql statements that are executed will be printed
+        metrics: snowmad.metrics.statement_metrics
+            records every statement under step 'teardown.<tier>'
+        write_controller: snowmad.throttle.write_controller
+            sends the statements with its retries and adaptive limit instead of a fixed number of workers
+
+    A tier only starts once every statement of the tier before it was executed.
+    """
+
+    def __init__(self, pool, workers = 8, return_sql = False, metrics = None, write_controller = None):
+        self.pool = pool
+        self.workers = workers
+        self.return_sql = return_sql
+        self.metrics = metrics
+        self.write_controller = write_controller
+
+
+    def run(self, plan, path = None):
+        """ Executes plan. With path the plan is saved there before the first drop and after every tier,
+            without the statements that were executed
+            Returns {tier: {'statements': ..., 'failed': ..., 'seconds': ...}}
+        """
+
+        if path is not None:
+            plan.save(path)
+
+        report = {}
+        for tier in teardown_tiers:
+            sql_list = list(plan.tiers[tier])
+            if not sql_list:
+                continue
+
+            start = time.perf_counter()
+            errors = []
+
+            if self.write_controller is not None:
+                self.write_controller.execute_sql_list(sql_list, pool = self.pool, return_sql = self.return_sql,
+                                                       metrics = self.metrics, step = f"teardown.{tier}",
+                                                       errors = errors)
+            else:
+                # one slice of the tier per worker, run on the worker's own connection
+                workers = max(1, min(self.workers, len(sql_list)))
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(lambda i: self._drop(sql_list[i::workers], tier, errors), range(workers)))
+
+            failed = {sql for sql, _ in errors}
+            plan.remove([sql for sql in sql_list if sql not in failed])
+            if path is not None:
+                plan.save(path)
+
+            report[tier] = {'statements': len(sql_list) - len(failed), 'failed': len(failed),
+                            'seconds': time.perf_counter() - start}
+            print(f"{tier}: {report[tier]['statements']} dropped, {len(failed)} failed "
+                  f"in {report[tier]['seconds']:.1f}s")
+
+        return report
+
+
+    def _drop(self, sql_list, tier, errors):
+        """ executes statements one at a time on one pool connection, failures go to errors """
+
+        step = f"teardown.{tier}"
+        try:
+            with self.pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    for sql in sql_list:
+                        start = time.time()
+                        try:
+                            if self.return_sql:
+                                print("Executing: ", sql)
+                            cur.execute(sql)
+
+                        except Exception as error:
+                            errors.append((sql, error))
+                            if self.metrics is not None:
+                                self.metrics.record(step, sql, start, time.time() - start,
+                                                    getattr(error, 'sfqid', None), error)
+                            print(error)
+                            print(f"Could not execute: {sql}")
+                            continue
+
+                        if self.metrics is not None:
+                            self.metrics.record(step, sql, start, time.time() - start, cur.sfqid)
+                finally:
+                    cur.close()
+
+        except Exception as error:
+            print(f"connection failed: {error}")
+            errors.extend((sql, error) for sql in sql_list)
+
+
+
+def teardown_account(config_file, plan_file, target_config_name = 'snowflake_target_account',
+                     conn_type_target = 'private_key', workers = 8, return_sql = False, metrics = None):
+    """ Runs a drop_plan saved to plan_file (see transcribe_account.save_drop_plan) against the target account.
+        The statements that were executed are taken out of plan_file. Returns the teardown report
+    """
+
+    plan = drop_plan.load(plan_file)
+    pool = connection_pool(config_file, target_config_name, conn_type_target, size = workers)
+    try:
+        return teardown(pool, workers, return_sql, metrics).run(plan, plan_file)
+    finally:
+        pool.close()
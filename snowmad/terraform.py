@@ -1,76 +1,46 @@
-import pandas as pd
-import snowflake.connector 
 import configparser
+import hashlib
+import json
+import os
+import re
+import zlib
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
+from .pool import connection_pool
+from .snapshot import snapshot_cache, source_key
 
 
-class transcribe:
+def role_block(role):
+    """ snowflake_role resource for one 'show roles' row (dict) """
     
-    def __init__(self, config_file):
-        self.config = configparser.ConfigParser()
-        self.config.read(config_file)
-        
-        self.user = self.config['snowflake']['user']
-        self.password = self.config['snowflake']['password']
-        self.account = self.config['snowflake']['account']
-        
-        self.conn = snowflake.connector.connect(
-                user = self.user,
-                password = self.password,
-                account = self.account
-            )
-        
-        self.cur = self.conn.cursor()
-      
+    name = role['name']
+    comment = role['comment']
     
+    # comment is an optional parameter
+    if comment == '':
+        return f"""resource "snowflake_role" "{name}" {{ \n \t name = "{name}" \n }} \n \n"""
     
-    def create_role_resource(self):
-        
-        sql = 'show roles'
-        roles_df = pd.read_sql(sql, self.conn)
-        print("total rows: ", )
-
-        tf_roles = []
-        for i in range(0, len(roles_df)):
-            role = roles_df['name'].values[i]
-            comment = roles_df['comment'].values[i]
+    return f"""resource "snowflake_role" "{name}" {{ \n \t name = "{name}" \n \t comment = "{comment}" \n }} \n \n"""
 
-            # comment is an optional parameter
-            if comment == '':
-                tf_role = (f"""resource "snowflake_role" "{role}" {{ \n \t name = "{role}" \n }} \n \n""")
-            else:
-                tf_role = f"""resource "snowflake_role" "{role}" {{ \n \t name = "{role}" \n \t comment = "{comment}" \n }} \n \n"""
-
-            tf_roles.append(tf_role)
-
-        tf_roles_str = ''.join(tf_roles)
-
-        return tf_roles_str
 
+def user_block(user):
+    """ snowflake_user resource for one 'show users' row (dict) """
     
-    
-    def create_user_resource(self):
-        
-        sql = 'show users'
-        users_df = pd.read_sql(sql, self.conn)
-        
-        print("total users: ", len(users_df))
-
-        tf_users = []
-        for i in range(0, len(users_df)):
-            name = users_df['name'].values[i]
-            login_name = users_df['login_name'].values[i]
-            comment = users_df['comment'].values[i]
-            disabled = users_df['disabled'].values[i]
-            display_name = users_df['display_name'].values[i]
-            email = users_df['email'].values[i]
-            first_name = users_df['first_name'].values[i]
-            last_name = users_df['last_name'].values[i]
-            default_warehouse = users_df['default_warehouse'].values[i]
-            default_role = users_df['default_role'].values[i]
-            must_change_password = users_df['must_change_password'].values[i]
-
-            tf_user = f"""resource "snowflake_user" "{name}" {{ \n \
+    name = user['name']
+    login_name = user['login_name']
+    comment = user['comment']
+    disabled = user['disabled']
+    display_name = user['display_name']
+    email = user['email']
+    first_name = user['first_name']
+    last_name = user['last_name']
+    default_warehouse = user['default_warehouse']
+    default_role = user['default_role']
+    must_change_password = user['must_change_password']
+
+    return f"""resource "snowflake_user" "{name}" {{ \n \
                           name         = "{name}" \n \
                           login_name   = "{login_name}" \n \
                           comment      = "{comment}" \n \
@@ -86,68 +56,551 @@ class transcribe:
                           must_change_password = {must_change_password} \n }} \n \n"""
 
 
-            tf_users.append(tf_user)
+def role_grants_block(role, role_roles, role_users):
+    """ snowflake_role_grants resource for one role """
+    
+    role_users_str = "[ \n" + ", \n".join([f""" \t \t "${{ {unique_user} }}" """ for unique_user in role_users]) + " \n \t ]"
+    role_roles_str = "[ \n" + ", \n".join([f""" \t \t "${{ {unique_role} }}" """ for unique_role in role_roles]) + " \n \t ]"
 
-        tf_users_str = ''.join(tf_users)
+    return f"""resource "snowflake_role_grants" "{role}_grants" {{
+                    role_name = "${{snowflake.role.role.{role}}}"  \n
+                    roles = {role_roles_str} \n
+                    users = {role_users_str}  \n }}  \n \n"""
 
-        return tf_users_str
 
+def warehouse_block(warehouse):
+    """ snowflake_warehouse resource for one 'show warehouses' row (dict) """
     
+    name = warehouse['name']
     
-    def create_role_grants_resource(self):
-        sql = 'show roles'
-        roles_df = pd.read_sql(sql, self.conn)
-        
-        # get grants for all roles (also shows users)
-        grants_df = pd.DataFrame()
-        for i in range(0, len(roles_df)):
-            role = roles_df['name'].values[i]
-            sql = f'show grants of role "{role}"'
-            print(sql)
-            grant_df = pd.read_sql(sql, self.conn)
+    return f"""resource "snowflake_warehouse" "{name}" {{ \n \
+                          name           = "{name}" \n \
+                          warehouse_size = "{warehouse['size']}" \n \
+                          auto_suspend   = {warehouse['auto_suspend'] or 'null'} \n \
+                          auto_resume    = {warehouse['auto_resume']} \n \
+                          comment        = "{warehouse['comment'] or ''}" \n }} \n \n"""
 
-            grants_df = pd.concat([grant_df, grants_df], ignore_index=True)
-        
-        
-        tf_role_map = []
-        for i in range(0, len(grants_df['role'].unique())):
-            role = grants_df['role'].unique()[i]
-            print(role)
 
-            role_users = grants_df[(grants_df['role'] == role) & \
-                              (grants_df['granted_to'] == 'USER')]['grantee_name'].values.tolist()
-            role_roles = grants_df[(grants_df['role'] == role) & \
-                              (grants_df['granted_to'] == 'ROLE')]['grantee_name'].values.tolist()
+def database_block(database):
+    """ snowflake_database resource for one 'show databases' row (dict) """
+    
+    name = database['name']
+    
+    return f"""resource "snowflake_database" "{name}" {{ \n \
+                          name    = "{name}" \n \
+                          comment = "{database['comment'] or ''}" \n \
+                          data_retention_time_in_days = {database['retention_time'] or 0} \n }} \n \n"""
 
-            role_users_str = "[ \n" + ", \n".join([f""" \t \t "${{ {unique_user} }}" """ for unique_user in role_users]) + " \n \t ]"
-            role_roles_str = "[ \n" + ", \n".join([f""" \t \t "${{ {unique_role} }}" """ for unique_role in role_roles]) + " \n \t ]"
 
-            tf_grants = f"""resource "snowflake_role_grants" "{role}_grants" {{
-                    role_name = "${{snowflake.role.role.{role}}}"  \n
-                    roles = {role_roles_str} \n
-                    users = {role_users_str}  \n }}  \n \n"""
+def schema_block(schema):
+    """ snowflake_schema resource for one 'show schemas' row (dict) """
+    
+    database = schema['database_name']
+    name = schema['name']
+    
+    return f"""resource "snowflake_schema" "{database}_{name}" {{ \n \
+                          database = snowflake_database.{database}.name \n \
+                          name     = "{name}" \n \
+                          comment  = "{schema['comment'] or ''}" \n }} \n \n"""
+
+
+# resource kinds: terraform type, address name, renderer, and the row fields the resource is rendered from
+resource_kinds = {
+    'roles': ('snowflake_role', lambda row: row['name'], role_block, ['name', 'comment']),
+    'users': ('snowflake_user', lambda row: row['name'], user_block,
+              ['name', 'login_name', 'comment', 'disabled', 'display_name', 'email', 'first_name', 'last_name',
+               'default_warehouse', 'default_role', 'must_change_password']),
+    'role_grants': ('snowflake_role_grants', lambda row: f"{row['role']}_grants",
+                    lambda row: role_grants_block(row['role'], row['roles'], row['users']), ['role', 'roles', 'users']),
+    'warehouses': ('snowflake_warehouse', lambda row: row['name'], warehouse_block,
+                   ['name', 'size', 'auto_suspend', 'auto_resume', 'comment']),
+    'databases': ('snowflake_database', lambda row: row['name'], database_block, ['name', 'comment', 'retention_time']),
+    'schemas': ('snowflake_schema', lambda row: f"{row['database_name']}_{row['name']}", schema_block,
+                ['database_name', 'name', 'comment']),
+}
+
+
+def role_grants_row(role, grants):
+    """ role_grants row of a role's (role, granted_to, grantee_name) grants. grantees are sorted,
+        'show grants of role' doesn't return them in a fixed order
+    """
+    
+    return {'role': role,
+            'roles': sorted(grantee for _, granted_to, grantee in grants if granted_to == 'ROLE'),
+            'users': sorted(grantee for _, granted_to, grantee in grants if granted_to == 'USER')}
+
+
+def resource_address(kind, row):
+    resource_type, name, _, _ = resource_kinds[kind]
+    return f"{resource_type}.{name(row)}"
+
+
+def resource_hash(kind, row):
+    """ sha256 of the fields a resource is rendered from. fields that change on their own
+        (last login, owner, created_on, ...) don't change the hash
+    """
+    
+    fields = {field: row.get(field) for field in resource_kinds[kind][3]}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def load_resource_manifest(path):
+    """ {address: {'file': ..., 'sha256': ...}} of the last run, empty if there wasn't one """
+    
+    if not os.path.exists(path):
+        return {}
+    
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_resource_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def diff_resources(previous, manifest):
+    """ {'added': [...], 'changed': [...], 'removed': [...]} resource addresses between two manifests """
+    
+    return {'added': sorted(address for address in manifest if address not in previous),
+            'changed': sorted(address for address, entry in manifest.items()
+                              if address in previous and previous[address]['sha256'] != entry['sha256']),
+            'removed': sorted(address for address in previous if address not in manifest)}
+
+
+def shard_of(name, shards):
+    """ stable shard number of a resource name, so resources keep their shard as the account changes """
+    
+    return zlib.crc32(name.encode('utf-8')) % shards
+
+
+def render_shard(shard):
+    """ (file_name, text, addresses) for a (file_name, [(kind, row), ...]) shard.
+        Module level so shards can be rendered in a process pool
+    """
+    
+    file_name, resources = shard
+    blocks = []
+    addresses = []
+    for kind, row in resources:
+        blocks.append(resource_kinds[kind][2](row))
+        addresses.append(resource_address(kind, row))
+    
+    return file_name, "".join(blocks), addresses
+
+
+def write_resources(path, resources, previous):
+    """ Writes (kind, row) resources to path, only if one of them was added or changed since the
+        previous resource manifest, one of the file's resources is gone, or the file doesn't exist.
+        resources is called for each pass over the rows: a first pass only hashes them, and they are
+        read again to be rendered once there is a change, so no pass holds the rows in memory.
+        Returns ({address: {'file': ..., 'sha256': ...}}, written)
+    """
+    
+    file_name = os.path.basename(path)
+    entries = {}
+    changed = False
+    
+    for kind, row in resources():
+        address = resource_address(kind, row)
+        entries[address] = {'file': file_name, 'sha256': resource_hash(kind, row)}
+        if previous.get(address) != entries[address]:
+            changed = True
+            break
+    
+    if not changed:
+        removed = any(entry['file'] == file_name and address not in entries
+                      for address, entry in previous.items())
+        if not removed and os.path.exists(path):
+            return entries, False
+    
+    tmp_path = f"{path}.tmp"
+    entries = {}
+    
+    try:
+        with open(tmp_path, 'w') as f:
+            for kind, row in resources():
+                entries[resource_address(kind, row)] = {'file': file_name, 'sha256': resource_hash(kind, row)}
+                f.write(resource_kinds[kind][2](row))
+    
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    os.replace(tmp_path, path)
+    return entries, True
+
+
+def _file_part(name):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+
+class transcribe:
+    
+    def __init__(self, config_file, config_name = 'snowflake', conn_type = 'password', pool_size = 9,
+                 snapshot_dir = None, snapshot_ttl = 3600):
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+        
+        self.user = self.config[config_name]['user']
+        self.password = self.config[config_name].get('password')
+        self.account = self.config[config_name]['account']
+        
+        # show roles / users / grants results are kept locally for snapshot_ttl seconds,
+        # so a run from a warm snapshot doesn't connect at all
+        self.snapshot = snapshot_cache(snapshot_dir, snapshot_ttl) if snapshot_dir else None
+        
+        # role grant lookups borrow their own connections from the pool,
+        # the default size fits the 8 role grant workers + the main connection.
+        # connections are only opened once a query has to run
+        self.pool = connection_pool(config_file, config_name, conn_type, size = pool_size)
+        self.snapshot_source = source_key(self.pool.account, self.pool.user, self.pool.role)
+        self._conn = None
+        self._cur = None
+    
+    
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self.pool.acquire()
+        return self._conn
+    
+    
+    @property
+    def cur(self):
+        if self._cur is None:
+            self._cur = self.conn.cursor()
+        return self._cur
+      
+    
+    
+    def iter_rows(self, sql, batch_size = 1000):
+        """ Yields the rows of a query as dicts, fetching batch_size rows at a time.
+            With a snapshot_dir, a fresh snapshot is read instead of running the query
+        """
+        
+        if self.snapshot is not None:
+            table = self.snapshot.get_table(self.snapshot_source, sql)
+            if table is not None:
+                yield from table.to_pylist()
+                return
+        
+        # the snapshot is written batch by batch while the rows stream,
+        # and only kept if the result was read to the end
+        snapshot = self.snapshot.writer(self.snapshot_source, sql) if self.snapshot is not None else None
+        
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql)
+            columns = [col[0] for col in cur.description]
+            
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows = [dict(zip(columns, row)) for row in batch]
+                if snapshot is not None:
+                    snapshot.write_rows(rows)
+                yield from rows
+                
+            if snapshot is not None:
+                snapshot.commit()
+        finally:
+            cur.close()
+            if snapshot is not None:
+                snapshot.abort()
+    
+    
+    def iter_role_resources(self):
+        """ Yields a snowflake_role resource per role as rows arrive """
+        
+        total = 0
+        for role in self.iter_rows('show roles'):
+            total += 1
+            yield role_block(role)
+            
+        print("total roles: ", total)
+        
+        
+    def iter_user_resources(self):
+        """ Yields a snowflake_user resource per user as rows arrive """
+        
+        total = 0
+        for user in self.iter_rows('show users'):
+            total += 1
+            yield user_block(user)
+            
+        print("total users: ", total)
+        
+        
+    def iter_role_grants_resources(self, workers = 8):
+        """ Yields a snowflake_role_grants resource per role with grants """
+        
+        for row in self.iter_role_grants_rows(workers):
+            yield role_grants_block(row['role'], row['roles'], row['users'])
+        
+        
+    def iter_role_grants_rows(self, workers = 8):
+        """ Yields a {'role', 'roles', 'users'} row per role with grants.
+            'show grants of role' runs concurrently with at most 2 * workers roles in flight
+        """
+        
+        roles = (role['name'] for role in self.iter_rows('show roles'))
+        
+        total = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            
+            for role in roles:
+                in_flight.append((role, executor.submit(self._show_grants_of_role, role)))
+                if len(in_flight) >= 2 * workers:
+                    total += 1
+                    row = self._role_grants_row(*in_flight.popleft())
+                    if row:
+                        yield row
+                    
+            while in_flight:
+                total += 1
+                row = self._role_grants_row(*in_flight.popleft())
+                if row:
+                    yield row
+                    
+        print("total roles with grants checked: ", total)
+        
+        
+    def _role_grants_row(self, role, future):
+        # roles without any grants don't get a resource
+        grants = future.result()
+        if not grants:
+            return None
+        
+        return role_grants_row(role, grants)
+    
+    
+    def create_role_resource(self):
+        return ''.join(self.iter_role_resources())
 
-            tf_role_map.append(tf_grants)
+    
+    def create_user_resource(self):
+        return ''.join(self.iter_user_resources())
 
-        tf_users_str = ''.join(tf_role_map)
+    
+    def create_role_grants_resource(self, workers = 8):
+        return ''.join(self.iter_role_grants_resources(workers))
+    
+    
+    def _show_grants_of_role(self, role):
+        """ returns (role, granted_to, grantee_name) rows for one role """
+        
+        sql = f'show grants of role "{role}"'
+        if self.snapshot is not None:
+            table = self.snapshot.get_table(self.snapshot_source, sql)
+            if table is not None:
+                return [(row['role'], row['granted_to'], row['grantee_name']) for row in table.to_pylist()]
         
-        return tf_users_str
+        with self.pool.connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute(sql)
+                columns = [col[0] for col in cur.description]
+                role_i, granted_to_i, grantee_i = [columns.index(col) for col in ['role', 'granted_to', 'grantee_name']]
+                
+                grants = [(row[role_i], row[granted_to_i], row[grantee_i]) for row in cur.fetchall()]
+            finally:
+                cur.close()
+        
+        if self.snapshot is not None:
+            self.snapshot.put_rows(self.snapshot_source, sql, [{'role': role_, 'granted_to': granted_to, 'grantee_name': grantee}
+                                                       for role_, granted_to, grantee in grants])
+        return grants
 
         
     def close_conn(self):
-        self.conn.close()
+        if self._conn is not None:
+            self.pool.release(self._conn)
+            self._conn = None
+            self._cur = None
+        self.pool.close()
         return print("closed connection")
     
-    def generate_files(self):
-        tf_roles_all = self.create_role_resource()
-        with open('tf_roles.txt', 'w') as f:
-            f.write(tf_roles_all)
-        tf_users_all = self.create_user_resource()
-        with open('tf_users.txt', 'w') as f:
-            f.write(tf_users_all)
-        tf_grants_all = self.create_role_grants_resource()
-        with open('tf_grants.txt', 'w') as f:
-            f.write(tf_grants_all)
+    def generate_files(self, manifest_file = 'tf_manifest.json'):
+        """ Streams each resource to its file as it is rendered. manifest_file keeps a hash of the source
+            fields of every resource, a file is only rendered and rewritten when one of its resources
+            was added, changed or removed (see write_resources)
+            Returns {'added': [...], 'changed': [...], 'removed': [...]} resource addresses and 'written' files
+        """
+        
+        previous = load_resource_manifest(manifest_file)
+        
+        # callables, write_resources reads the rows a second time when a file has to be rendered
+        outputs = [('tf_roles.txt', lambda: (('roles', row) for row in self.iter_rows('show roles'))),
+                   ('tf_users.txt', lambda: (('users', row) for row in self.iter_rows('show users'))),
+                   ('tf_grants.txt', lambda: (('role_grants', row) for row in self.iter_role_grants_rows()))]
+        
+        manifest = {}
+        written = []
+        for file_name, resources in outputs:
+            entries, file_written = write_resources(file_name, resources, previous)
+            manifest.update(entries)
+            if file_written:
+                written.append(file_name)
+        
+        report = diff_resources(previous, manifest)
+        report['written'] = written
+        if manifest != previous:
+            save_resource_manifest(manifest_file, manifest)
+        
+        print(f"resources added: {len(report['added'])}, changed: {len(report['changed'])}, "
+              f"removed: {len(report['removed'])}, files written: {len(written)}")
+        
+        return report
+    
+    
+    def collect_shards(self, shards = 16, workers = 8):
+        """ Reads the account and groups its resources into shard files:
+            - roles, users, role grants and warehouses by a stable hash of the name, shards files per kind
+            - one file per database with the database and its schemas
+            Returns {file_name: [(kind, row), ...]}, resources sorted by address within a file
+        """
+        
+        grouped = {}
+        
+        def add(file_name, kind, row):
+            grouped.setdefault(file_name, []).append((kind, row))
+        
+        roles = list(self.iter_rows('show roles'))
+        for role in roles:
+            add(f"roles_{shard_of(role['name'], shards):03d}.tf", 'roles', role)
+            
+        for user in self.iter_rows('show users'):
+            add(f"users_{shard_of(user['name'], shards):03d}.tf", 'users', user)
+            
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            role_names = [role['name'] for role in roles]
+            for role, grants in zip(role_names, executor.map(self._show_grants_of_role, role_names)):
+                # roles without any grants don't get a resource
+                if not grants:
+                    continue
+                add(f"role_grants_{shard_of(role, shards):03d}.tf", 'role_grants', role_grants_row(role, grants))
+        
+        for warehouse in self.iter_rows('show warehouses'):
+            add(f"warehouses_{shard_of(warehouse['name'], shards):03d}.tf", 'warehouses', warehouse)
+        
+        # same databases as transcribe_account: no snowflake databases and no shares
+        databases = set()
+        for database in self.iter_rows('show databases'):
+            if database['name'] in ('SNOWFLAKE', 'SNOWFLAKE_SAMPLE_DATA') or database['origin']:
+                continue
+            databases.add(database['name'])
+            add(f"database_{_file_part(database['name'])}.tf", 'databases', database)
+            
+        for schema in self.iter_rows('show schemas in account'):
+            if schema['database_name'] in databases and schema['name'] != 'INFORMATION_SCHEMA':
+                add(f"database_{_file_part(schema['database_name'])}.tf", 'schemas', schema)
+        
+        return {file_name: sorted(resources, key=lambda resource: resource_address(*resource))
+                for file_name, resources in sorted(grouped.items())}
+    
+    
+    def generate_sharded_files(self, directory = 'terraform', shards = 16, processes = None, workers = 8,
+                               index_file = 'tf_index.json', manifest_file = 'tf_manifest.json'):
+        """ Writes the resources as sharded .tf files (see collect_shards), rendered in a process pool,
+            and a resource index: the file of every resource address and the sha256 of every shard.
+            manifest_file keeps a hash of the source fields of every resource, only shards with an added,
+            changed or removed resource are rendered and rewritten. Shards that are gone are removed.
+            Returns {'written': [...], 'unchanged': [...], 'removed': [...]} files
+            and {'added': [...], 'changed': [...], 'removed_resources': [...]} resource addresses
+        """
+        
+        os.makedirs(directory, exist_ok = True)
+        index_path = os.path.join(directory, index_file)
+        manifest_path = os.path.join(directory, manifest_file)
+        
+        previous = {'resources': {}, 'shards': {}}
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                previous = json.load(f)
+        previous_manifest = load_resource_manifest(manifest_path)
+        
+        collected = self.collect_shards(shards, workers)
+        kinds = {file_name: resources[0][0] for file_name, resources in collected.items()}
+        
+        manifest = {resource_address(kind, row): {'file': file_name, 'sha256': resource_hash(kind, row)}
+                    for file_name, resources in collected.items() for kind, row in resources}
+        
+        # the addresses each shard had, a shard with the same addresses and hashes is left alone
+        previous_addresses = {}
+        for address, entry in previous_manifest.items():
+            previous_addresses.setdefault(entry['file'], set()).add(address)
+        
+        def changed(file_name, resources):
+            addresses = [resource_address(kind, row) for kind, row in resources]
+            return (file_name not in previous['shards']
+                    or not os.path.exists(os.path.join(directory, file_name))
+                    or set(addresses) != previous_addresses.get(file_name, set())
+                    or any(previous_manifest[address] != manifest[address] for address in addresses))
+        
+        dirty = {file_name: resources for file_name, resources in collected.items() if changed(file_name, resources)}
+        
+        index = {'resources': {}, 'shards': {}}
+        report = {'written': [], 'unchanged': [], 'removed': []}
+        
+        for file_name in collected:
+            if file_name not in dirty:
+                index['shards'][file_name] = previous['shards'][file_name]
+                report['unchanged'].append(file_name)
+        
+        # a run without changes doesn't start the process pool
+        with ProcessPoolExecutor(max_workers=processes) if dirty else nullcontext() as executor:
+            rendered = executor.map(render_shard, dirty.items()) if dirty else []
+            for file_name, text, addresses in rendered:
+                digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+                path = os.path.join(directory, file_name)
+                
+                if previous['shards'].get(file_name, {}).get('sha256') == digest and os.path.exists(path):
+                    report['unchanged'].append(file_name)
+                else:
+                    tmp_path = f"{path}.tmp"
+                    with open(tmp_path, 'w') as f:
+                        f.write(text)
+                    os.replace(tmp_path, path)
+                    report['written'].append(file_name)
+                
+                index['shards'][file_name] = {'kind': kinds[file_name], 'sha256': digest, 'resources': len(addresses)}
+        
+        for address, entry in manifest.items():
+            index['resources'][address] = entry['file']
+        
+        for file_name in previous['shards']:
+            if file_name not in index['shards']:
+                path = os.path.join(directory, file_name)
+                if os.path.exists(path):
+                    os.remove(path)
+                report['removed'].append(file_name)
+        
+        # sorted keys, so the index only changes when the resources do
+        if index != previous:
+            tmp_path = f"{index_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, index_path)
+        
+        resources = diff_resources(previous_manifest, manifest)
+        report.update({'added': resources['added'], 'changed': resources['changed'],
+                       'removed_resources': resources['removed']})
+        if manifest != previous_manifest:
+            save_resource_manifest(manifest_path, manifest)
+        
+        print(f"shards written: {len(report['written'])}, unchanged: {len(report['unchanged'])}, "
+              f"removed: {len(report['removed'])}")
+        print(f"resources added: {len(report['added'])}, changed: {len(report['changed'])}, "
+              f"removed: {len(report['removed_resources'])}")
+        
+        return report
 
 
 """
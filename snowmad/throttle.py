@@ -0,0 +1,245 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import snowflake.connector
+
+
+# error codes that went away on a retry: lock waits, statement / queue timeouts and canceled statements
+retryable_errnos = {604, 625, 630, 1304, 2031, 90064}
+
+# connection / request failures of the connector and expired sessions, retried on a new connection
+connection_errnos = {250001, 250002, 250003, 251005, 251006, 390114}
+
+# canceled or timed out statements, serialization failures. class 08 (connection exceptions) is added below
+retryable_sqlstates = {'57014', '40001'}
+
+
+def is_connection_error(error):
+    """ True if the connection the error came from shouldn't be used again """
+
+    if isinstance(error, (snowflake.connector.errors.OperationalError, snowflake.connector.errors.InterfaceError,
+                          ConnectionError)):
+        return True
+
+    return getattr(error, 'errno', None) in connection_errnos or \
+           str(getattr(error, 'sqlstate', None) or '').startswith('08')
+
+
+def is_retryable(error):
+    """ True for connector errors that are worth retrying (throttling, timeouts, lost connections),
+        False for permanent ones (syntax, missing objects, privileges).
+        Errors are told apart by type, errno and sqlstate only: messages quote object names
+        and sql, which can contain any word
+    """
+
+    if is_connection_error(error) or isinstance(error, TimeoutError):
+        return True
+
+    return getattr(error, 'errno', None) in retryable_errnos or \
+           getattr(error, 'sqlstate', None) in retryable_sqlstates
+
+
+
+class write_controller:
+    """
+    Sends statements to the target account with retries and an adaptive number of statements in flight
+
+    Attributes:
+        min_concurrency : int
+            the limit never drops below this
+        max_concurrency : int
+            the limit never grows above this. the target connection pool should be at least as large
+        initial_concurrency : int
+            statements in flight at the start
+        max_retries : int
+            retries per statement for retryable errors, see is_retryable
+        base_delay : float
+            seconds of the first backoff. each retry doubles it, with full jitter
+        max_delay : float
+            longest backoff in seconds
+        target_latency : float
+            statements slower than this count as congestion. by default latency_factor
+            times the lowest smoothed latency seen
+        latency_factor : float
+            see target_latency
+
+    The limit is adjusted AIMD style: every limit successful statements below the target latency
+    raise it by one, a retryable error or a slow statement halves it (at most once per smoothed latency),
+    so throughput settles just below what the account accepts.
+    """
+
+    def __init__(self,
+                 min_concurrency = 1,
+                 max_concurrency = 32,
+                 initial_concurrency = 4,
+                 max_retries = 5,
+                 base_delay = 0.5,
+                 max_delay = 30.0,
+                 target_latency = None,
+                 latency_factor = 3.0):
+
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.target_latency = target_latency
+        self.latency_factor = latency_factor
+
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.stats = {'statements': 0, 'failed': 0, 'retries': 0, 'decreases': 0}
+
+        self._in_flight = 0
+        self._latency = None
+        self._lowest_latency = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+
+    def _acquire(self):
+        with self._cond:
+            while self._in_flight >= max(int(self.limit), self.min_concurrency):
+                self._cond.wait()
+            self._in_flight += 1
+
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+
+    def _on_success(self, seconds):
+        with self._cond:
+            self.stats['statements'] += 1
+
+            # smoothed latency, and the best it has been as the uncongested baseline
+            self._latency = seconds if self._latency is None else 0.8 * self._latency + 0.2 * seconds
+            self._lowest_latency = self._latency if self._lowest_latency is None \
+                                   else min(self._lowest_latency, self._latency)
+
+            target = self.target_latency or self._lowest_latency * self.latency_factor
+            if seconds > target:
+                self._decrease()
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+    def _on_retry(self):
+        with self._cond:
+            self.stats['retries'] += 1
+            self._decrease()
+
+
+    def _decrease(self):
+        # one decrease per round trip, the statements already in flight saw the same congestion
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or 0.0):
+            return
+
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        self.stats['decreases'] += 1
+
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+    def execute_one(self, sql, cursor, return_sql = False, return_errors = True, metrics = None, step = None,
+                    errors = None, reconnect = None):
+        """ Executes one statement, retrying retryable errors. Returns True if it succeeded.
+            errors gets (sql, error) if it didn't.
+            reconnect: returns a cursor on a new connection, to retry on after a connection error.
+            without it connection errors aren't retried, the connection that failed isn't used again
+        """
+
+        for attempt in range(self.max_retries + 1):
+            start = time.time()
+            try:
+                if return_sql:
+                    print("Executing: ", sql)
+                cursor.execute(sql)
+
+            except Exception as error:
+                connection_lost = is_connection_error(error)
+                retry = is_retryable(error) and attempt < self.max_retries and \
+                        (reconnect is not None or not connection_lost)
+
+                # retried attempts aren't counted as statements, the last attempt is
+                if metrics is not None:
+                    metrics.record(step, sql, start, time.time() - start, getattr(error, 'sfqid', None), error,
+                                   statements = 0 if retry else 1)
+
+                if retry:
+                    self._on_retry()
+                    time.sleep(self.backoff(attempt))
+                    if connection_lost:
+                        try:
+                            cursor = reconnect()
+                        except Exception:
+                            # the next attempt fails on the closed connection and reconnects again
+                            pass
+                    continue
+
+                with self._cond:
+                    self.stats['failed'] += 1
+                if errors is not None:
+                    errors.append((sql, error))
+                if return_errors:
+                    print(error)
+                    print(f"Could not execute: {sql}")
+                return False
+
+            seconds = time.time() - start
+            if metrics is not None:
+                metrics.record(step, sql, start, seconds, cursor.sfqid)
+            self._on_success(seconds)
+            return True
+
+
+    def execute_sql_list(self, sql_list, pool = None, cursor = None, return_sql = False, return_errors = True,
+                         metrics = None, step = None, errors = None):
+        """ Executes sql_list with retries
+            - pool: statements run concurrently (up to the current limit), each on a connection
+              borrowed from the pool. only for statements that don't depend on each other
+            - cursor: statements run one at a time in order on cursor. connection errors
+              aren't retried here, there's no other connection to retry on
+            Returns the number of statements that succeeded, errors gets (sql, error) of the others
+        """
+
+        if pool is None:
+            return sum(self.execute_one(sql, cursor, return_sql, return_errors, metrics, step, errors)
+                       for sql in sql_list)
+
+        def worker(sql):
+            self._acquire()
+            held = []
+
+            def connect():
+                conn = pool.acquire()
+                held.append((conn, conn.cursor()))
+                return held[-1][1]
+
+            def reconnect():
+                # the connection that failed isn't returned to the pool
+                if held:
+                    pool.invalidate(held.pop()[0])
+                return connect()
+
+            try:
+                return self.execute_one(sql, connect(), return_sql, return_errors, metrics, step, errors, reconnect)
+            finally:
+                if held:
+                    conn, cur = held.pop()
+                    try:
+                        cur.close()
+                    finally:
+                        pool.release(conn)
+                self._release()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return sum(executor.map(worker, sql_list))
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_snowflake import fake_connection, fake_snowflake, synthetic_account
+
+from snowmad import aio
+from snowmad.metrics import statement_metrics
+
+
+@pytest.fixture
+def account():
+    return synthetic_account(roles = 20, users = 10, grants = 60, databases = 2, tables = 4)
+
+
+def test_query_polls_until_the_query_is_done(account):
+    conn = fake_connection(account, latency = 0.01)
+
+    df = asyncio.run(aio.fetch_data_df('show roles', conn))
+
+    assert df['name'].tolist() == account.roles
+    # submit, at least one poll that finds it running and one that finds it done, the results
+    assert conn.requests >= 4
+
+
+def test_execute_sql_list_skips_failed_statements(account):
+    conn = fake_connection(account, latency = 0.01)
+    sql_list = [f'create role if not exists "R{i}"' for i in range(8)]
+    account.failing.add(sql_list[3])
+    metrics = statement_metrics()
+
+    asyncio.run(aio.execute_sql_list(sql_list, conn, concurrency = 4, metrics = metrics, step = 'roles'))
+
+    assert conn.queries == 8
+    assert metrics.summary()['roles']['statements'] == 8
+    assert metrics.summary()['roles']['failed'] == 1
+    assert [record.sql for record in metrics.records if record.status == 'failed'] == [sql_list[3]]
+
+
+def test_copy_roles_to_several_targets(account, tmp_path):
+    config_file = str(tmp_path / 'snowflake.config')
+    with open(config_file, 'w') as f:
+        for name, account_name in [('snowflake_source_account', 'source'), ('target_a', 'a'), ('target_b', 'b')]:
+            f.write(f"[{name}]\nuser = u\npassword = p\naccount = {account_name}\n\n")
+
+    async def copy_roles():
+        async with aio.async_transcribe_account(config_file, target_config_names = ['target_a', 'target_b'],
+                                                conn_type_target = 'password', return_sql = False) as copy:
+            return await copy.roles(), copy.source_conn, copy.target_conns
+
+    with fake_snowflake(account, latency = 0.005):
+        statements, source_conn, target_conns = asyncio.run(copy_roles())
+
+    assert statements == len(account.roles)
+    assert source_conn.queries == 1
+    assert [conn.queries for conn in target_conns.values()] == [len(account.roles)] * 2
@@ -0,0 +1,101 @@
+import pandas as pd
+import pytest
+
+from snowmad.data_copy import table_copy, table_tasks, partition_sql, checksum_sql, copy_task
+from snowmad.local import local_connection, local_pool, write_pandas
+
+
+def rows_frame(rows):
+    return pd.DataFrame({'ID': range(rows),
+                         'NAME': [f"name_{i}" for i in range(rows)],
+                         'AMOUNT': [i * 1.5 for i in range(rows)]})
+
+
+@pytest.fixture
+def accounts():
+    """ a source with DB.PUBLIC.ORDERS, and a target with the same table holding other rows """
+
+    source = local_pool(local_connection(), account='source')
+    target = local_pool(local_connection(), account='target')
+
+    source.conn.create_table('DB', 'PUBLIC', 'ORDERS', rows_frame(1000))
+    target.conn.create_table('DB', 'PUBLIC', 'ORDERS', rows_frame(1000).iloc[::7] * 2)
+
+    yield source, target
+
+    source.close()
+    target.close()
+
+
+def test_table_tasks_partitions_large_tables():
+    tasks = table_tasks([('DB', 'PUBLIC', 'SMALL', 10), ('DB', 'PUBLIC', 'EMPTY', None),
+                         ('DB', 'PUBLIC', 'LARGE', 250)], partition_rows = 100)
+
+    assert [(task.table, task.partition, task.partitions) for task in tasks] == \
+        [('SMALL', 0, 1), ('EMPTY', 0, 1), ('LARGE', 0, 3), ('LARGE', 1, 3), ('LARGE', 2, 3)]
+
+
+def test_partition_sql():
+    assert partition_sql(copy_task('DB', 'PUBLIC', 'T', 0, 1), ['A']) == 'select * from "DB"."PUBLIC"."T"'
+    assert partition_sql(copy_task('DB', 'PUBLIC', 'T', 2, 4), ['A', 'B"C']) == \
+        'select * from "DB"."PUBLIC"."T" where mod(abs(hash("A", "B""C")), 4) = 2'
+
+
+def test_checksum_sql():
+    assert checksum_sql('DB', 'PUBLIC', 'T', ['A', 'B']) == 'select count(*), hash_agg("A", "B") from "DB"."PUBLIC"."T"'
+
+
+def test_copy_truncates_and_verifies(accounts):
+    source, target = accounts
+
+    results = table_copy(source, target, load = write_pandas).copy([('DB', 'PUBLIC', 'ORDERS', 1000)])
+
+    assert results['DB.PUBLIC.ORDERS']['status'] == 'copied'
+    assert results['DB.PUBLIC.ORDERS']['verified']
+    assert results['DB.PUBLIC.ORDERS']['rows'] == 1000
+    pd.testing.assert_frame_equal(target.conn.table('DB', 'PUBLIC', 'ORDERS').sort_values('ID', ignore_index = True),
+                                  rows_frame(1000))
+
+
+def test_partitioned_copy_copies_every_row_once(accounts):
+    source, target = accounts
+
+    results = table_copy(source, target, load = write_pandas, workers = 3, partition_rows = 300) \
+        .copy([('DB', 'PUBLIC', 'ORDERS', 1000)])
+
+    assert results['DB.PUBLIC.ORDERS']['verified']
+    assert results['DB.PUBLIC.ORDERS']['rows'] == 1000
+    assert sorted(target.conn.table('DB', 'PUBLIC', 'ORDERS')['ID']) == list(range(1000))
+
+
+def test_copy_without_truncate_is_a_mismatch(accounts):
+    source, target = accounts
+
+    results = table_copy(source, target, load = write_pandas).copy([('DB', 'PUBLIC', 'ORDERS', 1000)], truncate = False)
+
+    assert results['DB.PUBLIC.ORDERS']['status'] == 'mismatch'
+    assert results['DB.PUBLIC.ORDERS']['target_rows'] > results['DB.PUBLIC.ORDERS']['source_rows']
+
+
+def test_checksum_catches_changed_rows(accounts):
+    source, target = accounts
+
+    def load_changed(conn, df, table_name, **kwargs):
+        # same row count, one value changed
+        df = df.copy()
+        df.loc[df.index[0], 'NAME'] = 'changed'
+        return write_pandas(conn, df, table_name, **kwargs)
+
+    results = table_copy(source, target, load = load_changed).copy([('DB', 'PUBLIC', 'ORDERS', 1000)])
+
+    assert results['DB.PUBLIC.ORDERS']['source_rows'] == results['DB.PUBLIC.ORDERS']['target_rows']
+    assert not results['DB.PUBLIC.ORDERS']['verified']
+    assert results['DB.PUBLIC.ORDERS']['status'] == 'mismatch'
+
+
+def test_missing_table_fails(accounts):
+    source, target = accounts
+
+    results = table_copy(source, target, load = write_pandas).copy([('DB', 'PUBLIC', 'MISSING', 10)])
+
+    assert results['DB.PUBLIC.MISSING']['status'] == 'failed'
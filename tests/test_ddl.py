@@ -0,0 +1,58 @@
+import pytest
+
+from snowmad.ddl import ddl_filter, split_statements, statement_kind
+
+
+def test_split_statements():
+    text = """
+        create table A (ID number);
+        create view V as select ';' as S, "a;b" from A; -- trailing; comment
+        create procedure P() returns string language javascript as $$ return 'x;y'; $$;
+        /* block; comment */ create table B (ID number)
+    """
+
+    assert [" ".join(statement.split()) for statement in split_statements(text)] == [
+        'create table A (ID number)',
+        'create view V as select \';\' as S, "a;b" from A',
+        "-- trailing; comment create procedure P() returns string language javascript as $$ return 'x;y'; $$",
+        '/* block; comment */ create table B (ID number)',
+    ]
+
+
+def test_split_statements_unterminated_string_runs_to_the_end():
+    assert list(split_statements("select 'a;b")) == ["select 'a;b"]
+
+
+@pytest.mark.parametrize('statement, kind', [
+    ('create or replace TABLE DB.PUBLIC.T (ID NUMBER)', 'TABLE'),
+    ('create or replace transient table T (ID NUMBER)', 'TABLE'),
+    ('CREATE OR REPLACE SECURE MATERIALIZED   VIEW V AS select 1', 'MATERIALIZED VIEW'),
+    ('create file format F type = csv', 'FILE FORMAT'),
+    ('-- comment\ncreate masking policy M as (val string) returns string -> val', 'MASKING POLICY'),
+    ('alter table T add column C number', None),
+])
+def test_statement_kind(statement, kind):
+    assert statement_kind(statement) == kind
+
+
+def test_default_filter_leaves_out_dependent_objects():
+    text = """
+        create or replace schema DB.PUBLIC;
+        create or replace TABLE DB.PUBLIC.A (ID NUMBER);
+        create or replace TABLE DB.PUBLIC.B (ID NUMBER references DB.PUBLIC.A (ID));
+        create or replace view DB.PUBLIC.V as select * from A;
+        create or replace sequence DB.PUBLIC.S;
+        alter table DB.PUBLIC.A add column C number;
+    """
+
+    assert ddl_filter().filter(text) == ['create or replace schema DB.PUBLIC',
+                                         'create or replace TABLE DB.PUBLIC.A (ID NUMBER)',
+                                         'create or replace sequence DB.PUBLIC.S']
+
+
+def test_filter_allow_kinds_and_patterns():
+    text = "create table A (ID number); create table TMP_B (ID number); create sequence S;"
+
+    kept = ddl_filter(allow_kinds = ['table'], ignore_patterns = [r"\btmp_"]).filter(text)
+
+    assert kept == ['create table A (ID number)']
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_snowflake import fake_snowflake, synthetic_account
+
+from snowmad.fanout import fan_out_account
+
+
+def test_target_names_with_dots(tmp_path):
+    config_file = str(tmp_path / 'snowflake.config')
+    with open(config_file, 'w') as f:
+        for name, account_name in [('snowflake_source_account', 'source'), ('prod', 'prod'), ('prod.dr', 'dr')]:
+            f.write(f"[{name}]\nuser = u\npassword = p\naccount = {account_name}\n\n")
+    account = synthetic_account(roles = 10, users = 5, grants = 0, databases = 0, tables = 0)
+
+    with fake_snowflake(account):
+        fan_out = fan_out_account(config_file, ['prod', 'prod.dr'], conn_type_target = 'password')
+        fan_out.copy_account(['roles', 'users'])
+        fan_out.close()
+
+    for name in ['prod', 'prod.dr']:
+        report = fan_out.target_reports[name]
+        assert report['status'] == 'done'
+        assert report['steps']['roles']['statements'] == 10
+        assert report['steps']['users']['statements'] == 5
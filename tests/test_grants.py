@@ -0,0 +1,44 @@
+import pandas as pd
+
+from snowmad.grants import grant_diff, grant_key, object_grant_keys, object_names, revoke_sql, role_grant_keys
+
+
+def object_grants_frame():
+    return pd.DataFrame({'PRIVILEGE': ['SELECT', 'USAGE', 'USAGE', 'OWNERSHIP'],
+                         'GRANTED_ON': ['TABLE', 'SCHEMA', 'WAREHOUSE', 'VIEW'],
+                         'NAME': ['T', 'PUBLIC', 'WH', 'V'],
+                         'TABLE_SCHEMA': ['PUBLIC', None, None, 'PUBLIC'],
+                         'TABLE_CATALOG': ['DB', 'DB', None, 'DB'],
+                         'GRANTEE_NAME': ['ANALYST', 'ANALYST', 'ANALYST', 'SYSADMIN']})
+
+
+def test_object_names():
+    assert object_names(object_grants_frame()) == ['DB.PUBLIC.T', 'DB.PUBLIC', 'WH', 'DB.PUBLIC.V']
+
+
+def test_object_grant_keys():
+    assert object_grant_keys(object_grants_frame())[0] == grant_key('SELECT', 'TABLE', 'DB.PUBLIC.T', 'ROLE', 'ANALYST')
+
+
+def test_revoke_sql_leaves_out_ownership():
+    keys = object_grant_keys(object_grants_frame()) + [grant_key('USAGE', 'ROLE', 'ANALYST', 'USER', 'ALICE')]
+
+    assert revoke_sql(keys) == ['REVOKE SELECT ON TABLE DB.PUBLIC.T FROM ROLE ANALYST;',
+                                'REVOKE USAGE ON SCHEMA DB.PUBLIC FROM ROLE ANALYST;',
+                                'REVOKE USAGE ON WAREHOUSE WH FROM ROLE ANALYST;',
+                                'REVOKE ROLE "ANALYST" FROM USER "ALICE";']
+
+
+def test_grant_diff_missing_and_extra():
+    df_roles = pd.DataFrame({'NAME': ['ANALYST', 'LOADER'], 'GRANTEE_NAME': ['SYSADMIN', 'SYSADMIN']})
+    keys = role_grant_keys(df_roles)
+
+    target_keys = [keys[0],
+                   grant_key('USAGE', 'ROLE', 'OLD_ROLE', 'ROLE', 'ANALYST'),
+                   grant_key('USAGE', 'ROLE', 'SYSADMIN', 'ROLE', 'ACCOUNTADMIN'),
+                   grant_key('SELECT', 'TABLE', 'DB.PUBLIC.T', 'ROLE', 'PUBLIC')]
+    diff = grant_diff(target_keys)
+
+    assert diff.missing(df_roles, keys)['NAME'].tolist() == ['LOADER']
+    # grants to or of system roles are never revoked
+    assert diff.extra() == [grant_key('USAGE', 'ROLE', 'OLD_ROLE', 'ROLE', 'ANALYST')]
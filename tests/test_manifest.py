@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from snowmad.manifest import ddl_hash, replication_manifest, utc_timestamp
+from snowmad.snowflake import user_sql
+
+
+def test_ddl_hash_ignores_whitespace():
+    assert ddl_hash("create role  A\n") == ddl_hash("create role A")
+    assert ddl_hash("create role A") != ddl_hash("create role B")
+
+
+def test_utc_timestamp():
+    assert utc_timestamp('2024-03-10 01:30:00-08:00') == pd.Timestamp('2024-03-10 09:30:00', tz='UTC')
+    assert utc_timestamp('2024-03-10 09:30:00') == pd.Timestamp('2024-03-10 09:30:00', tz='UTC')
+
+
+def test_diff_and_record(tmp_path):
+    manifest = replication_manifest(str(tmp_path / 'manifest.json'))
+
+    assert manifest.diff('ROLE', 'A', 'create role A') == 'new'
+    manifest.record('ROLE', 'A', 'create role A')
+    assert manifest.diff('ROLE', 'A', 'create  role A') is None
+    assert manifest.diff('ROLE', 'A', 'create role A comment = \'x\'') == 'changed'
+
+
+def test_is_stale_compares_across_offsets(tmp_path):
+    manifest = replication_manifest(str(tmp_path / 'manifest.json'))
+    manifest.record('DATABASE', 'DB', 'create database DB', last_altered = '2024-11-03 01:30:00-07:00')
+
+    # the same instant in another offset, then a later one that sorts lower as a string
+    assert not manifest.is_stale('DATABASE', 'DB', '2024-11-03 08:30:00+00:00')
+    assert manifest.is_stale('DATABASE', 'DB', '2024-11-03 01:10:00-08:00')
+    assert manifest.is_stale('DATABASE', 'OTHER', '2024-11-03 08:30:00+00:00')
+
+
+def test_watermarks_only_move_forward(tmp_path):
+    manifest = replication_manifest(str(tmp_path / 'manifest.json'), overlap_hours = 3)
+
+    assert manifest.watermark('roles') is None
+    manifest.advance('roles', '2024-01-01 12:00:00+00:00')
+    manifest.advance('roles', '2024-01-01 06:00:00-05:00')
+    manifest.advance('roles', None)
+
+    assert manifest.watermark('roles') == '2024-01-01 09:00:00+00:00'
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = replication_manifest(path)
+    manifest.record('SCHEMA', 'DB.PUBLIC', 'ddl', statements = ['create table A (ID number)'])
+    manifest.advance('roles', '2024-01-01 12:00:00')
+    manifest.save()
+
+    loaded = replication_manifest(path)
+
+    assert loaded.get('SCHEMA', 'DB.PUBLIC')['statements'] == [ddl_hash('create table A (ID number)')]
+    assert loaded.watermarks == manifest.watermarks
+
+
+@pytest.mark.parametrize('email, alter_sql', [
+    ('a@example.com', ("""ALTER USER "A" SET login_name='a'   email='a@example.com'""",
+                       """ALTER USER "A" UNSET display_name, default_role""")),
+    (None, ("""ALTER USER "A" SET login_name='a'""", """ALTER USER "A" UNSET display_name, default_role, email""")),
+])
+def test_user_sql_unsets_null_properties(email, alter_sql):
+    df_users = pd.DataFrame({'NAME': ['A'], 'LOGIN_NAME': ['a'], 'DISPLAY_NAME': [None],
+                             'DEFAULT_ROLE': [float('nan')], 'EMAIL': [email]})
+
+    create_sql, alter_list = user_sql(df_users)
+
+    assert [" ".join(sql.split()) for sql in alter_list[0]] == [" ".join(sql.split()) for sql in alter_sql]
+    assert " ".join(create_sql[0].split()) == " ".join(f"""CREATE OR REPLACE USER "A" password='abc123'
+                                                             {alter_sql[0][len('ALTER USER "A" SET '):]}""".split())
@@ -0,0 +1,151 @@
+import os
+import sys
+
+import snowflake.connector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_snowflake import fake_snowflake, synthetic_account
+
+from snowmad import ddl
+from snowmad.metrics import statement_metrics
+from snowmad.snowflake import execute_sql_list, transcribe_account
+
+
+class batch_cursor:
+    """ runs multi statement requests like snowflake: statements run in order up to the first
+        one that fails, and every child query shows up in the session's query history.
+        The session has no current database, so information_schema has to be qualified.
+        With interleave, a query of another cursor of the session lands after every statement
+    """
+
+    def __init__(self, fail = (), history = True, interleave = False):
+        self.fail = set(fail)
+        self.history_available = history
+        self.interleave = interleave
+        self.executed = []
+        self.history = []
+        self.sfqid = None
+        self._rows = []
+
+    def _query(self, sql, status):
+        self.sfqid = f"q{len(self.history)}"
+        self.history.append((self.sfqid, sql, status, 5))
+        if self.interleave:
+            self.history.append((f"other{len(self.history)}", 'grant role R1 to role SYSADMIN', 'SUCCESS', 5))
+        return self.sfqid
+
+    def execute(self, sql, num_statements = None):
+        if 'query_history_by_session' in sql:
+            if not self.history_available:
+                raise snowflake.connector.errors.ProgrammingError(msg = 'not authorized')
+            if 'snowflake.information_schema' not in sql.lower():
+                raise snowflake.connector.errors.ProgrammingError(
+                    msg = 'Cannot perform SELECT. This session does not have a current database.')
+            self._rows = list(self.history)
+            return self
+
+        parent = self._query(sql, 'RUNNING') if num_statements else None
+        for statement in sql.split(";\n") if num_statements else [sql]:
+            if statement in self.fail:
+                self._query(statement, 'FAILED_WITH_ERROR')
+                raise snowflake.connector.errors.ProgrammingError(msg = f"cannot run {statement}",
+                                                                  sfqid = parent or self.sfqid)
+            self._query(statement, 'SUCCESS')
+            self.executed.append(statement)
+        return self
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+def test_batch_resumes_after_the_failed_statement():
+    sql_list = [f"create role R{i}" for i in range(10)]
+    cursor = batch_cursor(fail = ['create role R3', 'create role R8'])
+    metrics = statement_metrics()
+    errors = []
+
+    execute_sql_list(sql_list, cursor, batch_size = 5, metrics = metrics, step = 'roles', errors = errors)
+
+    # every statement is sent once
+    assert cursor.executed == [sql for sql in sql_list if sql not in cursor.fail]
+    assert [sql for sql, _ in errors] == ['create role R3', 'create role R8']
+    assert metrics.summary()['roles']['statements'] == 10
+    assert metrics.summary()['roles']['failed'] == 2
+
+
+def test_batch_resumes_with_other_queries_in_between():
+    sql_list = [f"create role R{i}" for i in range(6)]
+    cursor = batch_cursor(fail = ['create role R2'], interleave = True)
+    errors = []
+
+    execute_sql_list(sql_list, cursor, batch_size = 6, errors = errors)
+
+    assert cursor.executed == [sql for sql in sql_list if sql != 'create role R2']
+    assert [sql for sql, _ in errors] == ['create role R2']
+
+
+def test_batch_without_query_history_runs_statements_one_at_a_time():
+    sql_list = [f"create role R{i}" for i in range(4)]
+    cursor = batch_cursor(fail = ['create role R2'], history = False)
+    errors = []
+
+    execute_sql_list(sql_list, cursor, batch_size = 4, errors = errors)
+
+    assert [sql for sql, _ in errors] == ['create role R2']
+    assert cursor.executed == ['create role R0', 'create role R1', 'create role R0', 'create role R1', 'create role R3']
+
+
+class ddl_cursor:
+
+    def __init__(self, ddl):
+        self.ddl = ddl
+        self.executed = []
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        return self
+
+    def fetchone(self):
+        return (self.ddl,)
+
+    def close(self):
+        pass
+
+
+def test_schema_ddl_quotes_the_schema_name():
+    account = transcribe_account.__new__(transcribe_account)
+    account.ddl_filter = ddl.ddl_filter()
+    account.manifest = None
+    sent = []
+    account._execute = lambda step, sql_list, cursor = None, unit = None, errors = None: sent.extend(sql_list)
+    cursor = ddl_cursor('create or replace schema "Sales"."Q1 ""draft""";\ncreate or replace table "Sales"."Q1 ""draft""".T (ID number);')
+
+    class source_conn:
+        def cursor(self):
+            return cursor
+
+    assert account._schema_ddl('Sales', 'Q1 "draft"\'s', source_conn(), None) == (2, 0)
+    assert cursor.executed == ["""select get_ddl('schema', '"Sales"."Q1 ""draft""''s"', true)"""]
+
+
+def test_resume_reports_only_the_statements_it_sent(tmp_path):
+    config_file = str(tmp_path / 'snowflake.config')
+    with open(config_file, 'w') as f:
+        for name, account_name in [('snowflake_source_account', 'source'), ('snowflake_target_account', 'target')]:
+            f.write(f"[{name}]\nuser = u\npassword = p\naccount = {account_name}\n\n")
+    account = synthetic_account(roles = 10, users = 0, grants = 0, databases = 0, tables = 0)
+
+    with fake_snowflake(account):
+        copy = transcribe_account(config_file, conn_type_target = 'password', return_sql = False,
+                                  journal_file = str(tmp_path / 'journal'))
+        copy.copy_account(['roles'])
+        assert copy.step_report['roles']['statements'] == 10
+
+        account.roles += ['NEW_A', 'NEW_B']
+        copy.resume(['roles'])
+        copy.close()
+
+    assert copy.step_report['roles']['statements'] == 2
+    assert copy.resumed_statements['roles'] == 10
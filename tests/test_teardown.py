@@ -0,0 +1,120 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_snowflake import fake_snowflake, synthetic_account
+
+from snowmad.snowflake import transcribe_account
+from snowmad.teardown import drop_plan, teardown, teardown_tier, teardown_tiers
+
+
+@pytest.mark.parametrize('sql, tier', [
+    ('REVOKE ROLE "A" FROM USER "B";', 'grants'),
+    ('  drop user if exists "B";', 'users_roles'),
+    ('DROP ROLE IF EXISTS "A";', 'users_roles'),
+    ('drop database if exists "DB";', 'databases_warehouses'),
+    ('drop warehouse if exists WH;', 'databases_warehouses'),
+    ('drop schema if exists DB.S;', 'databases_warehouses'),
+])
+def test_teardown_tier(sql, tier):
+    assert teardown_tier(sql) == tier
+
+
+def test_drop_plan_deduplicates_and_removes():
+    plan = drop_plan()
+    plan.add(['drop role A;', 'drop database DB;', 'drop role A;', 'revoke role A from user U;'])
+    plan.add(['drop role A;', 'drop role B;'])
+
+    assert plan.tiers == {'grants': ['revoke role A from user U;'],
+                          'users_roles': ['drop role A;', 'drop role B;'],
+                          'databases_warehouses': ['drop database DB;']}
+
+    plan.remove(['drop role A;'])
+    plan.add(['drop role A;'])
+    assert plan.tiers['users_roles'] == ['drop role B;', 'drop role A;']
+    assert len(plan) == 4
+
+
+def test_drop_plan_save_and_load(tmp_path):
+    path = str(tmp_path / 'drop_plan.json')
+    plan = drop_plan()
+    plan.add(['drop role A;', 'drop database DB;'])
+    plan.save(path)
+
+    assert drop_plan.load(path).tiers == plan.tiers
+
+
+class recording_pool:
+    """ connection pool whose cursors record the statements, failing the ones in fail """
+
+    def __init__(self, fail = ()):
+        self.executed = []
+        self.fail = set(fail)
+        pool = self
+
+        class cursor:
+            sfqid = None
+
+            def execute(self, sql):
+                if sql in pool.fail:
+                    raise RuntimeError(f"cannot execute {sql}")
+                pool.executed.append(sql)
+
+            def close(self):
+                pass
+
+        class connection:
+            def cursor(self):
+                return cursor()
+
+        self.conn = connection()
+
+    def connection(self):
+        pool = self
+
+        class context:
+            def __enter__(self):
+                return pool.conn
+
+            def __exit__(self, *exc):
+                return False
+
+        return context()
+
+
+def test_teardown_runs_tiers_in_order_and_keeps_failures(tmp_path):
+    path = str(tmp_path / 'drop_plan.json')
+    plan = drop_plan()
+    plan.add(['drop database DB;', 'drop role A;', 'revoke role A from user U;', 'drop role B;'])
+    pool = recording_pool(fail = ['drop role B;'])
+
+    report = teardown(pool, workers = 2).run(plan, path)
+
+    tiers = [teardown_tier(sql) for sql in pool.executed]
+    assert tiers == sorted(tiers, key = teardown_tiers.index)
+    assert report['users_roles'] == {'statements': 1, 'failed': 1, 'seconds': report['users_roles']['seconds']}
+    # only the failed drop is left to run again
+    assert drop_plan.load(path).tiers == {'grants': [], 'users_roles': ['drop role B;'], 'databases_warehouses': []}
+
+
+def test_drop_objects_runs_on_a_pool_of_workers_connections(tmp_path):
+    config_file = str(tmp_path / 'snowflake.config')
+    with open(config_file, 'w') as f:
+        for name, account_name in [('snowflake_source_account', 'source'), ('snowflake_target_account', 'target')]:
+            f.write(f"[{name}]\nuser = u\npassword = p\naccount = {account_name}\n\n")
+    account = synthetic_account(roles = 40, users = 0, grants = 0, databases = 0, tables = 0)
+
+    with fake_snowflake(account, latency = 0.01) as connections:
+        # the copy steps share a pool of workers + 1 = 2 connections
+        copy = transcribe_account(config_file, conn_type_target = 'password', return_sql = False)
+        copy.roles()
+        opened = len(connections)
+        report = copy.drop_objects('roles', workers = 4)
+        copy.close()
+
+    assert report['users_roles']['statements'] == len(account.roles)
+    assert report['users_roles']['failed'] == 0
+    assert len(connections) - opened == 4
@@ -0,0 +1,54 @@
+import os
+
+from snowmad.terraform import write_resources
+
+
+class role_rows:
+    """ resources callable over 'show roles' rows, counting the passes over them """
+
+    def __init__(self, names):
+        self.rows = [{'name': name, 'comment': ''} for name in names]
+        self.passes = 0
+
+    def __call__(self):
+        self.passes += 1
+        return (('roles', row) for row in self.rows)
+
+
+def test_unchanged_file_is_hashed_but_not_written(tmp_path):
+    path = str(tmp_path / 'tf_roles.txt')
+    entries, written = write_resources(path, role_rows(['A', 'B', 'C']), {})
+    assert written
+    mtime = os.stat(path).st_mtime_ns
+
+    resources = role_rows(['A', 'B', 'C'])
+    assert write_resources(path, resources, entries) == (entries, False)
+    assert resources.passes == 1
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_changed_row_reads_the_rows_again_to_write_the_file(tmp_path):
+    path = str(tmp_path / 'tf_roles.txt')
+    previous, _ = write_resources(path, role_rows(['A', 'B', 'C']), {})
+
+    resources = role_rows(['A', 'B', 'C'])
+    resources.rows[1]['comment'] = 'changed'
+    entries, written = write_resources(path, resources, previous)
+
+    assert written
+    assert resources.passes == 2
+    assert list(entries) == list(previous)
+    assert entries['snowflake_role.B'] != previous['snowflake_role.B']
+    with open(path) as f:
+        assert f.read().count('resource "snowflake_role"') == 3
+
+
+def test_removed_row_rewrites_the_file(tmp_path):
+    path = str(tmp_path / 'tf_roles.txt')
+    previous, _ = write_resources(path, role_rows(['A', 'B', 'C']), {})
+
+    entries, written = write_resources(path, role_rows(['A', 'C']), previous)
+
+    assert written
+    assert list(entries) == ['snowflake_role.A', 'snowflake_role.C']
+    assert not os.path.exists(f"{path}.tmp")